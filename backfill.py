@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging as log
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, cast, column, insert, select, update, values
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from blaauw.core import database, history, models
+from blaauw.core.backfill import (
+    BACKFILLS,
+    ROW_COLUMNS,
+    Row,
+    compute_batch,
+    needs_header,
+    sort_backfills,
+    updated_columns,
+)
+from blaauw.core.coverage import CoverageMaps
+
+_raw = models.Observation.__table__
+_header = models.ObservationHeader.__table__
+
+
+def fetch_batch(
+    conn: Connection, last_id: int, batch_size: int, with_header: bool
+) -> List[Row]:
+    """
+    Fetches the next batch of rows after `last_id` (keyset pagination), such that
+    every batch is an index scan on the primary key, no matter how far we are.
+    """
+    columns = [_raw.c[name] for name in ROW_COLUMNS]
+    if with_header:
+        stmt = select(*columns, _header.c.header).select_from(
+            _raw.outerjoin(_header, _header.c.observation_id == _raw.c.id)
+        )
+    else:
+        stmt = select(*columns)
+    stmt = stmt.where(_raw.c.id > last_id).order_by(_raw.c.id).limit(batch_size)
+
+    rows = [dict(r._mapping) for r in conn.execute(stmt)]
+    if not with_header:
+        for row in rows:
+            row["header"] = None
+    return rows
+
+
+def write_batch(
+    conn: Connection,
+    columns: Sequence[str],
+    updates: List[Tuple[Any, ...]],
+    run_id: int,
+    coverage: Optional[CoverageMaps] = None,
+) -> int:
+    """
+    Writes the updated values of the rows which changed, like the ingest does:
+    with their new content_hash, their changed fields in the history (run
+    `run_id`) and their new versions in the `coverage` maps (if given). The rows
+    are written with a single statement (one per row in SQLite):
+        UPDATE blaauw.raw SET ... FROM (VALUES ...) AS v WHERE raw.id = v.id
+    Returns the number of changed rows.
+    """
+    new_values = {u[0]: dict(zip(columns, u[1:])) for u in updates}
+    old_rows = conn.execute(select(_raw).where(_raw.c.id.in_(new_values.keys())))
+    old_values = []
+    new_rows = []
+    history_rows = []
+    for old in old_rows:
+        old = old._mapping
+        new = {**old, **new_values[old["id"]]}
+        entries = history.change_entries(old, new, run_id)
+        if len(entries) == 0:
+            continue
+        new["content_hash"] = history.content_hash(new)
+        old_values.append(old)
+        new_rows.append(new)
+        history_rows += entries
+
+    if len(new_rows) == 0:
+        return 0
+
+    written = [*columns, "content_hash"]
+    if conn.dialect.name == "sqlite":
+        # No column names for a VALUES list in SQLite, so one UPDATE per row
+        stmt = (
+            update(_raw)
+            .where(_raw.c.id == bindparam("b_id"))
+            .values({name: bindparam(f"b_{name}") for name in written})
+        )
+        conn.execute(
+            stmt,
+            [{f"b_{name}": row[name] for name in ["id", *written]} for row in new_rows],
+        )
+    else:
+        v = values(
+            column("id", _raw.c.id.type),
+            *(column(name, _raw.c[name].type) for name in written),
+            name="v",
+        ).data([tuple(row[name] for name in ["id", *written]) for row in new_rows])
+        stmt = (
+            update(_raw)
+            .where(_raw.c.id == v.c.id)
+            .values({name: cast(v.c[name], _raw.c[name].type) for name in written})
+        )
+        conn.execute(stmt)
+    conn.execute(insert(models.ObservationHistory), history_rows)
+    if coverage is not None:
+        coverage.replace(old_values, new_rows)
+    return len(new_rows)
+
+
+def load_state(state_file: Path, names: Sequence[str]) -> int:
+    """
+    Returns the last id that was processed by a previous run with the same
+    backfills, 0 when starting from scratch.
+    """
+    if not state_file.exists():
+        return 0
+
+    with open(state_file) as f:
+        state = json.load(f)
+    if state["backfills"] != list(names):
+        log.error(
+            f"State file {state_file} belongs to backfills {state['backfills']}, use --restart or another --state"
+        )
+        exit(1)
+    return state["last_id"]
+
+
+def save_state(state_file: Path, names: Sequence[str], last_id: int) -> None:
+    tmp = state_file.with_name(f".{state_file.name}.tmp")
+    with open(tmp, "w") as f:
+        json.dump({"backfills": list(names), "last_id": last_id}, f)
+    os.replace(tmp, state_file)
+
+
+def main(args: argparse.Namespace):
+    names = sort_backfills(args.backfill)
+    columns = updated_columns(names)
+    with_header = needs_header(names)
+    state_file = Path(args.state)
+
+    last_id = 0 if args.restart else load_state(state_file, names)
+    log.info(f"Backfilling {', '.join(columns)} starting after id {last_id}")
+
+    engine = database.get_engine(args.dsn, echo=args.echo)
+    with Session(engine) as session:
+        run = models.IngestRun(source=f"backfill {' '.join(names)}")
+        session.add(run)
+        session.commit()
+        run_id = run.id
+    log.info(f"- Ingest run {run_id}")
+
+    coverage = None
+    if args.coverage:
+        coverage_file = Path(args.coverage).resolve()
+        coverage = CoverageMaps.load(coverage_file)
+        if coverage is None:
+            log.info(f"- No valid coverage maps in {coverage_file}, rebuilding")
+            coverage = CoverageMaps.from_table(engine)
+        # The maps are only saved at the end, until then the file does not match
+        # the table. Without it, the next run rebuilds them (e.g. after a crash).
+        coverage_file.unlink(missing_ok=True)
+
+    num_rows = 0
+    num_changed = 0
+    num_skipped = 0
+    start_time = time.perf_counter()
+    # Batches are written in the order they were read, so the saved last id
+    # always means that everything before it is done
+    pending: deque = deque()
+    exhausted = False
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        while True:
+            while not exhausted and len(pending) < 2 * args.workers:
+                with engine.connect() as conn:
+                    rows = fetch_batch(conn, last_id, args.batch_size, with_header)
+                if len(rows) == 0:
+                    exhausted = True
+                    break
+                last_id = rows[-1]["id"]
+                future = pool.submit(compute_batch, names, rows)
+                pending.append((last_id, len(rows), future))
+
+            if len(pending) == 0:
+                break
+
+            batch_last_id, batch_size, future = pending.popleft()
+            updates = future.result()
+            if len(updates) > 0:
+                with engine.begin() as conn:
+                    num_changed += write_batch(
+                        conn, columns, updates, run_id, coverage=coverage
+                    )
+            save_state(state_file, names, batch_last_id)
+
+            num_rows += len(updates)
+            num_skipped += batch_size - len(updates)
+            log.debug(f"Computed {num_rows} rows (up to id {batch_last_id})")
+
+            # Throttle, to not hog the live database
+            if args.rate is not None:
+                ahead = num_rows / args.rate - (time.perf_counter() - start_time)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+    if coverage is not None:
+        coverage.save(coverage_file)
+
+    duration = time.perf_counter() - start_time
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+    log.info(f"- Computed {num_rows} rows in {duration:.1f}s, {num_changed} changed")
+    if num_skipped > 0:
+        log.info(f"- Skipped {num_skipped} rows without a stored header")
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+
+
+def parse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "backfill",
+        nargs="+",
+        choices=list(BACKFILLS.keys()),
+        help="The derived columns to recompute.",
+    )
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of worker processes computing the values.",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        help="Maximum number of rows updated per second. Default is no limit.",
+    )
+    parser.add_argument(
+        "--state",
+        type=str,
+        default="backfill-state.json",
+        help="File in which the progress is stored, a rerun continues from there.",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Ignore the progress of a previous run and start from the beginning.",
+    )
+    parser.add_argument(
+        "--coverage",
+        type=str,
+        help="File with the sky coverage maps (see sky_coverage.py), which are updated with the changed rows.",
+    )
+    parser.add_argument(
+        "--dsn",
+        type=str,
+        help="Database to connect to. Default is $BLAAUW_DSN, or the server/local database.",
+    )
+    parser.add_argument("--echo", action="store_true")
+    parser.add_argument("--debug", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse()
+    if args.debug:
+        log.basicConfig(level=log.DEBUG)
+    else:
+        log.basicConfig(level=log.INFO)
+    main(args)
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import math
+import re
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Tuple
+
+# Lines of the COMMENT block written by Astrometry.net, e.g.
+#   scale: 0.519436 arcsec/pix
+#   log odds: 54.6875
+#   parity: neg
+#   index id: 4107
+#   Field width: 2048 pixels
+# All of them are matched in a single pass over the block. Depending on the version
+# the parity is an integer (e.g. "Parity: 1") of which the meaning differs between
+# versions, only pos and neg are kept and otherwise it comes from the CD matrix.
+# Rows ingested before get the parity with the astrometry backfill (backfill.py).
+SOLUTION_RE = re.compile(
+    r"^\s*(?:"
+    r"scale:\s*(?P<scale>\S+)\s+arcsec/pix"
+    r"|odds:\s*(?P<odds>\S+)"
+    r"|log odds:\s*(?P<log_odds>\S+)"
+    r"|parity:\s*(?P<parity>\S+)"
+    r"|index id:\s*(?P<index_id>\d+)"
+    r"|index name:\s*(?P<index_name>\S+)"
+    r"|field width:\s*(?P<width>\d+)\s+pixels"
+    r"|field height:\s*(?P<height>\d+)\s+pixels"
+    r"|field rotation angle: up is\s*(?P<rotation>\S+)\s+degrees E of N"
+    r")",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+class AstrometrySolution(NamedTuple):
+    scale: Optional[float] = None  # arcsec/pixel
+    odds: Optional[float] = None
+    log_odds: Optional[float] = None
+    field_width: Optional[float] = None  # arcmin
+    field_height: Optional[float] = None  # arcmin
+    rotation: Optional[float] = None  # degrees east of north of the image up
+    parity: Optional[str] = None  # pos or neg, the sign of the CD determinant
+    index_id: Optional[int] = None
+    index_name: Optional[str] = None
+
+
+def _float(value: str) -> Optional[float]:
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _cd_matrix(header: Dict[str, Any]) -> Optional[Tuple[float, float, float, float]]:
+    try:
+        return (
+            float(header["CD1_1"]),
+            float(header["CD1_2"]),
+            float(header["CD2_1"]),
+            float(header["CD2_2"]),
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _parity(value: Any) -> Optional[str]:
+    """The parity as pos or neg, None for other values (e.g. integers)."""
+    value = str(value).lower() if value is not None else None
+    return value if value in ("pos", "neg") else None
+
+
+def cd_parity(header: Dict[str, Any]) -> Optional[str]:
+    """The parity from the CD matrix: pos for a positive determinant, else neg."""
+    cd = _cd_matrix(header)
+    if cd is None:
+        return None
+    cd11, cd12, cd21, cd22 = cd
+    return "pos" if cd11 * cd22 - cd12 * cd21 >= 0 else "neg"
+
+
+def cd_rotation(header: Dict[str, Any]) -> Optional[float]:
+    """
+    The rotation (up, degrees east of north) from the CD matrix, computed like
+    Astrometry.net does (tan_get_orientation).
+    """
+    cd = _cd_matrix(header)
+    if cd is None:
+        return None
+    cd11, cd12, cd21, cd22 = cd
+    parity = 1.0 if cd11 * cd22 - cd12 * cd21 >= 0 else -1.0
+    return -math.degrees(math.atan2(parity * cd21 - cd12, parity * cd11 + cd22))
+
+
+def _field_size(
+    scale: Optional[float], header: Dict[str, Any], keys: Tuple[str, ...]
+) -> Optional[float]:
+    """The size (arcmin) of the image along the axis given by its size `keys`."""
+    pixels = next((header[k] for k in keys if header.get(k) is not None), None)
+    if scale is None or pixels is None:
+        return None
+    size = _float(str(pixels))
+    return size * scale / 60 if size is not None else None
+
+
+def _complete(values: Dict[str, Any], header: Dict[str, Any]) -> AstrometrySolution:
+    """
+    Fills in the field size, rotation and parity from the rest of the header
+    (image size and CD matrix), when they are not known yet.
+    """
+    if values.get("field_width") is None:
+        values["field_width"] = _field_size(
+            values.get("scale"), header, ("IMAGEW", "NAXIS1")
+        )
+    if values.get("field_height") is None:
+        values["field_height"] = _field_size(
+            values.get("scale"), header, ("IMAGEH", "NAXIS2")
+        )
+    if values.get("rotation") is None:
+        values["rotation"] = cd_rotation(header)
+    values["parity"] = _parity(values.get("parity"))
+    if values["parity"] is None:
+        values["parity"] = cd_parity(header)
+    return AstrometrySolution(**values)
+
+
+def parse_solution(
+    comments: Iterable[str], header: Optional[Dict[str, Any]] = None
+) -> Optional[AstrometrySolution]:
+    """
+    Extracts the Astrometry.net solution from the COMMENT lines. The field size
+    (in arcmin) is computed from the scale and the image size in pixels, taken
+    from the `header` (IMAGEW/IMAGEH or NAXIS1/NAXIS2) if not in the comments.
+    The rotation and parity are computed from the CD matrix in the header when
+    not given.
+
+    Returns None when no solution is found (i.e. no scale or odds).
+    """
+    found: Dict[str, str] = {}
+    for match in SOLUTION_RE.finditer("\n".join(str(c) for c in comments)):
+        # The first occurrence wins (e.g. the index id of the matching quad)
+        for key, value in match.groupdict().items():
+            if value is not None and key not in found:
+                found[key] = value
+
+    if "scale" not in found and "odds" not in found:
+        return None
+
+    header = dict(header) if header is not None else {}
+    # The image size in the comments takes precedence
+    if "width" in found:
+        header["IMAGEW"] = found["width"]
+    if "height" in found:
+        header["IMAGEH"] = found["height"]
+
+    values = {
+        "scale": _float(found["scale"]) if "scale" in found else None,
+        "odds": _float(found["odds"]) if "odds" in found else None,
+        "log_odds": _float(found["log_odds"]) if "log_odds" in found else None,
+        "rotation": _float(found["rotation"]) if "rotation" in found else None,
+        "parity": found.get("parity"),
+        "index_id": int(found["index_id"]) if "index_id" in found else None,
+        "index_name": found.get("index_name"),
+    }
+    return _complete(values, header)
+
+
+# Keys under which the solution is stored in the crawled header dicts. PLATE_SCALE
+# and ODDS are kept from earlier crawls, the others are prefixed to not clash with
+# keywords of the instruments.
+SOLUTION_KEYS = {
+    "scale": "PLATE_SCALE",
+    "odds": "ODDS",
+    "log_odds": "AN_LOGODDS",
+    "field_width": "AN_FIELDW",
+    "field_height": "AN_FIELDH",
+    "rotation": "AN_ROTATION",
+    "parity": "AN_PARITY",
+    "index_id": "AN_INDEXID",
+    "index_name": "AN_INDEX",
+}
+
+
+def solution_to_dict(solution: AstrometrySolution) -> Dict[str, Any]:
+    """The header keys of the solution, without the missing values."""
+    return {
+        SOLUTION_KEYS[field]: value
+        for field, value in solution._asdict().items()
+        if value is not None
+    }
+
+
+def solution_from_dict(header: Dict[str, Any]) -> Optional[AstrometrySolution]:
+    """
+    The solution stored in a crawled header dict (see solution_to_dict). For
+    headers of earlier crawls, which only have the PLATE_SCALE and ODDS, the
+    field size and rotation are computed from the rest of the header.
+    """
+    if header.get("PLATE_SCALE") is None and header.get("ODDS") is None:
+        return None
+    values = {field: header.get(key) for field, key in SOLUTION_KEYS.items()}
+    return _complete(values, header)
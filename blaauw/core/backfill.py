@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import astropy.units as u
+import numpy as np
+from astropy.coordinates import AltAz, SkyCoord
+from astropy.time import Time
+
+from blaauw.core import astrometry, models, paths, transformers
+
+# A row of the raw table (see ROW_COLUMNS) with the full header under "header"
+Row = Dict[str, Any]
+
+# Columns of the raw table which are fetched for the computations
+ROW_COLUMNS = ("id", "filename", "file_id", "date_obs", "ra", "dec", "telescope")
+
+
+def _header(row: Row) -> dict:
+    return row["header"] if row["header"] is not None else {}
+
+
+def compute_file_id(rows: List[Row]) -> None:
+    """
+    Recomputes the file_id from the filename, for rows ingested before the stem
+    handling of transformers.path_to_file_id was corrected (e.g. the old one gave
+    'er_flat_sloan' for 'master_flat_sloan_r'). Without it, re-ingesting such a
+    file inserts a second row for the same filename. Rows of which the path is not
+    known (anymore) keep their file_id.
+    """
+    for row in rows:
+        file_id = transformers.path_to_file_id(row["filename"])
+        if file_id is not None:
+            row["file_id"] = file_id
+
+
+def compute_image_type(rows: List[Row]) -> None:
+    for row in rows:
+        header = _header(row)
+        row["image_type"] = transformers.imtyp_to_enum(
+            header.get("IMAGETYP", None),
+            filter=header.get("FILTER", None),
+            obj=header.get("OBJECT", None),
+        )
+
+
+def compute_telescope(rows: List[Row]) -> None:
+    """
+    The telescope from the root of the path. Rows of which the path is not known
+    (anymore) keep their telescope, the column cannot be NULL.
+    """
+    for row in rows:
+        telescope = models.Telescope.from_path(row["filename"])
+        if telescope is not None:
+            row["telescope"] = telescope
+
+
+def compute_equatorial(rows: List[Row]) -> None:
+    """
+    Same as transformers.get_equitorial, but converts all the sexagesimal telescope
+    coordinates of the batch at once.
+    """
+    to_convert = []
+    for row in rows:
+        header = _header(row)
+        if "CRVAL1" in header and "CRVAL2" in header:
+            row["ra"], row["dec"] = header["CRVAL1"], header["CRVAL2"]
+        elif "OBJCTRA" in header and "OBJCTDEC" in header:
+            to_convert.append(row)
+        else:
+            row["ra"], row["dec"] = None, None
+
+    if len(to_convert) == 0:
+        return
+
+    coord = SkyCoord(
+        [_header(row)["OBJCTRA"] for row in to_convert],
+        [_header(row)["OBJCTDEC"] for row in to_convert],
+        unit=(u.hourangle, u.deg),
+    )
+    for row, ra, dec in zip(to_convert, coord.ra.degree, coord.dec.degree):
+        row["ra"], row["dec"] = float(ra), float(dec)
+
+
+def compute_horizontal(rows: List[Row]) -> None:
+    """
+    Same as in insert.create_observation: the alt-az coordinates and airmass are
+    computed from the ra/dec if available, otherwise taken from the header. The
+    transformation is done once per telescope for the entire batch.
+    """
+    per_telescope: Dict[models.Telescope, List[Row]] = {}
+    for row in rows:
+        if row["ra"] is not None and row["dec"] is not None and row["telescope"]:
+            per_telescope.setdefault(row["telescope"], []).append(row)
+        else:
+            header = _header(row)
+            row["alt"], row["az"] = transformers.get_horizontal(header)
+            row["airmass"] = header.get("AIRMASS", None)
+
+    for telescope, tel_rows in per_telescope.items():
+        coord = SkyCoord(
+            np.array([row["ra"] for row in tel_rows]),
+            np.array([row["dec"] for row in tel_rows]),
+            obstime=Time([row["date_obs"] for row in tel_rows], scale="utc"),
+            unit="deg",
+        )
+        horizontal_frame = coord.transform_to(AltAz(location=telescope.location()))
+        for row, alt, az, airmass in zip(
+            tel_rows,
+            horizontal_frame.alt.deg,
+            horizontal_frame.az.deg,
+            horizontal_frame.secz.value,
+        ):
+            row["alt"], row["az"], row["airmass"] = float(alt), float(az), float(airmass)
+
+
+def compute_astrometry(rows: List[Row]) -> None:
+    """
+    The Astrometry.net solution of the astrometry frames, from the values the
+    crawler stored in the header (see astrometry.solution_from_dict). This is
+    also how rows ingested before the parity was derived from the CD matrix get
+    it: `python3 backfill.py astrometry`.
+    """
+    for row in rows:
+        solution = None
+        info = paths.classify(row["filename"])
+        if info is not None and info.root == "ASTROM_GBT":
+            solution = astrometry.solution_from_dict(_header(row))
+        if solution is None:
+            solution = astrometry.AstrometrySolution()
+        row["plate_scale"] = solution.scale
+        row["astrometry_odds"] = solution.odds
+        row["astrometry_log_odds"] = solution.log_odds
+        row["field_width"] = solution.field_width
+        row["field_height"] = solution.field_height
+        row["rotation"] = solution.rotation
+        row["parity"] = solution.parity
+        row["astrometry_index"] = solution.index_id
+
+
+# name -> (updated columns, needs the full header, computation)
+# The order matters: later computations use the updated values of earlier ones
+BACKFILLS: Dict[str, Tuple[Tuple[str, ...], bool, Callable[[List[Row]], None]]] = {
+    "file_id": (("file_id",), False, compute_file_id),
+    "telescope": (("telescope",), False, compute_telescope),
+    "image_type": (("image_type",), True, compute_image_type),
+    "equatorial": (("ra", "dec"), True, compute_equatorial),
+    "horizontal": (("alt", "az", "airmass"), True, compute_horizontal),
+    "astrometry": (
+        (
+            "plate_scale",
+            "astrometry_odds",
+            "astrometry_log_odds",
+            "field_width",
+            "field_height",
+            "rotation",
+            "parity",
+            "astrometry_index",
+        ),
+        True,
+        compute_astrometry,
+    ),
+}
+
+
+def sort_backfills(names: Sequence[str]) -> List[str]:
+    """
+    Puts the selected backfills in the order in which they have to be computed.
+    """
+    return [name for name in BACKFILLS if name in names]
+
+
+def updated_columns(names: Sequence[str]) -> List[str]:
+    return [col for name in sort_backfills(names) for col in BACKFILLS[name][0]]
+
+
+def needs_header(names: Sequence[str]) -> bool:
+    return any(BACKFILLS[name][1] for name in names)
+
+
+def compute_batch(
+    names: Sequence[str], rows: List[Row]
+) -> List[Tuple[Optional[Any], ...]]:
+    """
+    Runs the selected backfills on a batch of rows. Returns the tuples
+    (id, *updated_columns) which should be written back to the database.
+
+    When a backfill needs the full header, rows without a stored header (e.g.
+    ingested before the headers were stored) are left out, as their values cannot
+    be derived and would otherwise be overwritten with NULL.
+    """
+    if needs_header(names):
+        rows = [row for row in rows if row["header"] is not None]
+    for name in sort_backfills(names):
+        BACKFILLS[name][2](rows)
+
+    columns = updated_columns(names)
+    return [tuple([row["id"]] + [row[col] for col in columns]) for row in rows]
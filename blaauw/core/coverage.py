@@ -0,0 +1,302 @@
+from __future__ import annotations
+
+import enum
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from blaauw.core import models
+
+# Increase when the layout of the file changes, it then has to be rebuilt
+COVERAGE_VERSION = 1
+# HEALPix order (nside = 2**order) of the maps, 8 gives pixels of ~0.23 degrees
+COVERAGE_ORDER = 8
+# Rows of the raw table read at once when building the maps from it
+BATCH_SIZE = 10000
+
+# (telescope, filter, image type), "" when not known
+MapKey = Tuple[str, str, str]
+# Sorted pixels (nested scheme) with their number of frames and exposure time (s)
+SparseMap = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+# Position of the base faces, as in the HEALPix library
+_JRLL = np.array([2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4])
+_JPLL = np.array([1, 3, 5, 7, 0, 2, 4, 6, 1, 3, 5, 7])
+
+
+def num_pixels(order: int) -> int:
+    return 12 * 4**order
+
+
+def _spread_bits(v: np.ndarray, order: int) -> np.ndarray:
+    result = np.zeros_like(v)
+    for bit in range(order):
+        result |= ((v >> bit) & 1) << (2 * bit)
+    return result
+
+
+def _compress_bits(v: np.ndarray, order: int) -> np.ndarray:
+    result = np.zeros_like(v)
+    for bit in range(order):
+        result |= ((v >> (2 * bit)) & 1) << bit
+    return result
+
+
+def radec_to_pixel(order: int, ra: np.ndarray, dec: np.ndarray) -> np.ndarray:
+    """
+    The HEALPix pixels (nested scheme) of the positions in degrees, vectorized
+    version of ang2pix of the HEALPix library.
+    """
+    nside = 2**order
+    z = np.sin(np.radians(np.asarray(dec, dtype=float)))
+    za = np.abs(z)
+    tt = np.mod(np.asarray(ra, dtype=float), 360.0) / 90.0  # in [0, 4)
+
+    # Equatorial region
+    temp1 = nside * (0.5 + tt)
+    temp2 = nside * z * 0.75
+    jp = (temp1 - temp2).astype(np.int64)  # index of the ascending edge line
+    jm = (temp1 + temp2).astype(np.int64)  # index of the descending edge line
+    ifp = jp >> order
+    ifm = jm >> order
+    eq_face = np.where(ifp == ifm, ifp | 4, np.where(ifp < ifm, ifp, ifm + 8))
+    eq_x = jm & (nside - 1)
+    eq_y = nside - (jp & (nside - 1)) - 1
+
+    # Polar caps
+    ntt = np.minimum(tt.astype(np.int64), 3)
+    tp = tt - ntt
+    tmp = nside * np.sqrt(3 * (1 - za))
+    pjp = np.minimum((tp * tmp).astype(np.int64), nside - 1)
+    pjm = np.minimum(((1 - tp) * tmp).astype(np.int64), nside - 1)
+    north = z >= 0
+    polar_face = np.where(north, ntt, ntt + 8)
+    polar_x = np.where(north, nside - pjm - 1, pjp)
+    polar_y = np.where(north, nside - pjp - 1, pjm)
+
+    equatorial = za <= 2 / 3
+    face = np.where(equatorial, eq_face, polar_face)
+    x = np.where(equatorial, eq_x, polar_x)
+    y = np.where(equatorial, eq_y, polar_y)
+    return face * nside**2 + _spread_bits(x, order) + (_spread_bits(y, order) << 1)
+
+
+def pixel_to_radec(order: int, pixels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """The centers (degrees) of the pixels (nested scheme), see pix2ang of HEALPix."""
+    nside = 2**order
+    npface = nside**2
+    pixels = np.asarray(pixels, dtype=np.int64)
+    face = pixels // npface
+    x = _compress_bits(pixels % npface, order)
+    y = _compress_bits((pixels % npface) >> 1, order)
+
+    jr = _JRLL[face] * nside - x - y - 1
+    nr = np.where(jr < nside, jr, np.where(jr > 3 * nside, 4 * nside - jr, nside))
+    z = np.where(
+        jr < nside,
+        1 - nr**2 / (3 * npface),
+        np.where(
+            jr > 3 * nside,
+            nr**2 / (3 * npface) - 1,
+            (2 * nside - jr) * 2 / (3 * nside),
+        ),
+    )
+    kshift = np.where((jr >= nside) & (jr <= 3 * nside), (jr - nside) & 1, 0)
+
+    jp = (_JPLL[face] * nr + x - y + 1 + kshift) // 2
+    jp = np.where(jp > 4 * nside, jp - 4 * nside, jp)
+    jp = np.where(jp < 1, jp + 4 * nside, jp)
+    ra = (jp - (kshift + 1) * 0.5) * (90.0 / nr)
+    return ra, np.degrees(np.arcsin(np.clip(z, -1, 1)))
+
+
+def _name(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, enum.Enum):
+        return value.name
+    return str(value)
+
+
+def map_key(row: Mapping[str, Any]) -> MapKey:
+    return (_name(row["telescope"]), _name(row["filter"]), _name(row["image_type"]))
+
+
+def _merge(maps: Iterable[SparseMap]) -> SparseMap:
+    """The sum of the maps, without the pixels which end up without frames."""
+    maps = list(maps)
+    pixels, inverse = np.unique(
+        np.concatenate([m[0] for m in maps]), return_inverse=True
+    )
+    counts = np.bincount(
+        inverse, weights=np.concatenate([m[1] for m in maps]), minlength=len(pixels)
+    ).astype(np.int64)
+    exposure = np.bincount(
+        inverse, weights=np.concatenate([m[2] for m in maps]), minlength=len(pixels)
+    )
+    keep = counts > 0
+    return pixels[keep], counts[keep], exposure[keep]
+
+
+def _empty() -> SparseMap:
+    return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+
+class CoverageMaps:
+    """
+    HEALPix maps of where on the sky observations were taken (their pointing), with
+    the number of frames and the total exposure time per pixel, one map per
+    (telescope, filter, image type). The maps are sparse (only the pixels with
+    frames) and are updated with every ingest batch (see ingest.upsert_observations),
+    so coverage questions do not need to scan the raw table.
+
+    Rows which are removed from the table (e.g. by reconcile.py) are not removed
+    from the maps, rebuild them with sky_coverage.py in that case.
+    """
+
+    def __init__(self, order: int = COVERAGE_ORDER):
+        self.order = order
+        self.maps: Dict[MapKey, SparseMap] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, coverage_file: Path) -> Optional[CoverageMaps]:
+        """Loads the maps, None when there is no file (of this version)."""
+        if not coverage_file.exists():
+            return None
+        coverage = cls()
+        with np.load(coverage_file, allow_pickle=False) as data:
+            if int(data["version"]) != COVERAGE_VERSION:
+                return None
+            coverage.order = int(data["order"])
+            for i, key in enumerate(json.loads(str(data["keys"]))):
+                coverage.maps[tuple(key)] = (
+                    data[f"pixels_{i}"].astype(np.int64),
+                    data[f"counts_{i}"].astype(np.int64),
+                    data[f"exposure_{i}"],
+                )
+        return coverage
+
+    @classmethod
+    def from_table(cls, engine, order: int = COVERAGE_ORDER) -> CoverageMaps:
+        """Builds the maps from all observations in the raw table."""
+        raw = models.Observation
+        coverage = cls(order)
+        stmt = select(
+            raw.ra, raw.dec, raw.exposure_time, raw.telescope, raw.filter, raw.image_type
+        )
+        with engine.connect() as conn:
+            result = conn.execution_options(
+                stream_results=True, yield_per=BATCH_SIZE
+            ).execute(stmt)
+            for rows in result.mappings().partitions():
+                coverage.update(rows)
+        return coverage
+
+    def save(self, coverage_file: Path) -> None:
+        with self._lock:
+            keys = list(self.maps.keys())
+            arrays = {
+                "version": np.array(COVERAGE_VERSION),
+                "order": np.array(self.order),
+                "keys": np.array(json.dumps(keys)),
+            }
+            for i, key in enumerate(keys):
+                pixels, counts, exposure = self.maps[key]
+                arrays[f"pixels_{i}"] = pixels.astype(np.uint32)
+                arrays[f"counts_{i}"] = counts.astype(np.uint32)
+                arrays[f"exposure_{i}"] = exposure
+
+        tmp = coverage_file.with_name(f".{coverage_file.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp, coverage_file)
+
+    def update(self, rows: Iterable[Mapping[str, Any]], sign: int = 1) -> None:
+        """
+        Adds the rows (with the columns of the raw table) to the maps, or removes
+        them with `sign` -1. Rows without a pointing are skipped.
+        """
+        groups: Dict[MapKey, List[Tuple[float, float, float]]] = {}
+        for row in rows:
+            if row["ra"] is None or row["dec"] is None:
+                continue
+            groups.setdefault(map_key(row), []).append(
+                (row["ra"], row["dec"], row["exposure_time"] or 0.0)
+            )
+
+        for key, values in groups.items():
+            ra, dec, exposure = np.array(values, dtype=float).T
+            pixels = radec_to_pixel(self.order, ra, dec)
+            batch = (pixels, np.full(len(pixels), sign), sign * exposure)
+            with self._lock:
+                self.maps[key] = _merge([self.maps.get(key, _empty()), batch])
+
+    def replace(
+        self,
+        old_rows: Iterable[Mapping[str, Any]],
+        new_rows: Iterable[Mapping[str, Any]],
+    ) -> None:
+        """Replaces the old versions of rows by the new ones."""
+        self.update(old_rows, sign=-1)
+        self.update(new_rows)
+
+    def keys(
+        self,
+        telescope: Optional[str] = None,
+        filter: Optional[str] = None,
+        image_type: Optional[str] = None,
+    ) -> List[MapKey]:
+        """The keys of the maps matching the selection, None matches anything."""
+        selection = (telescope, filter, image_type)
+        return sorted(
+            key
+            for key in self.maps
+            if all(s is None or _name(s) == k for s, k in zip(selection, key))
+        )
+
+    def select(
+        self,
+        telescope: Optional[str] = None,
+        filter: Optional[str] = None,
+        image_type: Optional[str] = None,
+    ) -> SparseMap:
+        """
+        The sum of the maps matching the selection, e.g. all frames in a filter
+        with select(filter="R"): the pixels, frames and exposure time per pixel.
+        """
+        keys = self.keys(telescope, filter, image_type)
+        with self._lock:
+            return _merge([_empty()] + [self.maps[key] for key in keys])
+
+    def dense(self, **selection: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """The frames and exposure time of all pixels of the selection."""
+        pixels, counts, exposure = self.select(**selection)
+        full_counts = np.zeros(num_pixels(self.order), dtype=np.int64)
+        full_exposure = np.zeros(num_pixels(self.order))
+        full_counts[pixels] = counts
+        full_exposure[pixels] = exposure
+        return full_counts, full_exposure
+
+    def lookup(
+        self, ra: np.ndarray, dec: np.ndarray, **selection: Optional[str]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """The frames and exposure time of the selection at the positions."""
+        pixels, counts, exposure = self.select(**selection)
+        wanted = radec_to_pixel(self.order, np.atleast_1d(ra), np.atleast_1d(dec))
+        # Pixels without frames are not in the map, append one with zeros for them
+        pixels = np.append(pixels, -1)
+        counts = np.append(counts, 0)
+        exposure = np.append(exposure, 0.0)
+        index = np.searchsorted(pixels[:-1], wanted)
+        index = np.where(pixels[index] == wanted, index, len(pixels) - 1)
+        return counts[index], exposure[index]
+
+    def sky_fraction(self, **selection: Optional[str]) -> float:
+        """The fraction of the sky with at least one frame of the selection."""
+        return len(self.select(**selection)[0]) / num_pixels(self.order)
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict, Iterator, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Observations queried against the tree at once
+QUERY_BATCH_SIZE = 100000
+# Radius (arcmin) for observations without a field size, when their telescope has
+# no observations with one either
+DEFAULT_RADIUS = 15.0
+
+CSV_SUFFIXES = (".csv", ".csv.gz", ".tsv")
+FITS_SUFFIXES = (".fits", ".fit", ".fts", ".fits.gz")
+PARQUET_SUFFIXES = (".parquet", ".pq")
+
+
+class Catalog(NamedTuple):
+    ids: np.ndarray  # str
+    ra: np.ndarray  # degrees
+    dec: np.ndarray  # degrees
+
+
+def radec_to_xyz(ra: np.ndarray, dec: np.ndarray) -> np.ndarray:
+    """Unit vectors (n, 3) of the positions in degrees."""
+    ra = np.radians(np.asarray(ra, dtype=float))
+    dec = np.radians(np.asarray(dec, dtype=float))
+    cos_dec = np.cos(dec)
+    return np.column_stack((cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)))
+
+
+def angle_to_chord(angle: np.ndarray) -> np.ndarray:
+    """The (Euclidean) distance between unit vectors at the angle (degrees)."""
+    return 2 * np.sin(np.radians(np.minimum(angle, 180.0)) / 2)
+
+
+def chord_to_angle(chord: np.ndarray) -> np.ndarray:
+    return np.degrees(2 * np.arcsin(np.minimum(chord, 2.0) / 2))
+
+
+def _read_columns(path: Path, columns: Sequence[str]) -> Dict[str, np.ndarray]:
+    name = path.name.lower()
+    if name.endswith(PARQUET_SUFFIXES):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path, columns=list(columns))
+        return {c: table.column(c).to_numpy() for c in columns}
+    if name.endswith(CSV_SUFFIXES):
+        import pyarrow.csv as pcsv
+
+        options = pcsv.ConvertOptions(include_columns=list(columns))
+        parse_options = pcsv.ParseOptions(delimiter="\t" if ".tsv" in name else ",")
+        table = pcsv.read_csv(
+            path, parse_options=parse_options, convert_options=options
+        )
+        return {c: table.column(c).to_numpy() for c in columns}
+    if name.endswith(FITS_SUFFIXES):
+        from astropy.io import fits
+
+        # The first binary table, read column wise
+        with fits.open(path, memmap=True) as hdul:
+            data = next(h.data for h in hdul if isinstance(h, fits.BinTableHDU))
+            return {c: np.array(data[c]) for c in columns}
+    raise ValueError(f"Unknown catalog format: {path.name}")
+
+
+def load_catalog(
+    path: Path, ra_column: str, dec_column: str, id_column: Optional[str] = None
+) -> Catalog:
+    """
+    Reads the positions (in degrees) and identifiers of the catalog sources from a
+    CSV (or TSV), FITS (first binary table) or Parquet file. Without `id_column`,
+    the row number is the identifier. Sources without a position are skipped.
+    """
+    columns = [ra_column, dec_column] + ([id_column] if id_column else [])
+    data = _read_columns(path, columns)
+    ra = np.asarray(data[ra_column], dtype=float)
+    dec = np.asarray(data[dec_column], dtype=float)
+    if id_column:
+        ids = np.asarray(data[id_column]).astype(str)
+    else:
+        ids = np.arange(len(ra)).astype(str)
+
+    valid = np.isfinite(ra) & np.isfinite(dec)
+    return Catalog(np.char.strip(ids[valid]), ra[valid], dec[valid])
+
+
+def field_radius(
+    field_width: np.ndarray,
+    field_height: np.ndarray,
+    groups: np.ndarray,
+    default: float = DEFAULT_RADIUS,
+) -> np.ndarray:
+    """
+    The radius (arcmin) of the circle around the field: half its diagonal, from the
+    field size of the astrometric solution. Observations without one get the median
+    radius of their group (e.g. telescope) or else the `default`.
+    """
+    width = np.asarray(field_width, dtype=float)
+    height = np.asarray(field_height, dtype=float)
+    height = np.where(np.isfinite(height), height, width)
+    radius = np.hypot(width, height) / 2
+
+    missing = ~np.isfinite(radius)
+    for group in np.unique(groups[missing]):
+        in_group = groups == group
+        known = radius[in_group & ~missing]
+        radius[in_group & missing] = np.median(known) if len(known) > 0 else default
+    return radius
+
+
+class CatalogIndex:
+    """
+    A KD-tree on the unit vectors of the catalog sources. Positions on the sphere
+    are matched by the chord distance between their vectors, which (unlike ra/dec)
+    has no problems at the poles or at ra = 0.
+    """
+
+    def __init__(self, catalog: Catalog):
+        self.catalog = catalog
+        self.tree = cKDTree(radec_to_xyz(catalog.ra, catalog.dec))
+
+    def query(
+        self,
+        ra: np.ndarray,
+        dec: np.ndarray,
+        radius: np.ndarray,
+        workers: int = 1,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        All sources within `radius` (arcmin) of the positions (degrees). Returns the
+        index of the position, the index of the source and their separation
+        (arcmin) for every match.
+        """
+        xyz = radec_to_xyz(ra, dec)
+        chord = angle_to_chord(np.asarray(radius, dtype=float) / 60)
+        found = self.tree.query_ball_point(
+            xyz, chord, workers=workers, return_sorted=False
+        )
+        counts = np.fromiter((len(f) for f in found), dtype=np.int64, count=len(found))
+        if counts.sum() == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0)
+
+        positions = np.repeat(np.arange(len(found)), counts)
+        sources = np.concatenate([f for f in found if len(f) > 0]).astype(np.int64)
+        distance = np.linalg.norm(xyz[positions] - self.tree.data[sources], axis=1)
+        return positions, sources, chord_to_angle(distance) * 60
+
+    def match(
+        self,
+        ra: np.ndarray,
+        dec: np.ndarray,
+        radius: np.ndarray,
+        batch_size: int = QUERY_BATCH_SIZE,
+        workers: int = 1,
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Same as `query`, in batches of `batch_size` positions."""
+        for start in range(0, len(ra), batch_size):
+            end = start + batch_size
+            positions, sources, separation = self.query(
+                ra[start:end], dec[start:end], radius[start:end], workers=workers
+            )
+            yield positions + start, sources, separation
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Set, Tuple
+
+from blaauw.core.paths import FITS_SUFFIXES
+
+# Increase when the layout of the file changes, it is then rebuilt
+TREE_VERSION = 2
+# Directories (and files) modified this recently (in seconds) are checked again
+# next time, as with coarse (e.g. NFS) timestamps a later change can get the same
+# mtime
+MTIME_GRACE = 2.0
+
+
+def stable_mtime(mtime_ns: int) -> int:
+    """
+    The modification time, or -1 when it is so recent that a later change could
+    get the same one, so it is seen as changed next time.
+    """
+    return -1 if time.time() - mtime_ns / 1e9 < MTIME_GRACE else mtime_ns
+
+
+def _file_stat(path: Path) -> List[int]:
+    """The [size, mtime_ns] of the file, [-1, -1] when it cannot be stat'ed."""
+    try:
+        st = path.stat()
+    except OSError:
+        return [-1, -1]
+    return [st.st_size, stable_mtime(st.st_mtime_ns)]
+
+
+class DirEntry(NamedTuple):
+    mtime_ns: int
+    nlink: int
+    subdirs: List[str]
+    files: Dict[str, List[int]]  # only the FITS files, with their [size, mtime_ns]
+
+
+class DirTree:
+    """
+    The listing of every directory from the previous crawl, with its modification
+    time and link count. Adding or removing an entry changes the modification time
+    of a directory (and adding or removing a subdirectory its link count), so a
+    directory where both are the same is not listed again, only its subdirectories
+    are checked. The number of entries itself is not known without listing it.
+
+    The size and modification time of the files are kept as well, as rewriting a
+    file in place does not change its directory. Files which failed in the
+    previous crawl (see `add_failed`) are returned as changed by the next walk.
+    """
+
+    def __init__(self):
+        self.dirs: Dict[str, DirEntry] = {}
+        self.failed: Set[str] = set()
+
+    @classmethod
+    def load(cls, tree_file: Path) -> DirTree:
+        tree = cls()
+        if tree_file.exists():
+            with open(tree_file) as f:
+                data = json.load(f)
+            if data["version"] == TREE_VERSION:
+                tree.dirs = {k: DirEntry(*v) for k, v in data["dirs"].items()}
+                tree.failed = set(data["failed"])
+        return tree
+
+    def save(self, tree_file: Path) -> None:
+        tmp = tree_file.with_name(f".{tree_file.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            data = {
+                "version": TREE_VERSION,
+                "dirs": self.dirs,
+                "failed": sorted(self.failed),
+            }
+            json.dump(data, f)
+        os.replace(tmp, tree_file)
+
+    def add_failed(self, filenames: Iterable[Path]) -> None:
+        """Marks the files as failed, so the next walk returns them again."""
+        self.failed.update(str(filename) for filename in filenames)
+
+    def _list(self, directory: Path, st: os.stat_result) -> DirEntry:
+        subdirs = []
+        files = []
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.name.endswith(FITS_SUFFIXES):
+                    files.append(entry.name)
+
+        file_stats = {name: _file_stat(directory / name) for name in sorted(files)}
+        return DirEntry(
+            stable_mtime(st.st_mtime_ns), st.st_nlink, sorted(subdirs), file_stats
+        )
+
+    def walk(self, root: Path) -> Tuple[List[Path], List[Path]]:
+        """
+        All FITS files under `root`, and the ones which changed since the previous
+        walk: new ones, ones with another size or modification time and the ones
+        which failed in the previous crawl. Only directories which changed are
+        listed, the files of the others are only stat'ed.
+        """
+        files = []
+        changed_files = []
+        seen = set()
+        stack = [root]
+        while len(stack) > 0:
+            directory = stack.pop()
+            key = str(directory)
+            try:
+                st = directory.stat()
+            except FileNotFoundError:
+                continue
+            seen.add(key)
+
+            entry = self.dirs.get(key)
+            signature = (st.st_mtime_ns, st.st_nlink)
+            if entry is None or (entry.mtime_ns, entry.nlink) != signature:
+                previous = entry.files if entry is not None else {}
+                entry = self._list(directory, st)
+                self.dirs[key] = entry
+            else:
+                previous = dict(entry.files)
+                for name in entry.files:
+                    entry.files[name] = _file_stat(directory / name)
+
+            for name, stat in entry.files.items():
+                path = directory / name
+                files.append(path)
+                if previous.get(name) != stat or str(path) in self.failed:
+                    changed_files.append(path)
+            stack.extend(directory / d for d in reversed(entry.subdirs))
+
+        # Forget the directories which are gone, and the failures (which are
+        # returned now, the crawl marks them again when they fail again)
+        prefix = str(root).rstrip("/") + "/"
+        for key in list(self.dirs.keys()):
+            if (key == str(root) or key.startswith(prefix)) and key not in seen:
+                del self.dirs[key]
+        self.failed = {f for f in self.failed if not f.startswith(prefix)}
+
+        return files, changed_files
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import csv
+import enum
+from datetime import datetime
+from pathlib import Path
+from typing import Any, List, Sequence
+from xml.sax.saxutils import escape, quoteattr
+
+from sqlalchemy import Boolean, Column, DateTime, Float, Integer
+
+# Datatypes of the columns in the VOTable
+VOTABLE_TYPES = [
+    (Boolean, 'datatype="boolean"'),
+    (Integer, 'datatype="long"'),
+    (Float, 'datatype="double"'),
+    (DateTime, 'datatype="char" arraysize="*" xtype="timestamp"'),
+]
+
+
+def convert_row(row: Sequence[Any]) -> List[Any]:
+    """
+    Converts the values of a row into plain types: enums become their name.
+    """
+    return [v.name if isinstance(v, enum.Enum) else v for v in row]
+
+
+class CsvWriter:
+    def __init__(self, filename: Path, columns: Sequence[Column]):
+        self.file = open(filename, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([c.key for c in columns])
+
+    def write_batch(self, rows: List[List[Any]]) -> None:
+        self.writer.writerows(rows)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetWriter:
+    def __init__(self, filename: Path, columns: Sequence[Column]):
+        # Only needed for this format
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        fields = []
+        for column in columns:
+            if isinstance(column.type, Boolean):
+                pa_type = pa.bool_()
+            elif isinstance(column.type, Integer):
+                pa_type = pa.int64()
+            elif isinstance(column.type, Float):
+                pa_type = pa.float64()
+            elif isinstance(column.type, DateTime):
+                pa_type = pa.timestamp("us")
+            else:
+                pa_type = pa.string()
+            fields.append(pa.field(column.key, pa_type))
+        self.schema = pa.schema(fields)
+        self.writer = pq.ParquetWriter(filename, self.schema)
+
+    def write_batch(self, rows: List[List[Any]]) -> None:
+        # Every batch becomes a row group, built column wise
+        arrays = [
+            self.pa.array([row[i] for row in rows], type=field.type)
+            for i, field in enumerate(self.schema)
+        ]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class VOTableWriter:
+    """
+    Writes a VOTable with the rows as TABLEDATA. The XML is written directly (instead
+    of through astropy.io.votable), so rows never have to be kept in memory.
+    """
+
+    def __init__(self, filename: Path, columns: Sequence[Column]):
+        self.file = open(filename, "w", encoding="utf-8")
+        self.file.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        self.file.write(
+            '<VOTABLE version="1.4" xmlns="http://www.ivoa.net/xml/VOTable/v1.3">\n'
+        )
+        self.file.write('<RESOURCE type="results">\n<TABLE name="raw">\n')
+        for column in columns:
+            # The attributes of the first matching type, text for the others
+            attributes = next(
+                (a for sql_type, a in VOTABLE_TYPES if isinstance(column.type, sql_type)),
+                'datatype="char" arraysize="*"',
+            )
+            self.file.write(f"<FIELD name={quoteattr(column.key)} {attributes}/>\n")
+        self.file.write("<DATA>\n<TABLEDATA>\n")
+
+    @staticmethod
+    def _cell(value: Any) -> str:
+        if value is None:
+            return "<TD/>"
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, bool):
+            value = "true" if value else "false"
+        return f"<TD>{escape(str(value))}</TD>"
+
+    def write_batch(self, rows: List[List[Any]]) -> None:
+        self.file.writelines(
+            "<TR>" + "".join(self._cell(v) for v in row) + "</TR>\n" for row in rows
+        )
+
+    def close(self) -> None:
+        self.file.write("</TABLEDATA>\n</DATA>\n</TABLE>\n</RESOURCE>\n</VOTABLE>\n")
+        self.file.close()
+
+
+# format -> (writer, file extension)
+WRITERS = {
+    "csv": (CsvWriter, "csv"),
+    "parquet": (ParquetWriter, "parquet"),
+    "votable": (VOTableWriter, "vot"),
+}
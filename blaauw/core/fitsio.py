@@ -0,0 +1,107 @@
+import gzip
+from pathlib import Path
+from typing import Optional, Tuple
+
+from astropy.io import fits
+
+# Defined with the paths, which do not need astropy
+from blaauw.core.paths import (  # noqa: F401
+    COMPRESSED_EXTENSIONS,
+    FITS_EXTENSIONS,
+    FITS_SUFFIXES,
+)
+
+# Size of a FITS block and of a single header card
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+
+
+def is_gzipped(filename: Path) -> bool:
+    return filename.name.endswith(".gz")
+
+
+def image_hdu(hdul: fits.HDUList) -> Optional[fits.hdu.base._BaseHDU]:
+    """
+    Returns the first HDU containing a 2D image, or None when there is no image.
+    """
+    for hdu in hdul:
+        if hdu.is_image and hdu.header.get("NAXIS", 0) == 2:
+            return hdu
+    return None
+
+
+def header_hdu(hdul: fits.HDUList) -> fits.hdu.base._BaseHDU:
+    """
+    Returns the HDU containing the header of the observation. This is the primary
+    HDU, except for tile compressed (.fz) files where the primary HDU is empty and
+    the image (with its header) is stored in the first extension.
+
+    Only looks at the first extension if the primary HDU is empty, such that for
+    plain files the rest of the file is never read.
+    """
+    primary = hdul[0]
+    if primary.header.get("NAXIS", 0) != 0:
+        return primary
+
+    try:
+        extension = hdul[1]
+    except IndexError:
+        return primary
+
+    if isinstance(extension, fits.CompImageHDU):
+        return extension
+    return primary
+
+
+def compression_type(filename: Path, hdu: fits.hdu.base._BaseHDU) -> Optional[str]:
+    """
+    The compression of the file/HDU: 'GZIP' for gzipped files, the tile compression
+    algorithm (e.g. 'RICE_1') for compressed images and None for plain files.
+    """
+    if is_gzipped(filename):
+        return "GZIP"
+    if isinstance(hdu, fits.CompImageHDU):
+        return hdu.compression_type
+    return None
+
+
+def _is_end_card(card: bytes) -> bool:
+    return card[:3] == b"END" and card[3:].strip() == b""
+
+
+def read_gzip_header(filename: Path) -> fits.Header:
+    """
+    Reads the primary header of a gzipped FITS file. Only decompresses the blocks
+    up to (and including) the one with the END card, the data is never touched.
+    """
+    blocks = []
+    with gzip.open(filename, "rb") as f:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if len(block) < BLOCK_SIZE:
+                raise OSError(f"Header without END card in {filename}")
+            blocks.append(block)
+
+            if any(
+                _is_end_card(block[i : i + CARD_SIZE])
+                for i in range(0, BLOCK_SIZE, CARD_SIZE)
+            ):
+                break
+
+    return fits.Header.fromstring(b"".join(blocks).decode("ascii"))
+
+
+def read_header(filename: Path) -> Tuple[fits.Header, Optional[str]]:
+    """
+    Reads the header of the observation in the (possibly compressed) FITS file.
+    Returns the header and the compression type (see `compression_type`).
+
+    For gzipped files only the header is decompressed, for tile compressed files
+    the header is read without decompressing any of the tiles.
+    """
+    if is_gzipped(filename):
+        return read_gzip_header(filename), "GZIP"
+
+    with fits.open(filename) as hdul:
+        hdu = header_hdu(hdul)
+        return hdu.header.copy(), compression_type(filename, hdu)
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import logging as log
+import os
+import pickle
+import struct
+import zlib
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional
+
+HEADER_FILE_MAGIC = b"BLAAUWHS"
+# Increase when the layout of the file changes
+HEADER_FILE_VERSION = 1
+HEADER_FILE_SUFFIX = ".headers"
+# Headers per chunk, a reader never holds more than a chunk (and a batch) at once
+CHUNK_SIZE = 1000
+
+# Every chunk starts with the size of its (compressed) data and number of headers
+_CHUNK = struct.Struct(">II")
+_PREFIX_SIZE = len(HEADER_FILE_MAGIC) + 2
+
+HeaderDict = Dict[str, Any]
+
+
+def _read_prefix(f: BinaryIO) -> Optional[int]:
+    """The version of the file, None if it is not a header file (i.e. a pickle)."""
+    prefix = f.read(_PREFIX_SIZE)
+    if len(prefix) < _PREFIX_SIZE or not prefix.startswith(HEADER_FILE_MAGIC):
+        return None
+    (version,) = struct.unpack(">H", prefix[len(HEADER_FILE_MAGIC) :])
+    return version
+
+
+def is_header_file(path: Path) -> bool:
+    with open(path, "rb") as f:
+        return _read_prefix(f) is not None
+
+
+def _chunks(f: BinaryIO, path: Path, decode: bool) -> Iterator[tuple[int, Any]]:
+    """
+    Yields (end offset, headers) of the complete chunks after the prefix, where the
+    headers are only decoded with `decode` (otherwise their number is given). A
+    chunk which was cut off (e.g. the crawler was killed while appending) ends it.
+    """
+    while True:
+        head = f.read(_CHUNK.size)
+        if len(head) == 0:
+            return
+        if len(head) < _CHUNK.size:
+            log.warning(f"{path}: skipping the incomplete last chunk")
+            return
+        num_bytes, num_headers = _CHUNK.unpack(head)
+        if not decode:
+            start = f.tell()
+            if f.seek(0, os.SEEK_END) < start + num_bytes:
+                log.warning(f"{path}: skipping the incomplete last chunk")
+                return
+            f.seek(start + num_bytes)
+            yield f.tell(), num_headers
+            continue
+
+        data = f.read(num_bytes)
+        if len(data) < num_bytes:
+            log.warning(f"{path}: skipping the incomplete last chunk")
+            return
+        yield f.tell(), pickle.loads(zlib.decompress(data))
+
+
+def iter_chunks(path: Path) -> Iterator[List[HeaderDict]]:
+    """
+    Yields the headers of the file chunk by chunk. Legacy files (a single pickle of
+    a list of headers, as written by earlier crawlers) are loaded as a whole and
+    yielded as one chunk, see convert_headers.py to convert them.
+    """
+    with open(path, "rb") as f:
+        version = _read_prefix(f)
+        if version is None:
+            log.warning(f"{path} is a legacy pickle, which is loaded in memory")
+            f.seek(0)
+            yield pickle.load(f)
+            return
+        if version != HEADER_FILE_VERSION:
+            raise ValueError(f"{path}: unsupported header file version {version}")
+        for _, headers in _chunks(f, path, decode=True):
+            yield headers
+
+
+def count_headers(path: Path) -> Optional[int]:
+    """
+    The number of headers in the file, from the chunk prefixes only. None for a
+    legacy pickle, which would have to be loaded.
+    """
+    with open(path, "rb") as f:
+        if _read_prefix(f) is None:
+            return None
+        return sum(n for _, n in _chunks(f, path, decode=False))
+
+
+def read_batches(
+    paths: Iterable[Path], batch_size: int = CHUNK_SIZE
+) -> Iterator[List[HeaderDict]]:
+    """
+    Yields the headers of all files (in order) in batches of `batch_size`, only the
+    last batch can be smaller.
+    """
+    batch: List[HeaderDict] = []
+    for path in paths:
+        for chunk in iter_chunks(path):
+            batch.extend(chunk)
+            start = 0
+            while len(batch) - start >= batch_size:
+                yield batch[start : start + batch_size]
+                start += batch_size
+            batch = batch[start:]
+    if len(batch) > 0:
+        yield batch
+
+
+def read_headers(paths: Iterable[Path]) -> Iterator[HeaderDict]:
+    """Yields the headers of all files one by one."""
+    for path in paths:
+        for chunk in iter_chunks(path):
+            yield from chunk
+
+
+class HeaderWriter:
+    """
+    Writes headers to a header file: the magic, the version (2 bytes) and then
+    chunks of at most `chunk_size` headers, each a compressed pickle of a list of
+    headers prefixed with its size and number of headers. As chunks are
+    independent, a file can be appended to and read back in chunks, without having
+    all headers in memory.
+
+    A new file is written to a temporary file first and replaces the file when
+    closed. With `append`, chunks are added to the existing file in place (an
+    incomplete last chunk, from a run which was killed, is removed first).
+    """
+
+    def __init__(self, path: Path, append: bool = False, chunk_size: int = CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.num_written = 0
+        self._buffer: List[HeaderDict] = []
+        self._tmp: Optional[Path] = None
+
+        if append and path.exists():
+            self._file = open(path, "r+b")
+            version = _read_prefix(self._file)
+            if version != HEADER_FILE_VERSION:
+                self._file.close()
+                raise ValueError(f"Cannot append to {path}: not a header file")
+            # Behind the last complete chunk, a partial one is cut off
+            end = _PREFIX_SIZE
+            for chunk_end, _ in _chunks(self._file, path, decode=False):
+                end = chunk_end
+            self._file.seek(end)
+            self._file.truncate()
+        else:
+            self._tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+            self._file = open(self._tmp, "wb")
+            self._file.write(HEADER_FILE_MAGIC)
+            self._file.write(struct.pack(">H", HEADER_FILE_VERSION))
+
+    def __enter__(self) -> HeaderWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, header: HeaderDict) -> None:
+        self._buffer.append(header)
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def write_many(self, headers: Iterable[HeaderDict]) -> None:
+        for header in headers:
+            self.write(header)
+
+    def flush(self) -> None:
+        """Writes the buffered headers as a chunk."""
+        if len(self._buffer) == 0:
+            return
+        data = zlib.compress(pickle.dumps(self._buffer, protocol=4))
+        self._file.write(_CHUNK.pack(len(data), len(self._buffer)))
+        self._file.write(data)
+        self._file.flush()
+        self.num_written += len(self._buffer)
+        self._buffer = []
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+        if self._tmp is not None:
+            os.replace(self._tmp, self.path)
+            self._tmp = None
+
+    def abort(self) -> None:
+        """Closes without replacing the file (the chunks appended so far are kept)."""
+        self._file.close()
+        if self._tmp is not None:
+            self._tmp.unlink()
+            self._tmp = None
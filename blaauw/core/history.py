@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import enum
+import hashlib
+import json
+import math
+from datetime import datetime
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from sqlalchemy import Enum, select
+from sqlalchemy.orm import Session
+
+from blaauw.core import models
+
+# Columns of the raw table which are not set by the ingest
+UNTRACKED_COLUMNS = {
+    "id",
+    "created_at",
+    "updated_at",
+    "missing_since",
+    "content_hash",
+    "created_run_id",
+}
+# Columns of the raw table which are tracked, i.e. set by the ingest
+TRACKED_COLUMNS = tuple(
+    c.key for c in models.Observation.__table__.columns if c.key not in UNTRACKED_COLUMNS
+)
+
+# Recomputed floats (e.g. alt/az) can differ in the last bits between runs
+FLOAT_REL_TOL = 1e-9
+FLOAT_ABS_TOL = 1e-12
+
+
+def to_json_value(value: Any) -> Any:
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def from_json_value(field: str, value: Any) -> Any:
+    """
+    Converts the stored JSON value back to the type of the column `field`.
+    """
+    if value is None:
+        return None
+    column_type = models.Observation.__table__.c[field].type
+    if isinstance(column_type, Enum) and column_type.enum_class is not None:
+        return column_type.enum_class[value]
+    if column_type.python_type is datetime:
+        return datetime.fromisoformat(value)
+    return value
+
+
+def values_equal(old: Any, new: Any) -> bool:
+    if isinstance(old, float) and isinstance(new, float):
+        if math.isnan(old) and math.isnan(new):
+            return True
+        return math.isclose(old, new, rel_tol=FLOAT_REL_TOL, abs_tol=FLOAT_ABS_TOL)
+    return old == new
+
+
+def content_hash(row: Mapping[str, Any]) -> str:
+    """
+    Hash of the tracked fields of the row. Floats are rounded to 10 significant
+    digits, such that recomputed values give the same hash.
+    """
+    values = []
+    for field in TRACKED_COLUMNS:
+        value = to_json_value(row[field])
+        if isinstance(value, float):
+            value = format(value, ".10g")
+        values.append(value)
+    encoded = json.dumps(values, default=str).encode()
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+def diff_rows(
+    old: Mapping[str, Any], new: Mapping[str, Any]
+) -> List[Tuple[str, Any, Any]]:
+    """
+    The (field, old, new) of the tracked fields which differ between the rows.
+    """
+    return [
+        (field, to_json_value(old[field]), to_json_value(new[field]))
+        for field in TRACKED_COLUMNS
+        if field in new and not values_equal(old[field], new[field])
+    ]
+
+
+def change_entries(
+    old: Mapping[str, Any], new: Mapping[str, Any], run_id: int
+) -> List[Dict[str, Any]]:
+    """
+    The rows of the observation_history table for the fields which changed from
+    the `old` to the `new` version of an observation in the run `run_id`.
+    """
+    return [
+        {
+            "observation_id": old["id"],
+            "run_id": run_id,
+            "field": field,
+            "old_value": old_value,
+            "new_value": new_value,
+        }
+        for field, old_value, new_value in diff_rows(old, new)
+    ]
+
+
+def observation_as_of(
+    session: Session, observation_id: int, run_id: int
+) -> Optional[Dict[str, Any]]:
+    """
+    Reconstructs the tracked fields of an observation as they were right after the
+    ingest run `run_id`. Returns None if the observation did not exist yet, i.e.
+    it was inserted by a later run. Rows inserted before the run was recorded
+    (created_run_id is NULL) are taken to have existed.
+
+    Starts from the current row and, for every field changed after the run, takes
+    the old value of the first change after the run. This is a single query,
+    independent of the number of runs in between.
+    """
+    raw = models.Observation.__table__
+    current = session.execute(
+        select(raw).where(raw.c.id == observation_id)
+    ).first()
+    if current is None or session.get(models.IngestRun, run_id) is None:
+        return None
+    created_run_id = current._mapping["created_run_id"]
+    if created_run_id is not None and created_run_id > run_id:
+        return None
+
+    history = models.ObservationHistory
+    changes = (
+        select(history.field, history.old_value)
+        .where(history.observation_id == observation_id)
+        .where(history.run_id > run_id)
+        .order_by(history.run_id, history.id)
+    )
+
+    result = {field: current._mapping[field] for field in TRACKED_COLUMNS}
+    # Only the first change of every field after the run has its value at the run
+    restored = set()
+    for field, old_value in session.execute(changes):
+        if field in result and field not in restored:
+            result[field] = from_json_value(field, old_value)
+            restored.add(field)
+    return result
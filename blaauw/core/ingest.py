@@ -0,0 +1,459 @@
+from __future__ import annotations
+
+import json
+import logging as log
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from astropy.coordinates import AltAz, SkyCoord
+from astropy.time import Time
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from tqdm import tqdm
+
+from blaauw.core import astrometry, history, models, paths, transformers
+from blaauw.core.coverage import CoverageMaps
+from blaauw.core.metrics import RunMetrics
+
+HEADER_BATCH_SIZE = 1000
+UPSERT_BATCH_SIZE = 1000
+
+# Only computed by crawls with --stats, other crawls keep the stored values
+PIXEL_STAT_COLUMNS = (
+    "pixel_median",
+    "pixel_sigma",
+    "pixel_min",
+    "pixel_max",
+    "saturated_fraction",
+)
+
+# The upsert (INSERT ... ON CONFLICT) is dialect specific, both have the same API
+DIALECT_INSERT = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def create_observation(header: dict) -> models.Observation:
+    """
+    Given a header, creates an Observation out of it.
+    """
+    # Assume utc
+    date_str = header["DATE-OBS"]
+    # maybe format="isot" ?
+    date = Time(date_str, format="fits", scale="utc")
+
+    imtyp = header.get("IMAGETYP", None)
+    filter = header.get("FILTER", None)
+    obj = header.get("OBJECT", None)
+    xbin = header["XBINNING"]
+    ybin = header["YBINNING"]
+    binning = xbin if xbin == ybin else None
+    filename = Path(header["FILENAME"])
+    telescope = models.Telescope.from_path(filename)
+    file_id = transformers.path_to_file_id(filename)
+
+    # Determine if it has WCS info
+    has_wcs = False
+    wcs_filename = None
+    raw_filename = filename
+    path_info = paths.classify(filename)
+    if path_info is not None and path_info.root == "ASTROM_GBT":
+        has_wcs = True
+        wcs_filename = filename
+        # We don't have this info directly, so need to query later
+        raw_filename = "QUERY"
+
+    airmass = header.get("AIRMASS", None)
+    ra, dec = transformers.get_equitorial(header)
+    # if ra & dec are available calculate alt az and airmass.
+    # TODO: probably only do this if astrometry is available (most reliable)
+    if dec is not None and ra is not None and telescope is not None:
+        coord = SkyCoord(ra, dec, obstime=date, unit="deg")
+        horizontal_frame = coord.transform_to(AltAz(location=telescope.location()))
+
+        alt = horizontal_frame.alt.deg
+        az = horizontal_frame.az.deg
+        airmass = horizontal_frame.secz.value
+    else:
+        alt, az = transformers.get_horizontal(header)
+
+    solution = None
+    if has_wcs:
+        solution = astrometry.solution_from_dict(header)
+    if solution is None:
+        solution = astrometry.AstrometrySolution()
+
+    exposure_time = header.get("EXPTIME", None)
+    if exposure_time is None:
+        exposure_time = header.get("EXPOSURE", None)
+
+    obs = models.Observation(
+        filename=str(filename),
+        file_id=file_id,
+        date_obs=date.to_datetime(),
+        date_obs_mjd=date.mjd,
+        ra=ra,
+        dec=dec,
+        alt=alt,
+        az=az,
+        airmass=airmass,
+        image_type=transformers.imtyp_to_enum(imtyp, filter=filter, obj=obj),
+        filter=filter,
+        target_object=obj,
+        exposure_time=exposure_time,
+        binning=binning,
+        telescope=telescope,
+        instrument=header.get("INSTRUME", None),
+        has_wcs=has_wcs,
+        raw_filename=str(raw_filename),
+        wcs_filename=str(wcs_filename),
+        plate_scale=solution.scale,
+        astrometry_odds=solution.odds,
+        astrometry_log_odds=solution.log_odds,
+        field_width=solution.field_width,
+        field_height=solution.field_height,
+        rotation=solution.rotation,
+        parity=solution.parity,
+        astrometry_index=solution.index_id,
+        pixel_median=header.get("PIX_MEDIAN", None),
+        pixel_sigma=header.get("PIX_SIGMA", None),
+        pixel_min=header.get("PIX_MIN", None),
+        pixel_max=header.get("PIX_MAX", None),
+        saturated_fraction=header.get("PIX_SATFRAC", None),
+    )
+    return obs
+
+
+def observation_values(observation: models.Observation) -> dict:
+    return {k: getattr(observation, k) for k in history.TRACKED_COLUMNS}
+
+
+def upsert_observations(
+    observations: List[models.Observation],
+    session: Session,
+    run_id: int,
+    coverage: Optional[CoverageMaps] = None,
+) -> tuple[int, int, int, int]:
+    """
+    Will insert the given `observations` in the database, or update them when an
+    entry with the same file_id already exists, using a single statement.
+
+    Entries are only written when the hash of their values differs from the stored
+    one, so re-ingesting the same data does not write anything. The hashes of the
+    existing entries are fetched with a single query, the full rows only for the
+    ones that changed, to record the changed fields in the history (run `run_id`).
+    The changed rows replace their old versions in the `coverage` maps (if given).
+    Pixel statistics which are not in the headers keep their stored values.
+
+    Returns the number of inserted, updated and unchanged observations, and the
+    number of duplicates (a later observation with the same file_id in the batch,
+    e.g. the astrometry frame of a raw frame) which were merged into them.
+    """
+    raw = models.Observation.__table__
+    file_ids = {obs.file_id for obs in observations}
+    existing_stmt = select(
+        raw.c.id,
+        raw.c.file_id,
+        raw.c.filename,
+        raw.c.raw_filename,
+        raw.c.has_wcs,
+        raw.c.content_hash,
+        *(raw.c[column] for column in PIXEL_STAT_COLUMNS),
+    ).where(raw.c.file_id.in_(file_ids))
+    existing = {row.file_id: row._mapping for row in session.execute(existing_stmt)}
+
+    # A file_id can occur more than once in the batch, the last one wins
+    rows = {}
+    for obs in observations:
+        row = observation_values(obs)
+        previous = rows.get(obs.file_id, existing.get(obs.file_id))
+        if previous is not None:
+            # We already have an entry in there, so get the raw_filename and update
+            row["raw_filename"] = previous["raw_filename"]
+            for column in PIXEL_STAT_COLUMNS:
+                if row[column] is None:
+                    row[column] = previous[column]
+        row["content_hash"] = history.content_hash(row)
+        # Only written on insert, see the ON CONFLICT update below
+        row["created_run_id"] = run_id
+
+        if previous is not None and previous["content_hash"] != row["content_hash"]:
+            # We log some warnings to see if stuff goes wrong
+            if previous["has_wcs"] and not obs.has_wcs:
+                log.warning(
+                    f"Updating existing element {previous['filename']} with element without WCS {obs.filename}"
+                )
+            if not previous["has_wcs"] and not obs.has_wcs:
+                log.warning(
+                    f"Potential duplicate entry: Updating existing element (no WCS) {previous['filename']} with element without WCS {obs.filename}"
+                )
+        rows[obs.file_id] = row
+
+    changed = [
+        row
+        for file_id, row in rows.items()
+        if file_id not in existing
+        or existing[file_id]["content_hash"] != row["content_hash"]
+    ]
+    num_inserted = len(file_ids - existing.keys())
+    num_updated = len(changed) - num_inserted
+    num_unchanged = len(rows) - len(changed)
+    num_duplicates = len(observations) - len(rows)
+    if len(changed) == 0:
+        return num_inserted, num_updated, num_unchanged, num_duplicates
+
+    history_rows = []
+    old_values = []
+    updated_ids = [
+        existing[row["file_id"]]["id"] for row in changed if row["file_id"] in existing
+    ]
+    if len(updated_ids) > 0:
+        old_rows = session.execute(select(raw).where(raw.c.id.in_(updated_ids)))
+        for old in old_rows:
+            old = old._mapping
+            old_values.append(old)
+            history_rows += history.change_entries(old, rows[old["file_id"]], run_id)
+
+    dialect = session.get_bind().dialect.name
+    stmt = DIALECT_INSERT[dialect](raw)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[raw.c.file_id],
+        set_={
+            **{k: stmt.excluded[k] for k in history.TRACKED_COLUMNS},
+            # Also for rows written by another worker since they were fetched
+            **{
+                k: func.coalesce(stmt.excluded[k], raw.c[k])
+                for k in PIXEL_STAT_COLUMNS
+            },
+            "content_hash": stmt.excluded.content_hash,
+            "updated_at": func.now(),
+        },
+    )
+    session.execute(stmt, changed)
+    if len(history_rows) > 0:
+        session.execute(insert(models.ObservationHistory), history_rows)
+    if coverage is not None:
+        coverage.replace(old_values, changed)
+
+    return num_inserted, num_updated, num_unchanged, num_duplicates
+
+
+# Upsert of the full headers, joined on file_id to get the observation id
+_header_upsert_stmts = {
+    "postgresql": text(
+        """
+        INSERT INTO blaauw.header AS target (observation_id, header)
+        SELECT raw.id, h.header
+        FROM jsonb_to_recordset(CAST(:rows AS jsonb)) AS h(file_id text, header jsonb)
+        JOIN blaauw.raw AS raw ON raw.file_id = h.file_id
+        ON CONFLICT (observation_id) DO UPDATE SET header = EXCLUDED.header
+        WHERE target.header IS DISTINCT FROM EXCLUDED.header
+        """
+    ),
+    # Same using the JSON1 functions, the schema is not used in SQLite. The WHERE
+    # true is needed to parse the ON CONFLICT after a join.
+    "sqlite": text(
+        """
+        INSERT INTO header (observation_id, header)
+        SELECT raw.id, json_extract(h.value, '$.header')
+        FROM json_each(:rows) AS h
+        JOIN raw ON raw.file_id = json_extract(h.value, '$.file_id')
+        WHERE true
+        ON CONFLICT (observation_id) DO UPDATE SET header = excluded.header
+        WHERE header IS NOT excluded.header
+        """
+    ),
+}
+
+
+def insert_headers(
+    headers: List[dict],
+    observations: List[models.Observation],
+    session: Session,
+    batch_size: int = HEADER_BATCH_SIZE,
+):
+    """
+    Stores the full `headers` of the `observations` in the header table. The rows
+    are sent in batches, each as a single JSON array which is unpacked and joined
+    with the raw table in the database, so it is a single statement per batch.
+    Headers which did not change are not written.
+
+    The observations should already be in the database.
+    """
+    # A file_id can occur more than once (e.g. raw and astrometry version), only
+    # keep the last one like the observation itself
+    rows = {
+        obs.file_id: transformers.header_to_json(header)
+        for header, obs in zip(headers, observations)
+        if obs.file_id is not None
+    }
+    rows = [{"file_id": k, "header": v} for k, v in rows.items()]
+
+    stmt = _header_upsert_stmts[session.get_bind().dialect.name]
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start : start + batch_size]
+        session.execute(stmt, {"rows": json.dumps(batch)})
+
+
+def partition_headers(headers: List[dict], num_partitions: int) -> List[List[dict]]:
+    """
+    Splits the headers into partitions based on the hash of their file_id. Headers
+    with the same file_id end up in the same partition, in their original order, so
+    workers never write the same rows.
+    """
+    partitions = [[] for _ in range(num_partitions)]
+    for header in headers:
+        file_id = transformers.path_to_file_id(Path(header["FILENAME"])) or ""
+        partitions[zlib.crc32(file_id.encode()) % num_partitions].append(header)
+    return partitions
+
+
+def insert_partition(
+    headers: List[dict],
+    engine,
+    run_id: int,
+    progress: Optional[tqdm] = None,
+    metrics: Optional[RunMetrics] = None,
+    coverage: Optional[CoverageMaps] = None,
+) -> tuple[int, int, int, int]:
+    """
+    Inserts the headers on a single connection, committing after every batch.
+    The rows are counted in the `metrics` (if given) after every batch, and the
+    `coverage` maps (if given) are updated with them.
+    Returns the number of inserted, updated, unchanged and duplicate observations
+    (see `upsert_observations`).
+    """
+    num_inserted = 0
+    num_updated = 0
+    num_unchanged = 0
+    num_duplicates = 0
+    with Session(engine) as session:
+        for start in range(0, len(headers), UPSERT_BATCH_SIZE):
+            batch = headers[start : start + UPSERT_BATCH_SIZE]
+            try:
+                observations = [create_observation(header) for header in batch]
+
+                inserted, updated, unchanged, duplicates = upsert_observations(
+                    observations, session, run_id, coverage=coverage
+                )
+                insert_headers(batch, observations, session)
+                session.commit()
+            except Exception as e:
+                if metrics is not None:
+                    metrics.inc("errors", type=type(e).__name__)
+                raise
+
+            num_inserted += inserted
+            num_updated += updated
+            num_unchanged += unchanged
+            num_duplicates += duplicates
+            if progress is not None:
+                progress.update(len(batch))
+            if metrics is not None:
+                metrics.inc("rows_inserted", inserted)
+                metrics.inc("rows_updated", updated)
+                metrics.inc("rows_unchanged", unchanged)
+                metrics.inc("rows_duplicate", duplicates)
+                metrics.maybe_write()
+
+    return num_inserted, num_updated, num_unchanged, num_duplicates
+
+
+def insert_header_batches(
+    batches: Iterable[List[dict]],
+    engine,
+    source: Optional[str] = None,
+    workers: int = 1,
+    total: Optional[int] = None,
+    progress_bar: bool = False,
+    metrics: Optional[RunMetrics] = None,
+    coverage: Optional[CoverageMaps] = None,
+):
+    """
+    Inserts the headers batch by batch (e.g. from headerfile.read_batches), so only
+    a single batch is in memory. Each batch is partitioned over the `workers`, later
+    batches are inserted after the earlier ones (and so take precedence). The
+    `total` number of headers is only used for reporting. The `coverage` maps are
+    updated with every batch.
+    """
+    if engine.dialect.name == "sqlite":
+        # SQLite allows a single writer, more connections would only wait on the lock
+        workers = 1
+
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+    num_str = total if total is not None else "all"
+    log.info(f"- Inserting {num_str} observations using {workers} connection(s)...")
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+    with Session(engine) as session:
+        run = models.IngestRun(source=source)
+        session.add(run)
+        session.commit()
+        run_id = run.id
+    log.info(f"- Ingest run {run_id}")
+
+    # Insert everything
+    num_inserted = 0
+    num_updated = 0
+    num_unchanged = 0
+    num_duplicates = 0
+    progress = tqdm(total=total) if progress_bar else None
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch in batches:
+            futures = [
+                pool.submit(
+                    insert_partition,
+                    partition,
+                    engine,
+                    run_id,
+                    progress,
+                    metrics,
+                    coverage,
+                )
+                for partition in partition_headers(batch, workers)
+            ]
+            for future in futures:
+                inserted, updated, unchanged, duplicates = future.result()
+                num_inserted += inserted
+                num_updated += updated
+                num_unchanged += unchanged
+                num_duplicates += duplicates
+    if progress is not None:
+        progress.close()
+
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+    log.info(
+        f"- Inserted {num_inserted}, Updated {num_updated}, Unchanged {num_unchanged}"
+    )
+    log.info(f"- Merged {num_duplicates} duplicate headers of the same frames")
+    log.info("- Done")
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+
+
+def insert_header_list(
+    headers: List[dict],
+    engine,
+    source: Optional[str] = None,
+    workers: int = 1,
+    progress_bar: bool = False,
+    metrics: Optional[RunMetrics] = None,
+    coverage: Optional[CoverageMaps] = None,
+):
+    insert_header_batches(
+        [headers],
+        engine,
+        source=source,
+        workers=workers,
+        total=len(headers),
+        progress_bar=progress_bar,
+        metrics=metrics,
+        coverage=coverage,
+    )
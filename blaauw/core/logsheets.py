@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import datetime as dt
+import re
+import sqlite3
+from itertools import groupby
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+LogRow = Dict[str, Any]
+
+SCAN_ROWS_QUERY = """
+    SELECT ROW_ID, ObsDate, LogSheetFile, RowNum, Interpreter, GoogleVision,
+           BlopFile, CALMatch, SIMMatch, MPCMatch, Flag_Nomatch, Flag_Interpreter
+    FROM ScanRows
+"""
+
+OBS_DATE_FORMATS = ("%Y-%m-%d", "%Y%m%d", "%y%m%d", "%d-%m-%Y")
+# Times as written on the logsheets, e.g. 21:34, 21.34 or 21h34 (optional seconds)
+TIME_RE = re.compile(r"\b([01]?\d|2[0-3])[:.h]([0-5]\d)(?:[:.]([0-5]\d))?\b")
+# A night runs from noon to noon (UTC), and is named after the first day
+NIGHT_OFFSET = dt.timedelta(hours=12)
+
+
+def parse_obs_date(value: Any) -> dt.date:
+    for fmt in OBS_DATE_FORMATS:
+        try:
+            return dt.datetime.strptime(str(value).strip(), fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"Unknown ObsDate format: {value}")
+
+
+def night_of(timestamp: dt.datetime) -> dt.date:
+    """
+    The night (named after the date of the evening) to which the timestamp belongs.
+    """
+    return (timestamp - NIGHT_OFFSET).date()
+
+
+def night_start(night: dt.date) -> dt.datetime:
+    return dt.datetime.combine(night, dt.time()) + NIGHT_OFFSET
+
+
+def parse_row_time(text: Optional[str], night: dt.date) -> Optional[dt.datetime]:
+    """
+    Finds the (first) time in the interpreted text of a logsheet row and converts it
+    to a timestamp in the given night. Times before noon are on the next day. The
+    times on the logsheets are assumed to be in UTC, like DATE-OBS.
+    """
+    if text is None:
+        return None
+    match = TIME_RE.search(text)
+    if match is None:
+        return None
+
+    hour, minute, second = (int(g) if g is not None else 0 for g in match.groups())
+    timestamp = dt.datetime.combine(night, dt.time(hour, minute, second))
+    if timestamp < night_start(night):
+        timestamp += dt.timedelta(days=1)
+    return timestamp
+
+
+def _as_text(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def _as_bool(value: Any) -> Optional[bool]:
+    return None if value is None else bool(int(value))
+
+
+def read_scan_rows(filename: Path) -> List[LogRow]:
+    """
+    Reads all the scan rows from the logsheet (SQLite) database, in the format of
+    the models.LogsheetRow table. The time window is not set yet.
+    """
+    # Read only, we should never change the logsheet database from here
+    con = sqlite3.connect(f"file:{filename}?mode=ro", uri=True)
+    try:
+        records = con.execute(SCAN_ROWS_QUERY).fetchall()
+    finally:
+        con.close()
+
+    rows = []
+    for record in records:
+        obs_date = parse_obs_date(record[1])
+        rows.append(
+            {
+                "id": int(record[0]),
+                "obs_date": obs_date,
+                "logsheet_file": str(record[2]),
+                "row_num": int(record[3]),
+                "interpreter": _as_text(record[4]),
+                "google_vision": _as_text(record[5]),
+                "blop_file": _as_text(record[6]),
+                "cal_match": _as_text(record[7]),
+                "sim_match": _as_text(record[8]),
+                "mpc_match": _as_text(record[9]),
+                "flag_nomatch": _as_bool(record[10]),
+                "flag_interpreter": _as_bool(record[11]),
+                "start_time": parse_row_time(_as_text(record[4]), obs_date),
+                "end_time": None,
+            }
+        )
+    return rows
+
+
+def assign_windows(rows: List[LogRow]) -> None:
+    """
+    Sets the time window of every row (with a time) in place. A row applies from
+    its own time until the next later time on the same logsheet, the last row of a
+    logsheet until the end of the night. Rows with the same time get the same
+    window.
+    """
+    timed = sorted(
+        (row for row in rows if row["start_time"] is not None),
+        key=lambda row: (row["obs_date"], row["logsheet_file"], row["start_time"]),
+    )
+    for _, sheet in groupby(timed, key=lambda r: (r["obs_date"], r["logsheet_file"])):
+        sheet = list(sheet)
+        end_of_night = night_start(sheet[0]["obs_date"] + dt.timedelta(days=1))
+
+        # Walk backwards, so we always know the next (strictly) later start: the
+        # start of the previous group of rows with the same time
+        next_start = end_of_night
+        group_start = end_of_night
+        for row in reversed(sheet):
+            if row["start_time"] < group_start:
+                next_start = group_start
+                group_start = row["start_time"]
+            row["end_time"] = next_start
+
+
+def interval_join(
+    windows: List[Tuple[dt.datetime, dt.datetime, int]],
+    observations: List[Tuple[dt.datetime, int]],
+) -> List[Tuple[int, int]]:
+    """
+    Sort-merge join of the windows (start, end, row_id) with the observations
+    (date_obs, observation_id), both sorted by time. Returns the pairs
+    (observation_id, row_id) where start <= date_obs < end.
+
+    The start of the scan only moves forward (windows are sorted by start), so the
+    cost is linear in the number of windows, observations and links.
+    """
+    links = []
+    first = 0
+    for start, end, row_id in windows:
+        while first < len(observations) and observations[first][0] < start:
+            first += 1
+
+        i = first
+        while i < len(observations) and observations[i][0] < end:
+            links.append((observations[i][1], row_id))
+            i += 1
+    return links
+
+
+def link_observations(
+    rows: Iterable[LogRow], observations: Iterable[Tuple[dt.datetime, int]]
+) -> List[Tuple[int, int]]:
+    """
+    Links the logsheet rows to the observations (date_obs, observation_id), by
+    joining the windows and observations night by night.
+    """
+    windows_per_night: Dict[dt.date, list] = {}
+    for row in rows:
+        if row["start_time"] is None:
+            continue
+        window = (row["start_time"], row["end_time"], row["id"])
+        windows_per_night.setdefault(row["obs_date"], []).append(window)
+
+    obs_per_night: Dict[dt.date, list] = {}
+    for date_obs, obs_id in observations:
+        obs_per_night.setdefault(night_of(date_obs), []).append((date_obs, obs_id))
+
+    links = []
+    for night, windows in windows_per_night.items():
+        night_obs = obs_per_night.get(night)
+        if night_obs is None:
+            continue
+        windows.sort()
+        night_obs.sort()
+        links.extend(interval_join(windows, night_obs))
+    return links
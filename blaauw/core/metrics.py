@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+# Metrics with a description, others are written without one
+HELP = {
+    "files_discovered": "FITS files found in the searched directories.",
+    "files_indexed": "Files whose header was taken from the night index.",
+    "files_quarantined": "Files skipped because they failed before.",
+    "headers_extracted": "Headers read from FITS files.",
+    "errors": "Files or rows which failed, by error type.",
+    "bytes_read": "Bytes of the files which were read.",
+    "rows_inserted": "Observations inserted in the database.",
+    "rows_updated": "Existing observations which were changed in the database.",
+    "rows_unchanged": "Observations which were already up to date.",
+    "rows_duplicate": "Headers merged into a later one of the same frame.",
+    "stage_seconds": "Wall clock time spent per stage of the run.",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class RunMetrics:
+    """
+    Counters and stage timings of a single run of a job (e.g. the crawler). They
+    are written to <prefix>.prom (Prometheus textfile format, e.g. for the node
+    exporter) and <prefix>.json, at the end of the run and every `interval`
+    seconds during it (see `maybe_write`). Files are replaced atomically, so a
+    scraper never reads a partial file. Safe to use from multiple threads.
+    """
+
+    def __init__(self, job: str, prefix: Optional[Path] = None, interval: float = 30):
+        self.job = job
+        self.prefix = prefix
+        self.interval = interval
+        self.started = time.time()
+        self.values: Dict[str, Dict[Labels, float]] = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._last_write = time.monotonic()
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self.values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Adds the wall clock time of the block to the stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc("stage_seconds", time.perf_counter() - start, stage=name)
+
+    def to_prometheus(self, running: bool) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.values.items()):
+                kind = "gauge" if name == "stage_seconds" else "counter"
+                metric = f"blaauw_{self.job}_{name}"
+                if kind == "counter":
+                    metric += "_total"
+                if name in HELP:
+                    lines.append(f"# HELP {metric} {HELP[name]}")
+                lines.append(f"# TYPE {metric} {kind}")
+                for labels, value in sorted(series.items()):
+                    label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+                    label_str = f"{{{label_str}}}" if label_str else ""
+                    lines.append(f"{metric}{label_str} {value:.15g}")
+
+        for name, value in (
+            ("start_time_seconds", self.started),
+            ("last_update_time_seconds", time.time()),
+            ("running", int(running)),
+        ):
+            lines.append(f"# TYPE blaauw_{self.job}_{name} gauge")
+            lines.append(f"blaauw_{self.job}_{name} {value:.15g}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self, running: bool) -> dict:
+        with self._lock:
+            metrics = {
+                name: {
+                    ",".join(f"{k}={v}" for k, v in labels): value
+                    for labels, value in sorted(series.items())
+                }
+                for name, series in sorted(self.values.items())
+            }
+        return {
+            "job": self.job,
+            "started": self.started,
+            "updated": time.time(),
+            "running": running,
+            "metrics": metrics,
+        }
+
+    def write(self, running: bool = False) -> None:
+        """Writes both files (if there is a prefix)."""
+        if self.prefix is None:
+            return
+        with self._write_lock:
+            self._last_write = time.monotonic()
+            for suffix, content in (
+                (".prom", self.to_prometheus(running)),
+                (".json", json.dumps(self.to_dict(running), indent=1)),
+            ):
+                path = self.prefix.with_name(self.prefix.name + suffix)
+                tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+                with open(tmp, "w") as f:
+                    f.write(content)
+                os.replace(tmp, path)
+
+    def maybe_write(self) -> None:
+        """Writes the files when the last write is more than `interval` ago."""
+        if time.monotonic() - self._last_write >= self.interval:
+            self.write(running=True)
@@ -1,12 +1,17 @@
 import enum
-from datetime import datetime
+from datetime import date, datetime
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Any, Dict, Optional
 
-from astropy.coordinates import EarthLocation, Latitude, Longitude
-from sqlalchemy import func
+from sqlalchemy import JSON, ForeignKey, Index, func
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
+from blaauw.core import paths
+
+if TYPE_CHECKING:
+    from astropy.coordinates import EarthLocation
+
 
 class ImageType(enum.Enum):
     BIAS = "Bias"
@@ -15,24 +20,19 @@ class ImageType(enum.Enum):
     LIGHT = "Light"
 
 
-RAW_GBT = Path("/net/vega/data/users/observatory/images/")
-RAW_LDST = Path("/net/vega/data/users/observatory/LDST")
-ASTROM_GBT = Path("/net/dataserver3/data/users/noelstorr/blaauwastrom/")
-PIPE_GBT = Path("/net/dataserver3/data/users/noelstorr/blaauwpipe/")
+BASE_DIR_MAP = paths.BASE_DIRS
 
-BASE_DIR_MAP = {
-    "RAW_GBT": RAW_GBT,
-    "RAW_LDST": RAW_LDST,
-    "ASTROM_GBT": ASTROM_GBT,
-    "PIPE_GBT": PIPE_GBT,
-}
+RAW_GBT = BASE_DIR_MAP.get("RAW_GBT")
+RAW_LDST = BASE_DIR_MAP.get("RAW_LDST")
+ASTROM_GBT = BASE_DIR_MAP.get("ASTROM_GBT")
+PIPE_GBT = BASE_DIR_MAP.get("PIPE_GBT")
 
-GBT_LOCATION = EarthLocation.from_geodetic(
-    lon=Longitude("06d32m11.20s"), lat=Latitude("+53d14m24.90s"), height=0
-)
-LDST_LOCATION = EarthLocation.from_geodetic(
-    lon=Longitude("06d14m05s"), lat=Latitude("+53d23m04s"), height=0
-)
+# (longitude, latitude) of the telescopes, see Telescope.location
+GEODETIC = {
+    "GBT": ("06d32m11.20s", "+53d14m24.90s"),
+    "LDST": ("06d14m05s", "+53d23m04s"),
+}
+_locations: Dict[str, "EarthLocation"] = {}
 
 
 class Telescope(enum.Enum):
@@ -41,23 +41,30 @@ class Telescope(enum.Enum):
 
     @classmethod
     def from_path(cls, path: Path):
-        parents = path.parents
-        if RAW_GBT in parents or ASTROM_GBT in parents:
-            return cls.GBT
-        if RAW_LDST in parents:
-            return cls.LDST
-        return None
-
-    def location(self) -> EarthLocation:
-        if self is Telescope.LDST:
-            return LDST_LOCATION
-        else:
-            return GBT_LOCATION
+        info = paths.classify(path)
+        if info is None or info.telescope is None:
+            return None
+        return cls[info.telescope]
+
+    def location(self) -> "EarthLocation":
+        # Built on first use, so importing the models does not need astropy
+        if self.name not in _locations:
+            from astropy.coordinates import EarthLocation, Latitude, Longitude
+
+            lon, lat = GEODETIC[self.name]
+            _locations[self.name] = EarthLocation.from_geodetic(
+                lon=Longitude(lon), lat=Latitude(lat), height=0
+            )
+        return _locations[self.name]
 
     def __str__(self) -> str:
         return self.name
 
 
+# JSONB in PostgreSQL, plain JSON (text) in SQLite
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+
+
 class Base(DeclarativeBase):
     __table_args__ = {"schema": "blaauw"}
     pass
@@ -96,7 +103,34 @@ class Observation(Base):
     has_wcs: Mapped[bool]
     wcs_filename: Mapped[Optional[str]]
 
+    # Astrometry.net solution (astrometry frames only)
+    plate_scale: Mapped[Optional[float]]
+    astrometry_odds: Mapped[Optional[float]]
+    astrometry_log_odds: Mapped[Optional[float]]
+    field_width: Mapped[Optional[float]]
+    field_height: Mapped[Optional[float]]
+    rotation: Mapped[Optional[float]]
+    parity: Mapped[Optional[str]]
+    astrometry_index: Mapped[Optional[int]]
+
+    # Pixel statistics (optional crawl stage)
+    pixel_median: Mapped[Optional[float]]
+    pixel_sigma: Mapped[Optional[float]]
+    pixel_min: Mapped[Optional[float]]
+    pixel_max: Mapped[Optional[float]]
+    saturated_fraction: Mapped[Optional[float]]
+
+    # Set when the file no longer exists on disk (see reconcile.py)
+    missing_since: Mapped[Optional[datetime]]
+
     # db metadata (automatic)
+    # Hash of the values set by the ingest, to skip updates which change nothing
+    content_hash: Mapped[Optional[str]]
+    # Ingest run which inserted the row (see history.observation_as_of), not known
+    # for rows inserted before it was recorded
+    created_run_id: Mapped[Optional[int]] = mapped_column(
+        ForeignKey("blaauw.ingest_run.id")
+    )
     created_at: Mapped[datetime] = mapped_column(
         insert_default=func.CURRENT_TIMESTAMP()
     )
@@ -106,3 +140,115 @@ class Observation(Base):
 
     def __repr__(self) -> str:
         return f"Observation(file_id={self.file_id}, date_obs='{self.date_obs}', image_type={self.image_type}, filter={self.filter}, telescope={self.telescope}, filename={self.filename.split('/')[-1]}, created_at='{self.created_at}', updated_at='{self.updated_at}')"
+
+
+class ObservationHeader(Base):
+    """
+    The full FITS header of an observation (without COMMENT and HISTORY), so any
+    keyword can be queried without adding a column for it. The GIN index supports
+    containment and key existence queries, e.g.:
+        SELECT observation_id FROM blaauw.header WHERE header @> '{"FILTER": "R"}'
+        SELECT observation_id FROM blaauw.header WHERE header ? 'FOCUSPOS'
+    """
+
+    __tablename__ = "header"
+    __table_args__ = (
+        Index("header_gin_idx", "header", postgresql_using="gin"),
+        {"schema": "blaauw"},
+    )
+    observation_id: Mapped[int] = mapped_column(
+        ForeignKey(Observation.id, ondelete="CASCADE"), primary_key=True
+    )
+    header: Mapped[dict] = mapped_column(JSONType)
+
+
+class LogsheetRow(Base):
+    """
+    A row of a scanned observer logsheet, imported from the logsheet database
+    (ScanRows table). The start/end time give the window in which the row applies,
+    observations in that window are linked to it via LogsheetLink.
+    """
+
+    __tablename__ = "logsheet_row"
+    # ROW_ID in the logsheet database
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    obs_date: Mapped[date] = mapped_column(index=True)
+    logsheet_file: Mapped[str]
+    row_num: Mapped[int]
+
+    interpreter: Mapped[Optional[str]]
+    google_vision: Mapped[Optional[str]]
+    blop_file: Mapped[Optional[str]]
+    cal_match: Mapped[Optional[str]]
+    sim_match: Mapped[Optional[str]]
+    mpc_match: Mapped[Optional[str]]
+    flag_nomatch: Mapped[Optional[bool]]
+    flag_interpreter: Mapped[Optional[bool]]
+
+    start_time: Mapped[Optional[datetime]]
+    end_time: Mapped[Optional[datetime]]
+
+
+class LogsheetLink(Base):
+    __tablename__ = "logsheet_link"
+    observation_id: Mapped[int] = mapped_column(
+        ForeignKey(Observation.id, ondelete="CASCADE"), primary_key=True
+    )
+    logsheet_row_id: Mapped[int] = mapped_column(
+        ForeignKey(LogsheetRow.id, ondelete="CASCADE"), primary_key=True, index=True
+    )
+
+
+class CatalogMatch(Base):
+    """
+    A source of an (offline) catalog within the field of an observation, see
+    crossmatch.py. The separation (arcmin) is from the pointing of the observation.
+    """
+
+    __tablename__ = "catalog_match"
+    __table_args__ = (
+        Index("catalog_match_source_idx", "catalog", "source_id"),
+        {"schema": "blaauw"},
+    )
+    catalog: Mapped[str] = mapped_column(primary_key=True)
+    observation_id: Mapped[int] = mapped_column(
+        ForeignKey(Observation.id, ondelete="CASCADE"), primary_key=True, index=True
+    )
+    source_id: Mapped[str] = mapped_column(primary_key=True)
+    ra: Mapped[float]
+    dec: Mapped[float]
+    separation: Mapped[float]
+
+
+class IngestRun(Base):
+    """
+    A single run of insert.py on an input file, referred to by the history.
+    """
+
+    __tablename__ = "ingest_run"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    source: Mapped[Optional[str]]
+    started_at: Mapped[datetime] = mapped_column(
+        insert_default=func.CURRENT_TIMESTAMP()
+    )
+
+
+class ObservationHistory(Base):
+    """
+    A change of a single field of an observation by an ingest run. Values are
+    stored as JSON (see history.to_json_value) to keep their type.
+    """
+
+    __tablename__ = "observation_history"
+    __table_args__ = (
+        Index("observation_history_obs_run_idx", "observation_id", "run_id"),
+        {"schema": "blaauw"},
+    )
+    id: Mapped[int] = mapped_column(primary_key=True)
+    observation_id: Mapped[int] = mapped_column(
+        ForeignKey(Observation.id, ondelete="CASCADE")
+    )
+    run_id: Mapped[int] = mapped_column(ForeignKey(IngestRun.id))
+    field: Mapped[str]
+    old_value: Mapped[Any] = mapped_column(JSONType, nullable=True)
+    new_value: Mapped[Any] = mapped_column(JSONType, nullable=True)
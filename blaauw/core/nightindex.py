@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import os
+import pickle
+import struct
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from blaauw.core.paths import FITS_SUFFIXES
+
+# Stored in every night directory (hidden, so it is not picked up as data)
+INDEX_NAME = ".blaauw-headers.idx"
+INDEX_MAGIC = b"BLAAUWIX"
+# Increase when the layout or the contents of the headers change, older indexes are
+# then ignored (and rewritten by the crawler)
+INDEX_VERSION = 2
+HEADERS_KIND = "headers"
+
+HeaderDict = Dict[str, Any]
+
+
+def index_kind(stats: bool = False, stats_stride: Optional[int] = None) -> str:
+    """
+    What the headers in an index contain, an index is only used for the same kind.
+    """
+    return f"stats-{stats_stride}" if stats else HEADERS_KIND
+
+
+class NightIndex:
+    """
+    All the (crawled) headers of a night directory in a single file, together with
+    the size and modification time of each file when it was read. A header is only
+    used when the file did not change since, so reading a finished night is a
+    single sequential read instead of opening all of its FITS files.
+
+    The file is the magic, the version (2 bytes) and a compressed pickle of
+    {"kind": kind, "files": {relative path: (size, mtime_ns, header)}}.
+    """
+
+    def __init__(self, night_dir: Path, kind: Optional[str] = HEADERS_KIND):
+        self.night_dir = night_dir
+        self.kind = kind
+        self.entries: Dict[str, Tuple[int, int, HeaderDict]] = {}
+        self._seen: Set[str] = set()
+        self._changed = False
+        self._resolved_dir = night_dir.resolve()
+
+    @property
+    def path(self) -> Path:
+        return self.night_dir / INDEX_NAME
+
+    @classmethod
+    def load(cls, night_dir: Path, kind: Optional[str] = HEADERS_KIND) -> NightIndex:
+        """
+        Loads the index of the night, an empty one when there is none (or when it
+        is of another version or kind, or is unreadable). With `kind` None, an
+        index of any kind is loaded (only for reading, e.g. the filenames).
+        """
+        index = cls(night_dir, kind)
+        try:
+            with open(index.path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return index
+
+        prefix_size = len(INDEX_MAGIC) + 2
+        if len(data) < prefix_size or not data.startswith(INDEX_MAGIC):
+            return index
+        (version,) = struct.unpack(">H", data[len(INDEX_MAGIC) : prefix_size])
+        if version != INDEX_VERSION:
+            return index
+
+        try:
+            contents = pickle.loads(zlib.decompress(data[prefix_size:]))
+        except Exception:
+            return index
+        if kind is None or contents["kind"] == kind:
+            index.entries = contents["files"]
+        return index
+
+    def _key(self, filename: Path) -> str:
+        return filename.relative_to(self.night_dir).as_posix()
+
+    def lookup(self, filename: Path, st: os.stat_result) -> Optional[HeaderDict]:
+        """
+        The header of the file, if it is in the index and did not change since.
+        """
+        key = self._key(filename)
+        entry = self.entries.get(key)
+        if entry is None or entry[:2] != (st.st_size, st.st_mtime_ns):
+            return None
+        self._seen.add(key)
+        header = dict(entry[2])
+        header["FILENAME"] = str(self._resolved_dir / key)
+        return header
+
+    def keep(self, filename: Path) -> None:
+        """Keeps the entry of the file (if any) on `write`, without looking it up."""
+        self._seen.add(self._key(filename))
+
+    def add(self, filename: Path, st: os.stat_result, header: HeaderDict) -> None:
+        key = self._key(filename)
+        self.entries[key] = (st.st_size, st.st_mtime_ns, header)
+        self._seen.add(key)
+        self._changed = True
+
+    def write(self) -> bool:
+        """
+        Writes the index (atomically), without the files which were not looked up
+        or added since loading it (i.e. removed ones). Returns whether it changed.
+        """
+        removed = self.entries.keys() - self._seen
+        if not self._changed and len(removed) == 0:
+            return False
+        for key in removed:
+            del self.entries[key]
+
+        data = zlib.compress(
+            pickle.dumps({"kind": self.kind, "files": self.entries}, protocol=4)
+        )
+        tmp = self.path.with_name(f".{INDEX_NAME}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(INDEX_MAGIC)
+            f.write(struct.pack(">H", INDEX_VERSION))
+            f.write(data)
+        os.replace(tmp, self.path)
+        self._changed = False
+        return True
+
+
+def read_headers(
+    night_dir: Path, kind: Optional[str] = HEADERS_KIND
+) -> Tuple[List[HeaderDict], List[Path]]:
+    """
+    The headers of the FITS files in the night directory from its index, and the
+    files which are not in the index or changed since it was written (e.g. new,
+    quarantined or unreadable files). Those are skipped one by one, the headers of
+    the other files are still returned. See `NightIndex.load` for the `kind`.
+    """
+    index = NightIndex.load(night_dir, kind)
+    headers = []
+    skipped = []
+    for filename in sorted(night_dir.rglob("*")):
+        if not filename.name.endswith(FITS_SUFFIXES):
+            continue
+        try:
+            header = index.lookup(filename, filename.stat())
+        except OSError:
+            header = None
+        if header is None:
+            skipped.append(filename)
+        else:
+            headers.append(header)
+    return headers, skipped
@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import datetime as dt
+import json
+import logging as log
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from blaauw.core.dirtree import stable_mtime
+from blaauw.core.paths import FITS_SUFFIXES
+
+# Night directories are named by date, e.g. 2020-04-17, 200417 or 20200417
+DATE_RE = re.compile(r"([0-9][0-9])?([0-9][0-9]-?[0-9][0-9]-?[0-9][0-9])")
+DIR_EXCEPTIONS = {"2222-22-22", "FISHEYE JAKE 20230407"}
+# Increase when the layout of the catalog changes, it is then rebuilt
+CATALOG_VERSION = 2
+
+
+class Night(NamedTuple):
+    name: str
+    date: dt.date
+    mtime_ns: int  # latest of the night directory and its subdirectories
+    num_files: int
+    num_bytes: int
+
+
+def parse_night(name: str) -> Optional[dt.date]:
+    """
+    The date of a night directory, None if it is not a night directory.
+    """
+    if name in DIR_EXCEPTIONS:
+        return None
+    match = DATE_RE.match(name)
+    if match is None:
+        return None
+    date_str = match.groups()[-1].replace("-", "")  # match the last group
+    try:
+        return dt.datetime.strptime(date_str, "%y%m%d").date()  # format: YYMMDD
+    except ValueError:
+        return None
+
+
+def tree_mtime(path: Path) -> int:
+    """
+    The latest modification time of the directory and its subdirectories. Files
+    usually land in subdirectories of a night (e.g. instrument/filter), which does
+    not change the modification time of the night directory itself.
+    """
+    mtime_ns = path.stat().st_mtime_ns
+    stack = [path]
+    while len(stack) > 0:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    mtime_ns = max(mtime_ns, entry.stat().st_mtime_ns)
+                    stack.append(Path(entry.path))
+    return stable_mtime(mtime_ns)
+
+
+def scan_night(path: Path) -> Tuple[int, int, int]:
+    """
+    The number of FITS files (also in subdirectories), their total size and the
+    latest modification time of the directories (see `tree_mtime`).
+    """
+    num_files = 0
+    num_bytes = 0
+    mtime_ns = 0
+    stack = [path]
+    while len(stack) > 0:
+        directory = stack.pop()
+        # Before listing it, so files added during the scan give a later one
+        mtime_ns = max(mtime_ns, directory.stat().st_mtime_ns)
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(Path(entry.path))
+                elif entry.name.endswith(FITS_SUFFIXES):
+                    num_files += 1
+                    num_bytes += entry.stat().st_size
+    return num_files, num_bytes, stable_mtime(mtime_ns)
+
+
+class NightCatalog:
+    """
+    The night directories of a base directory, with their date, modification time,
+    number of FITS files and size. It is stored between runs and refreshed
+    incrementally: the base directory is only listed again when its modification
+    time changed, which only finds new (and removed) nights.
+
+    The nights themselves are checked by `refresh_nights`, which scans a night
+    again when the latest modification time of its directory or any of its
+    subdirectories changed, i.e. when files were added or removed anywhere in it.
+    Files which are rewritten in place are not noticed.
+    """
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = base_dir
+        self.base_mtime_ns: Optional[int] = None
+        self.nights: Dict[str, Night] = {}
+
+    @classmethod
+    def load(cls, catalog_file: Path, base_dir: Path) -> NightCatalog:
+        """
+        Loads the catalog, an empty one when there is none (or when it is of another
+        version or base directory).
+        """
+        catalog = cls(base_dir)
+        if not catalog_file.exists():
+            return catalog
+
+        with open(catalog_file) as f:
+            data = json.load(f)
+        if data["version"] != CATALOG_VERSION or data["base"] != str(base_dir):
+            return catalog
+
+        catalog.base_mtime_ns = data["base_mtime_ns"]
+        for night in data["nights"]:
+            night["date"] = dt.date.fromisoformat(night["date"])
+            catalog.nights[night["name"]] = Night(**night)
+        return catalog
+
+    def save(self, catalog_file: Path) -> None:
+        data = {
+            "version": CATALOG_VERSION,
+            "base": str(self.base_dir),
+            "base_mtime_ns": self.base_mtime_ns,
+            "nights": [
+                {**night._asdict(), "date": night.date.isoformat()}
+                for night in self.nights.values()
+            ],
+        }
+        tmp = catalog_file.with_name(f".{catalog_file.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, catalog_file)
+
+    def _scan(self, name: str, date: dt.date) -> Night:
+        num_files, num_bytes, mtime_ns = scan_night(self.base_dir / name)
+        return Night(name, date, mtime_ns, num_files, num_bytes)
+
+    def refresh(self) -> bool:
+        """
+        Lists the base directory again if it changed since the last refresh, adding
+        new nights and removing the ones which are gone. Returns whether it changed.
+        Known nights are kept as they are, see `refresh_nights`.
+        """
+        base_mtime_ns = self.base_dir.stat().st_mtime_ns
+        if base_mtime_ns == self.base_mtime_ns:
+            return False
+
+        nights = {}
+        with os.scandir(self.base_dir) as it:
+            for entry in it:
+                if not entry.is_dir():
+                    continue
+                date = parse_night(entry.name)
+                if date is None:
+                    log.debug(f"Skipping {entry.name}: not a night directory")
+                    continue
+                night = self.nights.get(entry.name)
+                if night is None:
+                    night = self._scan(entry.name, date)
+                nights[entry.name] = night
+
+        self.nights = nights
+        self.base_mtime_ns = base_mtime_ns
+        return True
+
+    def refresh_nights(self, nights: List[Night]) -> List[Night]:
+        """
+        Scans the given nights again when the latest modification time of their
+        directories changed (e.g. the current night, which gets new files without
+        changing the base directory), and returns them up to date. Only the
+        directories are stat'ed for this, not the files in them.
+        """
+        result = []
+        for night in nights:
+            mtime_ns = tree_mtime(self.base_dir / night.name)
+            if mtime_ns == -1 or mtime_ns != night.mtime_ns:
+                night = self._scan(night.name, night.date)
+                self.nights[night.name] = night
+            result.append(night)
+        return result
+
+    def select(
+        self,
+        date: Optional[dt.date] = None,
+        from_date: Optional[dt.date] = None,
+        to_date: Optional[dt.date] = None,
+    ) -> List[Night]:
+        """
+        The nights of the date, or in the (inclusive) range, or all of them when
+        nothing is given, sorted on date. Note that dates are not unique!
+        """
+        nights = sorted(self.nights.values(), key=lambda n: (n.date, n.name))
+        if date is not None:
+            return [n for n in nights if n.date == date]
+        if from_date is not None or to_date is not None:
+            return [
+                n
+                for n in nights
+                if (from_date is None or n.date >= from_date)
+                and (to_date is None or n.date <= to_date)
+            ]
+        return nights
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import csv
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+PathLike = Union[str, Path]
+
+
+class Root(NamedTuple):
+    """
+    A base directory containing observations. The directories directly under it are
+    the nights, i.e. files are located at:
+        {path}/{night}/**/{filename}
+    """
+
+    name: str
+    path: Path
+    # Name of the models.Telescope, None if the files are not (yet) supported
+    telescope: Optional[str]
+
+
+class PathInfo(NamedTuple):
+    root: str
+    telescope: Optional[str]
+    night: str
+    stem: str
+
+
+DEFAULT_ROOTS = (
+    Root("RAW_GBT", Path("/net/vega/data/users/observatory/images/"), "GBT"),
+    Root("RAW_LDST", Path("/net/vega/data/users/observatory/LDST"), "LDST"),
+    Root(
+        "ASTROM_GBT", Path("/net/dataserver3/data/users/noelstorr/blaauwastrom/"), "GBT"
+    ),
+    Root("PIPE_GBT", Path("/net/dataserver3/data/users/noelstorr/blaauwpipe/"), None),
+)
+# CSV file with the root table (see load_roots), replacing the default one
+ROOTS_ENV = "BLAAUW_ROOTS"
+
+ASTROM_PREFIX = "astrom_"
+ASTROM_SUFFIX = ".astrom"
+COMPRESSED_SUFFIXES = (".fz", ".gz")
+
+FITS_EXTENSIONS = {"FIT", "fit", "FITS", "fits"}
+COMPRESSED_EXTENSIONS = {"fz", "gz"}
+
+# All filename suffixes of (possibly compressed) FITS files, e.g. '.fits.fz'
+FITS_SUFFIXES = tuple(f".{ext}" for ext in FITS_EXTENSIONS) + tuple(
+    f".{ext}.{comp}" for ext in FITS_EXTENSIONS for comp in COMPRESSED_EXTENSIONS
+)
+
+
+def load_roots(filename: PathLike) -> List[Root]:
+    """
+    Reads a root table from a CSV file with the columns: name, path, telescope.
+    An empty telescope means the files under that root have no telescope.
+    """
+    with open(filename, newline="") as f:
+        return [
+            Root(row["name"], Path(row["path"]), row["telescope"] or None)
+            for row in csv.DictReader(f)
+        ]
+
+
+def file_stem(name: str) -> str:
+    """
+    The filename without extension and without the astrometry designation, e.g.
+        astrom_160216_Li_00000157.fits -> 160216_Li_00000157
+        160216_Li_00000157.astrom.fits -> 160216_Li_00000157
+        160216_Li_00000157.fits.fz -> 160216_Li_00000157
+    """
+    if name.endswith(COMPRESSED_SUFFIXES):
+        name = name[:-3]
+    stem = name.rsplit(".", 1)[0] if "." in name else name
+    if stem.startswith(ASTROM_PREFIX):
+        stem = stem[len(ASTROM_PREFIX) :]
+    if stem.endswith(ASTROM_SUFFIX):
+        stem = stem[: -len(ASTROM_SUFFIX)]
+    return stem
+
+
+class PathClassifier:
+    """
+    Determines to which root, telescope and night a file belongs, by comparing the
+    path as a string with the prefixes of the roots. The result is memoized per
+    directory, so classifying all files in a directory costs a single dict lookup
+    per file.
+    """
+
+    def __init__(self, roots: Iterable[Root] = DEFAULT_ROOTS):
+        self.roots = list(roots)
+        # Longest prefix first, such that nested roots resolve to the deepest one
+        self._prefixes = sorted(
+            ((str(root.path).rstrip("/") + "/", root) for root in self.roots),
+            key=lambda item: len(item[0]),
+            reverse=True,
+        )
+        self._dir_cache: Dict[str, Optional[Tuple[Root, str]]] = {}
+
+    def _classify_dir(self, directory: str) -> Optional[Tuple[Root, str]]:
+        directory = directory + "/"
+        for prefix, root in self._prefixes:
+            if directory.startswith(prefix):
+                night = directory[len(prefix) :].split("/", 1)[0]
+                if night == "":
+                    # Directly in the root, so not part of a night
+                    return None
+                return root, night
+        return None
+
+    def classify(self, path: PathLike) -> Optional[PathInfo]:
+        """
+        Returns the root, telescope, night and stem of the `path`, or None when it
+        is not under one of the roots.
+        """
+        directory, _, name = os.fspath(path).rpartition("/")
+        try:
+            entry = self._dir_cache[directory]
+        except KeyError:
+            entry = self._dir_cache[directory] = self._classify_dir(directory)
+
+        if entry is None:
+            return None
+        root, night = entry
+        return PathInfo(root.name, root.telescope, night, file_stem(name))
+
+
+def configured_roots() -> Tuple[Root, ...]:
+    """
+    The root table from the file in the BLAAUW_ROOTS environment variable, the
+    default one (DEFAULT_ROOTS) when it is not set. The names of the default roots
+    are used by the code (e.g. ASTROM_GBT), so a table should keep them.
+    """
+    if os.environ.get(ROOTS_ENV):
+        return tuple(load_roots(os.environ[ROOTS_ENV]))
+    return DEFAULT_ROOTS
+
+
+ROOTS = configured_roots()
+# name -> path of the base directories
+BASE_DIRS = {root.name: root.path for root in ROOTS}
+CLASSIFIER = PathClassifier(ROOTS)
+
+
+def classify(path: PathLike) -> Optional[PathInfo]:
+    """
+    Classifies the `path` using the default root table, see `PathClassifier`.
+    """
+    return CLASSIFIER.classify(path)
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from astropy.io import fits
+from astropy.visualization import AsinhStretch, ZScaleInterval
+from PIL import Image
+
+from blaauw.core.fitsio import image_hdu
+
+PREVIEW_SIZE = 512
+PREVIEW_FORMATS = {"png": "PNG", "webp": "WEBP"}
+# Number of reduced rows processed at once, bounds the memory used per frame
+ROWS_PER_CHUNK = 64
+
+
+def cache_path(cache_dir: Path, file_id: str, mtime_ns: int, fmt: str = "png") -> Path:
+    """
+    Location of the preview of a file in the cache. The key is the hash of the
+    file_id and the modification time of the file, so a rewritten file gets a new
+    preview while moving the file around (same file_id) keeps the old one:
+        {cache_dir}/ab/abcdef....{fmt}
+    """
+    digest = hashlib.sha1(f"{file_id}:{mtime_ns}".encode()).hexdigest()
+    return cache_dir / digest[:2] / f"{digest}.{fmt}"
+
+
+def block_reduce(data: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Downsamples the 2D `data` by averaging blocks of `factor` x `factor` pixels.
+    Trailing rows/columns which do not fill an entire block are dropped.
+
+    The array is processed in chunks of rows, so a memory-mapped array is never
+    loaded (or converted to float) in its entirety.
+    """
+    height = data.shape[0] // factor
+    width = data.shape[1] // factor
+    reduced = np.empty((height, width), dtype=np.float32)
+
+    for start in range(0, height, ROWS_PER_CHUNK):
+        stop = min(start + ROWS_PER_CHUNK, height)
+        chunk = np.asarray(
+            data[start * factor : stop * factor, : width * factor], dtype=np.float32
+        )
+        reduced[start:stop] = chunk.reshape(stop - start, factor, width, factor).mean(
+            axis=(1, 3)
+        )
+    return reduced
+
+
+def stretch(data: np.ndarray) -> np.ndarray:
+    """
+    Maps the data to 8-bit grey values using a zscale interval followed by an asinh
+    stretch. Flips the image such that the FITS origin ends up in the lower left.
+    """
+    finite = np.isfinite(data)
+    if not finite.any():
+        return np.zeros(data.shape, dtype=np.uint8)
+    data = np.where(finite, data, np.nanmedian(data))
+
+    normalized = AsinhStretch(a=0.1)(ZScaleInterval()(data, clip=True))
+    return np.flipud((normalized * 255).astype(np.uint8))
+
+
+def make_preview(
+    filename: Path, target: Path, size: int = PREVIEW_SIZE, fmt: str = "png"
+) -> Path:
+    """
+    Creates the preview of the FITS file `filename` and writes it to `target`. The
+    pixel data is memory mapped and not scaled by astropy (scaling is linear, so it
+    does not change the stretched result), so only the reduced image is kept in
+    memory.
+    """
+    with fits.open(filename, memmap=True, do_not_scale_image_data=True) as hdul:
+        hdu = image_hdu(hdul)
+        if hdu is None:
+            raise ValueError(f"No image data in {filename}")
+
+        data = hdu.data
+        factor = max(1, -(-max(data.shape) // size))  # ceil division
+        reduced = block_reduce(data, factor)
+        del data
+
+    image = Image.fromarray(stretch(reduced), mode="L")
+
+    # Write to a temporary file first, to never leave half written previews behind
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    image.save(tmp, format=PREVIEW_FORMATS[fmt])
+    os.replace(tmp, target)
+    return target
+
+
+def generate_previews(
+    files: Iterable[Tuple[str, Path]],
+    cache_dir: Path,
+    fmt: str = "png",
+    size: int = PREVIEW_SIZE,
+    workers: Optional[int] = None,
+) -> tuple[int, int, List[tuple[Path, Exception]]]:
+    """
+    Generates the previews for all (file_id, filename) pairs in `files` using a pool
+    of `workers` processes. Files which already have a preview in the cache are
+    skipped.
+
+    Returns the number of generated previews, the number of cached previews and a
+    list of (filename, error) for the files that failed.
+    """
+    errors = []
+    num_cached = 0
+    num_generated = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for file_id, filename in files:
+            try:
+                mtime_ns = filename.stat().st_mtime_ns
+            except OSError as e:
+                errors.append((filename, e))
+                continue
+
+            target = cache_path(cache_dir, file_id, mtime_ns, fmt)
+            if target.exists():
+                num_cached += 1
+                continue
+
+            future = pool.submit(make_preview, filename, target, size, fmt)
+            futures[future] = filename
+
+        for future in as_completed(futures):
+            try:
+                future.result()
+                num_generated += 1
+            except Exception as e:
+                errors.append((futures[future], e))
+
+    return num_generated, num_cached, errors
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import datetime as dt
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+
+class QuarantineEntry(NamedTuple):
+    error: str  # class of the error
+    message: str
+    size: int
+    mtime_ns: int
+    failed_at: str  # ISO timestamp (UTC)
+
+
+class Quarantine:
+    """
+    Files which could not be read by the crawler, with the error and the size and
+    modification time of the file at that moment. They are skipped by later crawls
+    until the file changes (e.g. when it was fixed or completely copied).
+    """
+
+    def __init__(self):
+        self.entries: Dict[str, QuarantineEntry] = {}
+        # When disabled, quarantined files are tried again (and released if they
+        # can be read now)
+        self.skip = True
+        self._changed = False
+
+    @classmethod
+    def load(cls, quarantine_file: Path) -> Quarantine:
+        quarantine = cls()
+        if quarantine_file.exists():
+            with open(quarantine_file) as f:
+                quarantine.entries = {
+                    filename: QuarantineEntry(**entry)
+                    for filename, entry in json.load(f).items()
+                }
+        return quarantine
+
+    def save(self, quarantine_file: Path) -> None:
+        if not self._changed:
+            return
+        tmp = quarantine_file.with_name(f".{quarantine_file.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(
+                {k: v._asdict() for k, v in sorted(self.entries.items())}, f, indent=1
+            )
+        os.replace(tmp, quarantine_file)
+        self._changed = False
+
+    def is_quarantined(self, filename: Path, st: os.stat_result) -> bool:
+        """
+        Whether the file failed before and did not change since. A changed file is
+        released from the quarantine, so it is tried again.
+        """
+        entry = self.entries.get(str(filename))
+        if entry is None or not self.skip:
+            return False
+        if (entry.size, entry.mtime_ns) == (st.st_size, st.st_mtime_ns):
+            return True
+        self.release(filename)
+        return False
+
+    def add(self, filename: Path, st: os.stat_result, error: BaseException) -> None:
+        self.entries[str(filename)] = QuarantineEntry(
+            error=type(error).__name__,
+            message=str(error),
+            size=st.st_size,
+            mtime_ns=st.st_mtime_ns,
+            failed_at=dt.datetime.utcnow().isoformat(timespec="seconds"),
+        )
+        self._changed = True
+
+    def release(self, filename: Path) -> None:
+        if self.entries.pop(str(filename), None) is not None:
+            self._changed = True
+
+    def report(self) -> List[str]:
+        """
+        A line per quarantined file: failure time, error, file and message.
+        """
+        return [
+            f"{entry.failed_at}\t{entry.error}\t{filename}\t{entry.message}"
+            for filename, entry in sorted(
+                self.entries.items(), key=lambda item: item[1].failed_at
+            )
+        ]
@@ -0,0 +1,321 @@
+from __future__ import annotations
+
+import datetime as dt
+import enum
+import hashlib
+import math
+import os
+import pickle
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+from sqlalchemy import Boolean, DateTime, Float, Integer, and_, func, select
+from sqlalchemy.engine import Engine
+
+from blaauw.core import database, models
+
+_raw = models.Observation.__table__
+
+DateLike = Union[str, dt.date, dt.datetime]
+
+# Number of results kept in memory
+MEMORY_CACHE_SIZE = 32
+_memory_cache: "OrderedDict[tuple, Any]" = OrderedDict()
+# Shared by all queries without an explicit engine
+_default_engine: Optional[Engine] = None
+
+
+def _to_datetime(value: DateLike) -> dt.datetime:
+    if isinstance(value, dt.datetime):
+        return value
+    if isinstance(value, dt.date):
+        return dt.datetime.combine(value, dt.time())
+    return dt.datetime.fromisoformat(value)
+
+
+def _numpy_dtype(column) -> Any:
+    if isinstance(column.type, Boolean) and not column.nullable:
+        return np.bool_
+    if isinstance(column.type, Integer) and not column.nullable:
+        return np.int64
+    if isinstance(column.type, (Float, Integer)):
+        # Nullable integers become floats, with NaN for missing values
+        return np.float64
+    if isinstance(column.type, DateTime):
+        return "datetime64[us]"
+    return object
+
+
+def _arrow_type(column, pa) -> Any:
+    """The pyarrow type of the column (same as export.ParquetWriter)."""
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp("us")
+    return pa.string()
+
+
+def _plain(value: Any) -> Any:
+    return value.name if isinstance(value, enum.Enum) else value
+
+
+class Query:
+    """
+    Query on the archive from Python, e.g. in a notebook:
+
+        flats = (
+            Query()
+            .date_range("2020-04-17", "2020-04-20")
+            .telescope("GBT")
+            .image_type("FLAT")
+            .filter("R")
+            .to_records()
+        )
+
+    Every method returns a new Query, so queries can be built up step by step.
+    Results are built directly from batches of the cursor (no ORM objects) and are
+    cached by the normalized query, in memory and (optionally) on disk.
+    """
+
+    def __init__(
+        self,
+        engine: Optional[Engine] = None,
+        cache_dir: Optional[Union[str, Path]] = None,
+        max_age: float = 3600,
+    ):
+        """
+        `engine` defaults to the archive database (see database.get_engine). When
+        `cache_dir` is given, results are also cached on disk for `max_age` seconds.
+        """
+        self._engine = engine
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.max_age = max_age
+        self._filters: Dict[str, Any] = {}
+        self._columns: Tuple[str, ...] = tuple(
+            c.key for c in _raw.columns if c.key != "content_hash"
+        )
+        self._limit: Optional[int] = None
+
+    def _with(self, **kwargs) -> Query:
+        query = Query(self._engine, self.cache_dir, self.max_age)
+        query._filters = dict(self._filters)
+        query._columns = self._columns
+        query._limit = self._limit
+        for name, value in kwargs.items():
+            if name in ("columns", "limit"):
+                setattr(query, f"_{name}", value)
+            else:
+                query._filters[name] = value
+        return query
+
+    # Filters
+    def date_range(self, start: DateLike, end: DateLike) -> Query:
+        """Observations with start <= date_obs < end (UTC)."""
+        return self._with(date_range=(_to_datetime(start), _to_datetime(end)))
+
+    def telescope(self, *telescopes: Union[str, models.Telescope]) -> Query:
+        names = tuple(sorted(models.Telescope[_plain(t)].name for t in telescopes))
+        return self._with(telescope=names)
+
+    def image_type(self, *image_types: Union[str, models.ImageType]) -> Query:
+        names = tuple(sorted(models.ImageType[_plain(t)].name for t in image_types))
+        return self._with(image_type=names)
+
+    def filter(self, *filters: str) -> Query:
+        return self._with(filter=tuple(sorted(filters)))
+
+    def target(self, pattern: str) -> Query:
+        """Case insensitive match on the target, with * as wildcard."""
+        return self._with(target=pattern.replace("*", "%"))
+
+    def cone(self, ra: float, dec: float, radius: float) -> Query:
+        """Observations pointed within `radius` degrees of (ra, dec) in degrees."""
+        return self._with(cone=(float(ra), float(dec), float(radius)))
+
+    # Output
+    def columns(self, *columns: str) -> Query:
+        for name in columns:
+            if name not in _raw.c:
+                raise ValueError(f"Unknown column {name}")
+        return self._with(columns=tuple(columns))
+
+    def limit(self, limit: int) -> Query:
+        return self._with(limit=limit)
+
+    def key(self) -> tuple:
+        """The normalized query, used as the key of the cache."""
+        return (
+            tuple(sorted(self._filters.items())),
+            self._columns,
+            self._limit,
+        )
+
+    def statement(self):
+        stmt = select(*(_raw.c[name] for name in self._columns))
+        f = self._filters
+        if "date_range" in f:
+            start, end = f["date_range"]
+            stmt = stmt.where(_raw.c.date_obs >= start, _raw.c.date_obs < end)
+        if "telescope" in f:
+            stmt = stmt.where(
+                _raw.c.telescope.in_([models.Telescope[t] for t in f["telescope"]])
+            )
+        if "image_type" in f:
+            stmt = stmt.where(
+                _raw.c.image_type.in_([models.ImageType[t] for t in f["image_type"]])
+            )
+        if "filter" in f:
+            stmt = stmt.where(_raw.c.filter.in_(f["filter"]))
+        if "target" in f:
+            stmt = stmt.where(_raw.c.target_object.ilike(f["target"]))
+        if "cone" in f:
+            stmt = stmt.where(_cone_clause(*f["cone"]))
+        stmt = stmt.order_by(_raw.c.date_obs)
+        if self._limit is not None:
+            stmt = stmt.limit(self._limit)
+        return stmt
+
+    def _batches(self, batch_size: int) -> Iterable[List[Tuple[Any, ...]]]:
+        with self._engine_or_default().connect() as conn:
+            result = conn.execution_options(
+                stream_results=True, yield_per=batch_size
+            ).execute(self.statement())
+            for partition in result.partitions():
+                yield [tuple(_plain(v) for v in row) for row in partition]
+
+    def _engine_or_default(self) -> Engine:
+        global _default_engine
+        if self._engine is not None:
+            return self._engine
+        if _default_engine is None:
+            _default_engine = database.get_engine()
+        return _default_engine
+
+    def _cached(self, kind: str, build) -> Any:
+        """
+        Returns the cached result of this query, or builds and caches it. Both
+        caches expire after `max_age` seconds, as the archive changes by inserts.
+        """
+        key = (kind, str(self._engine_or_default().url)) + self.key()
+        if key in _memory_cache:
+            created, result = _memory_cache[key]
+            if time.time() - created < self.max_age:
+                _memory_cache.move_to_end(key)
+                return result
+            del _memory_cache[key]
+
+        result = None
+        disk_file = None
+        if self.cache_dir is not None:
+            digest = hashlib.sha1(repr(key).encode()).hexdigest()
+            disk_file = self.cache_dir / f"{digest}.pickle"
+            if (
+                disk_file.exists()
+                and time.time() - disk_file.stat().st_mtime < self.max_age
+            ):
+                with open(disk_file, "rb") as f:
+                    result = pickle.load(f)
+
+        if result is None:
+            result = build()
+            if disk_file is not None:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                tmp = disk_file.with_name(f".{disk_file.name}.{os.getpid()}.tmp")
+                with open(tmp, "wb") as f:
+                    pickle.dump(result, f)
+                os.replace(tmp, disk_file)
+
+        _memory_cache[key] = (time.time(), result)
+        if len(_memory_cache) > MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+        return result
+
+    def to_records(self, batch_size: int = 10000) -> np.recarray:
+        """The results as a NumPy record array."""
+
+        def build():
+            dtypes = [_numpy_dtype(_raw.c[name]) for name in self._columns]
+            chunks: List[List[np.ndarray]] = [[] for _ in self._columns]
+            for batch in self._batches(batch_size):
+                for i, values in enumerate(zip(*batch)):
+                    if dtypes[i] is np.float64:
+                        values = [math.nan if v is None else v for v in values]
+                    chunks[i].append(np.array(values, dtype=dtypes[i]))
+
+            arrays = [
+                np.concatenate(c) if len(c) > 0 else np.array([], dtype=dtype)
+                for c, dtype in zip(chunks, dtypes)
+            ]
+            return np.rec.fromarrays(arrays, names=list(self._columns))
+
+        return self._cached("records", build)
+
+    def to_arrow(self, batch_size: int = 10000):
+        """The results as a pyarrow Table (needs pyarrow)."""
+        import pyarrow as pa
+
+        def build():
+            # The types come from the columns, a batch with only NULLs in a column
+            # would otherwise get the null type and not match the other batches
+            schema = pa.schema(
+                [
+                    pa.field(name, _arrow_type(_raw.c[name], pa))
+                    for name in self._columns
+                ]
+            )
+            batches = [
+                pa.RecordBatch.from_arrays(
+                    [
+                        pa.array(values, type=field.type)
+                        for values, field in zip(zip(*batch), schema)
+                    ],
+                    schema=schema,
+                )
+                for batch in self._batches(batch_size)
+            ]
+            return pa.Table.from_batches(batches, schema=schema)
+
+        return self._cached("arrow", build)
+
+    def count(self) -> int:
+        """The number of results (not cached)."""
+        with self._engine_or_default().connect() as conn:
+            return conn.scalar(
+                select(func.count()).select_from(self.statement().subquery())
+            )
+
+
+def clear_cache() -> None:
+    """Clears the in memory cache (the disk cache expires by itself)."""
+    _memory_cache.clear()
+
+
+def _cone_clause(ra: float, dec: float, radius: float):
+    """
+    Angular distance <= radius (all in degrees). A declination band is checked
+    first, so the (more expensive) distance is only computed for few rows.
+    """
+    ra_rad, dec_rad = math.radians(ra), math.radians(dec)
+    distance = func.degrees(
+        func.acos(
+            func.least(
+                1.0,
+                func.sin(func.radians(_raw.c.dec)) * math.sin(dec_rad)
+                + func.cos(func.radians(_raw.c.dec))
+                * math.cos(dec_rad)
+                * func.cos(func.radians(_raw.c.ra) - ra_rad),
+            )
+        )
+    )
+    return and_(
+        _raw.c.ra.is_not(None),
+        _raw.c.dec.between(dec - radius, dec + radius),
+        distance <= radius,
+    )
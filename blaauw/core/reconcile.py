@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import os
+from typing import Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from blaauw.core.paths import FITS_SUFFIXES, Root
+
+T = TypeVar("T")
+
+# Collation per dialect which sorts strings like Python does (by code point, which
+# is the same as the byte order of UTF-8)
+SORT_COLLATIONS = {"postgresql": "C", "sqlite": "BINARY"}
+
+
+def walk_sorted(directory: str) -> Iterator[str]:
+    """
+    Yields the paths of all FITS files under `directory` in lexicographic order of
+    the full path (same as ORDER BY ... COLLATE "C" in PostgreSQL, see
+    SORT_COLLATIONS).
+
+    Only a single directory listing per level is kept in memory. The entries are
+    sorted with a '/' appended to directory names, which makes the depth first
+    walk produce the paths in sorted order (e.g. 'a/b.fits' < 'a/b/c.fits').
+
+    Directories which cannot be listed raise an OSError: skipping them would make
+    all their files look removed.
+    """
+    with os.scandir(directory) as it:
+        entries = [(e.name + "/" if e.is_dir() else e.name, e) for e in it]
+    entries.sort(key=lambda item: item[0])
+
+    for name, entry in entries:
+        if name.endswith("/"):
+            yield from walk_sorted(entry.path)
+        elif name.endswith(FITS_SUFFIXES):
+            yield entry.path
+
+
+def mounted_roots(roots: Iterable[Root]) -> Tuple[List[Root], List[Root]]:
+    """
+    Splits the roots in the ones which can be listed and have entries, and the
+    ones which cannot (e.g. not mounted, or a stale mount). The files of the
+    latter are unknown, rather than removed.
+    """
+    mounted, unavailable = [], []
+    for root in roots:
+        try:
+            with os.scandir(root.path) as it:
+                empty = next(it, None) is None
+        except OSError:
+            empty = True
+        (unavailable if empty else mounted).append(root)
+    return mounted, unavailable
+
+
+def disk_listing(roots: Iterable[Root]) -> Iterator[str]:
+    """
+    All FITS files under the roots, sorted. Since the roots do not contain each
+    other, walking them in sorted order keeps the entire listing sorted.
+    """
+    for prefix in sorted(str(root.path).rstrip("/") + "/" for root in roots):
+        yield from walk_sorted(prefix.rstrip("/"))
+
+
+def merge_diff(
+    disk: Iterable[str], db: Iterable[Tuple[str, T]]
+) -> Iterator[Tuple[Optional[str], Optional[T]]]:
+    """
+    Merges the sorted stream of filenames on disk with the sorted stream of
+    (filename, row) from the database. Yields:
+        (filename, row) when the file is in both
+        (filename, None) when the file is only on disk
+        (None, row) when the file is only in the database
+    Both streams are consumed one element at a time, so the memory use is constant.
+    """
+    disk_iter = iter(disk)
+    db_iter = iter(db)
+    disk_name = next(disk_iter, None)
+    db_entry = next(db_iter, None)
+
+    while disk_name is not None or db_entry is not None:
+        if db_entry is None or (disk_name is not None and disk_name < db_entry[0]):
+            yield disk_name, None
+            disk_name = next(disk_iter, None)
+        elif disk_name is None or db_entry[0] < disk_name:
+            yield None, db_entry[1]
+            db_entry = next(db_iter, None)
+        else:
+            yield disk_name, db_entry[1]
+            disk_name = next(disk_iter, None)
+            db_entry = next(db_iter, None)
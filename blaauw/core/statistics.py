@@ -0,0 +1,70 @@
+from typing import Dict, Optional
+
+import numpy as np
+from astropy.io import fits
+
+# Keys under which the statistics are stored in the header dict
+STAT_KEYS = ("PIX_MEDIAN", "PIX_SIGMA", "PIX_MIN", "PIX_MAX", "PIX_SATFRAC")
+
+# Scale factor between the median absolute deviation and sigma (for a gaussian)
+MAD_TO_SIGMA = 1.4826
+
+
+def saturation_level(hdu: fits.hdu.base._BaseHDU) -> Optional[float]:
+    """
+    Determines the (physical) value at which pixels are saturated. Uses the SATURATE
+    keyword if it exists, otherwise the maximum value of the integer type the data
+    is stored in. For floating point data without SATURATE, returns None.
+    """
+    if "SATURATE" in hdu.header:
+        return float(hdu.header["SATURATE"])
+
+    dtype = hdu.data.dtype
+    if not np.issubdtype(dtype, np.integer):
+        return None
+
+    bscale = hdu.header.get("BSCALE", 1.0)
+    bzero = hdu.header.get("BZERO", 0.0)
+    return float(np.iinfo(dtype).max) * bscale + bzero
+
+
+def frame_statistics(
+    hdu: fits.hdu.base._BaseHDU, stride: Optional[int] = None
+) -> Dict[str, Optional[float]]:
+    """
+    Computes pixel statistics of the image in `hdu`: median, robust sigma (based on
+    the median absolute deviation), min, max and the fraction of saturated pixels.
+
+    If `stride` is given, only every `stride`-th pixel of every `stride`-th row is
+    used. When the HDU is opened memory mapped (and unscaled, i.e. with
+    `do_not_scale_image_data=True`), only the pages containing sampled rows are
+    read from disk.
+    """
+    data = hdu.data
+    if stride is not None and stride > 1:
+        data = data[::stride, ::stride]
+
+    bscale = hdu.header.get("BSCALE", 1.0)
+    bzero = hdu.header.get("BZERO", 0.0)
+    sample = np.asarray(data, dtype=np.float32).ravel() * bscale + bzero
+    sample = sample[np.isfinite(sample)]
+
+    if sample.size == 0:
+        return {key: None for key in STAT_KEYS}
+
+    median = float(np.median(sample))
+    sigma = MAD_TO_SIGMA * float(np.median(np.abs(sample - median)))
+
+    saturation = saturation_level(hdu)
+    if saturation is not None:
+        saturated_fraction = float(np.count_nonzero(sample >= saturation)) / sample.size
+    else:
+        saturated_fraction = None
+
+    return {
+        "PIX_MEDIAN": median,
+        "PIX_SIGMA": sigma,
+        "PIX_MIN": float(sample.min()),
+        "PIX_MAX": float(sample.max()),
+        "PIX_SATFRAC": saturated_fraction,
+    }
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import Connection, wait
+from time import monotonic
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+
+# Seconds to wait for a killed worker to exit, after which it is abandoned
+KILL_TIMEOUT = 5.0
+
+
+class TaskTimeout(Exception):
+    """The task did not finish before the deadline, its worker was killed."""
+
+
+class WorkerDied(Exception):
+    """The worker exited (e.g. crashed) while running the task."""
+
+
+def _worker_main(func: Callable[[Any], Any], conn: Connection) -> None:
+    while True:
+        item = conn.recv()
+        if item is None:
+            break
+        try:
+            message = (func(item), None)
+        except Exception as e:
+            message = (None, e)
+        try:
+            conn.send(message)
+        except Exception as e:
+            # The result or error could not be pickled
+            conn.send((None, RuntimeError(f"{type(e).__name__}: {e}")))
+    conn.close()
+
+
+class _Worker:
+    def __init__(self, func: Callable[[Any], Any]):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_worker_main, args=(func, child_conn), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.item: Any = None
+        self.started = 0.0
+        self.num_tasks = 0
+
+    @property
+    def busy(self) -> bool:
+        return self.started > 0
+
+    def submit(self, item: Any) -> None:
+        self.item = item
+        self.started = monotonic()
+        self.conn.send(item)
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        self.kill()
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+            # A process stuck in uninterruptible I/O (e.g. a hung NFS mount) only
+            # exits when that returns, so it is abandoned (it is a daemon)
+            self.process.join(timeout=KILL_TIMEOUT)
+        self.conn.close()
+
+
+def supervised_map(
+    func: Callable[[Any], Any],
+    items: Iterable[Any],
+    workers: int = 1,
+    timeout: Optional[float] = None,
+    max_tasks: Optional[int] = None,
+) -> Iterator[Tuple[Any, Any, Optional[Exception]]]:
+    """
+    Runs `func` on all items in worker processes, yielding (item, result, error) in
+    the order they finish. Unlike a ProcessPoolExecutor, every worker runs a single
+    item at a time, so a worker which is still busy after `timeout` seconds (e.g.
+    on a stale NFS mount) can be killed and replaced. The item then gets a
+    TaskTimeout error. Workers are replaced after `max_tasks` items as well, to
+    bound their memory use.
+
+    `func` (and the items and results) need to be picklable.
+    """
+    pending = deque(items)
+    slots: list[Optional[_Worker]] = [None] * max(1, min(workers, len(pending)))
+
+    def finish(i: int, replace: bool) -> None:
+        worker = slots[i]
+        if replace:
+            worker.kill()
+        else:
+            worker.stop()
+        slots[i] = None
+
+    try:
+        while True:
+            # Give every idle worker an item, starting new workers where needed
+            for i in range(len(slots)):
+                if len(pending) == 0:
+                    break
+                if slots[i] is None:
+                    slots[i] = _Worker(func)
+                if not slots[i].busy:
+                    slots[i].submit(pending.popleft())
+
+            busy = [(i, w) for i, w in enumerate(slots) if w is not None and w.busy]
+            if len(busy) == 0:
+                break
+
+            wait_time = None
+            if timeout is not None:
+                deadline = min(w.started for _, w in busy) + timeout
+                wait_time = max(0.0, deadline - monotonic())
+            ready = wait([w.conn for _, w in busy], timeout=wait_time)
+
+            for i, worker in busy:
+                item = worker.item
+                if worker.conn in ready:
+                    try:
+                        result, error = worker.conn.recv()
+                    except EOFError:
+                        code = worker.process.exitcode
+                        finish(i, replace=True)
+                        yield item, None, WorkerDied(f"Exit code {code}")
+                        continue
+
+                    worker.started = 0.0
+                    worker.num_tasks += 1
+                    if max_tasks is not None and worker.num_tasks >= max_tasks:
+                        finish(i, replace=False)
+                    yield item, result, error
+                elif timeout is not None and monotonic() - worker.started > timeout:
+                    finish(i, replace=True)
+                    yield item, None, TaskTimeout(f"No result after {timeout}s")
+    finally:
+        for i, worker in enumerate(slots):
+            if worker is not None:
+                finish(i, replace=worker.busy)
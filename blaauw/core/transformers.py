@@ -1,10 +1,12 @@
+import math
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Any, Optional, Tuple
 
 import astropy.units as u
 from astropy.coordinates import SkyCoord
+from astropy.io.fits.card import Undefined
 
-from blaauw.core import models
+from blaauw.core import models, paths
 
 
 def imtyp_to_enum(
@@ -59,26 +61,13 @@ def path_to_file_id(path: Path) -> Optional[str]:
     /net/dataserver3/data/users/noelstorr/blaauwastrom/160216/astrom_160216_Li_00000157.fits
     -> GBT/160216/160216_Li_00000157
     """
-    p = Path(path)
+    info = paths.classify(path)
 
     # If no telescope is associated with the path, then the path is unknown
-    tel = models.Telescope.from_path(p)
-    if tel is None:
+    if info is None or info.telescope is None:
         return None
 
-    stem = p.stem
-    # Strip astrom designation
-    stem = stem.strip("astrom_").strip(".astrom")
-    file_id_format = "{telescope}/{date}/{filename}"
-
-    file_id = None
-    prnt = p.parents
-    if models.ASTROM_GBT in prnt or models.RAW_GBT in prnt or models.PIPE_GBT in prnt:
-        file_id = file_id_format.format(telescope=tel, date=p.parts[7], filename=stem)
-    elif models.RAW_LDST in prnt:
-        file_id = file_id_format.format(telescope=tel, date=p.parts[7], filename=stem)
-
-    return file_id
+    return f"{info.telescope}/{info.night}/{info.stem}"
 
 
 def get_horizontal(header: dict) -> Tuple[Optional[float], Optional[float]]:
@@ -116,3 +105,24 @@ def get_equitorial(header: dict) -> Tuple[Optional[float], Optional[float]]:
         return coord.ra.degree, coord.dec.degree
 
     return None, None
+
+
+def header_to_json(header: dict) -> dict:
+    """
+    Converts the header values into values which can be stored as JSON. Non-finite
+    floats (not allowed in JSON) become None, as do empty (undefined) values. Other
+    non-standard types are stored as their string representation.
+    """
+
+    def convert(value: Any) -> Any:
+        if value is None or isinstance(value, (bool, int, str)):
+            return value
+        if isinstance(value, float):
+            return value if math.isfinite(value) else None
+        if isinstance(value, (list, tuple)):
+            return [convert(v) for v in value]
+        if isinstance(value, Undefined):
+            return None
+        return str(value)
+
+    return {str(k): convert(v) for k, v in header.items()}
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import argparse
+import logging as log
+import pickle
+from pathlib import Path
+
+from blaauw.core.headerfile import (
+    CHUNK_SIZE,
+    HEADER_FILE_SUFFIX,
+    HeaderWriter,
+    is_header_file,
+)
+
+
+def main(args: argparse.Namespace):
+    output_dir = Path(args.output).resolve() if args.output else None
+    for filename in map(Path, args.file):
+        if is_header_file(filename):
+            log.info(f"Skipping {filename}: already a header file")
+            continue
+
+        # Legacy files are a single pickle, so these have to be loaded once
+        log.info(f"Reading {filename}")
+        with open(filename, "rb") as f:
+            headers = pickle.load(f)
+
+        output = filename.with_suffix(HEADER_FILE_SUFFIX)
+        if output_dir is not None:
+            output = output_dir / output.name
+        log.info(f"Writing {len(headers)} headers to {output}")
+        with HeaderWriter(output, chunk_size=args.chunk_size) as writer:
+            writer.write_many(headers)
+        del headers
+
+
+def parse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Converts legacy header pickles of the crawler to header files, which are read in chunks."
+    )
+    parser.add_argument(
+        "--file",
+        type=str,
+        nargs="+",
+        required=True,
+        help="Pickled header file(s), each is written to <name>.headers.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        help="Directory where the header files are written. Default is next to the input.",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=CHUNK_SIZE,
+        help=f"Number of headers per chunk. Default is {CHUNK_SIZE}.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    log.basicConfig(level=log.INFO)
+    main(parse())
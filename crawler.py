@@ -2,46 +2,83 @@ from __future__ import annotations
 
 import argparse
 import datetime as dt
-import pickle
-import re
-from itertools import chain
+from functools import partial
 from pathlib import Path
-from time import process_time
-from typing import Any, Dict, Iterable, List, Optional
+from time import perf_counter, process_time
+from typing import Any, Callable, Dict, Iterable, List, Optional
 
-from astropy.io import fits
 from tqdm import tqdm
 
-from blaauw.core.models import BASE_DIR_MAP, PIPE_GBT  # loading bar
+from blaauw.core.astrometry import parse_solution, solution_to_dict
+from blaauw.core.dirtree import DirTree
+from blaauw.core.headerfile import HEADER_FILE_SUFFIX, HeaderWriter
+from blaauw.core.metrics import RunMetrics
+from blaauw.core.nightindex import HEADERS_KIND, NightIndex, index_kind
+from blaauw.core.nights import NightCatalog
+from blaauw.core.paths import BASE_DIRS, FITS_SUFFIXES
+from blaauw.core.quarantine import Quarantine
+from blaauw.core.supervisor import supervised_map
 
 EXCLUDE_SET = {"COMMENT", "HISTORY"}
 PIPELINE_FILE_TYPES = {"Raw", "Reduced", "Correction"}
 BASE_DIR = "/net/dataserver3/data/users/noelstorr/blaauwpipe"
-FITS_EXTENSIONS = {"FIT", "fit", "FITS", "fits"}
 
 HeaderDict = Dict[str, Any]
 
 
-def header_to_dict(filename: Path) -> HeaderDict:
+def header_to_dict(
+    filename: Path, stats: bool = False, stats_stride: Optional[int] = None
+) -> HeaderDict:
     """
     Converts the FITS file pointed to by the filename, into a dict of header values.
     It strips unimportant entries, like COMMENT and HISTORY and derives some other
-    quantities like the PLATE_SCALE and ODDS from Astrometry.net
+    quantities like the PLATE_SCALE and ODDS from Astrometry.net (see
+    astrometry.parse_solution)
+
+    If `stats` is set, pixel statistics (see `frame_statistics`) are added as well,
+    sampling every `stats_stride`-th row/column of the image.
+
+    Compressed files (.fz and .gz) are supported, in which case the type of
+    compression is stored under COMPRESSION.
     """
-    with fits.open(filename) as hdul:
-        head_dict = dict(hdul[0].header)
+    # astropy is only imported when reading files (see `collect`), so the other
+    # commands start fast
+    from astropy.io import fits
+
+    from blaauw.core.fitsio import (
+        compression_type,
+        header_hdu,
+        image_hdu,
+        read_header,
+    )
+    from blaauw.core.statistics import frame_statistics
+
+    stat_dict = {}
+    if stats:
+        # Data is memory mapped and unscaled, so the statistics only read the sample
+        with fits.open(filename, memmap=True, do_not_scale_image_data=True) as hdul:
+            hdu = header_hdu(hdul)
+            head_dict = dict(hdu.header)
+            compression = compression_type(filename, hdu)
+
+            hdu = image_hdu(hdul)
+            if hdu is not None:
+                stat_dict = frame_statistics(hdu, stats_stride)
+    else:
+        header, compression = read_header(filename)
+        head_dict = dict(header)
 
     final_dict = {k: v for k, v in head_dict.items() if k not in EXCLUDE_SET}
 
     final_dict["FILENAME"] = str(filename.resolve())
 
-    plate_scale = find_plate_scale(head_dict)
-    if plate_scale is not None:
-        final_dict["PLATE_SCALE"] = plate_scale
+    if compression is not None:
+        final_dict["COMPRESSION"] = compression
 
-    odds = find_odds(head_dict)
-    if odds is not None:
-        final_dict["ODDS"] = odds
+    if "COMMENT" in head_dict:
+        solution = parse_solution(head_dict["COMMENT"], head_dict)
+        if solution is not None:
+            final_dict.update(solution_to_dict(solution))
 
     res = combine_cal_sources(head_dict)
     if res is not None:
@@ -53,53 +90,9 @@ def header_to_dict(filename: Path) -> HeaderDict:
         for i in range(1, n + 1):
             del final_dict[f"BP-SRC{i}"]
 
-    return final_dict
-
-
-def find_odds(dictionary: HeaderDict) -> Optional[float]:
-    """
-    Find the odds determined by Astrometry.net
-
-    This value is given inside a COMMENT header, hence we have to search for it
-    Will return the odds as a float if it exists, None otherwise.
-    """
-    try:
-        comment_entry = dictionary["COMMENT"]
-    except KeyError:
-        return None
-
-    for line in comment_entry:
-        str_line = line.strip()
-        if str_line.startswith("odds: "):
-            break
-    else:
-        return None
+    final_dict.update(stat_dict)
 
-    odds = float(line.split(" ")[1])
-    return odds
-
-
-def find_plate_scale(dictionary: HeaderDict) -> Optional[float]:
-    """
-    Find the plate scale determined by Astrometry.net
-
-    This value is given inside a COMMENT header, hence we have to search for it
-    Will return the plate scale as a float if it exists, None otherwise.
-    """
-    try:
-        comment_entry = dictionary["COMMENT"]
-    except KeyError:
-        return None
-
-    for line in comment_entry:
-        str_line = line.strip()
-        if str_line.startswith("scale: ") and str_line.endswith(" arcsec/pix"):
-            break
-    else:
-        return None
-
-    plate_scale = float(line.split(" ")[1])
-    return plate_scale
+    return final_dict
 
 
 def combine_cal_sources(dictionary: HeaderDict) -> Optional[tuple[list[str], int]]:
@@ -133,43 +126,162 @@ def search(base: Path, ftype: Optional[str] = None) -> list[Path]:
     For the given the type of image: (Raw, Reduced or Correction), and base path:
     list all the FITS files under this direction. Roughly:
         {base_path}/**/{ftype}/*.fits
-    but for all possible fit extensions (.fit, .FIT, .fits, .FITS)
+    but for all possible fit extensions (.fit, .FIT, .fits, .FITS), also when
+    compressed (.fz, .gz)
 
     If ftype is not specified, will just search
         {base_path}/**/*.fits
     """
-    if ftype is None:
-        files_iter = chain.from_iterable(
-            base.rglob(f"*.{ext}") for ext in FITS_EXTENSIONS
-        )
-    else:
-        files_iter = chain.from_iterable(
-            base.rglob(f"{ftype}/*.{ext}") for ext in FITS_EXTENSIONS
-        )
+    pattern = "*" if ftype is None else f"{ftype}/*"
+    # A single walk of the tree, instead of one for each extension
+    return [path for path in base.rglob(pattern) if path.name.endswith(FITS_SUFFIXES)]
 
-    return list(files_iter)
+
+def extract_file(
+    extract: Callable[[Path], HeaderDict], filename: Path
+) -> tuple[Path, Optional[HeaderDict], Optional[Exception]]:
+    """
+    Runs `extract` on a single file, catching the error (if any) so it can be
+    reported back from a worker process.
+    """
+    try:
+        return filename, extract(filename), None
+    except Exception as e:
+        return filename, None, e
 
 
 def collect(
-    files_iter: list[Path], progress_desc: str = ""
-) -> tuple[list[HeaderDict], list[tuple[Path, Exception]], float]:
-    start_time = process_time()
+    files_iter: list[Path],
+    progress_desc: str = "",
+    extract: Callable[[Path], HeaderDict] = header_to_dict,
+    workers: int = 1,
+    timeout: Optional[float] = None,
+    max_files_per_worker: Optional[int] = None,
+    metrics: Optional[RunMetrics] = None,
+) -> tuple[list[tuple[Path, HeaderDict]], list[tuple[Path, Exception]], float]:
+    """
+    Extracts the header dicts of all the files using `extract`. With more than one
+    worker (or a `timeout`), the files are distributed over supervised worker
+    processes: a file which takes longer than `timeout` seconds gets a TaskTimeout
+    error and its worker is replaced, and workers are replaced after
+    `max_files_per_worker` files (see supervised_map). The headers and errors are
+    counted in the `metrics` (if given), which are written periodically.
+    Returns the (filename, header) pairs, the errors and the (wall clock) duration.
+    """
+    start_time = perf_counter()
     headers = []
     errors = []
+    if len(files_iter) > 0:
+        # Import the FITS reading once here, so the (forked) workers inherit it
+        # instead of each importing it again
+        from blaauw.core import fitsio, statistics  # noqa: F401
+
+    if workers > 1 or timeout is not None:
+        results = supervised_map(
+            extract,
+            files_iter,
+            workers=workers,
+            timeout=timeout,
+            max_tasks=max_files_per_worker,
+        )
+    else:
+        results = map(partial(extract_file, extract), files_iter)
 
     # TODO: Make tqdm optional (for when this is called from somewhere else)
-    for filename in tqdm(files_iter, ncols=79, desc=progress_desc):
-        try:
-            head_dict = header_to_dict(filename)
-            headers.append(head_dict)
-        except Exception as e:
-            errors.append((filename, e))
-
-    end_time = process_time()
+    for filename, head_dict, err in tqdm(
+        results, total=len(files_iter), ncols=79, desc=progress_desc
+    ):
+        if err is None:
+            headers.append((filename, head_dict))
+        else:
+            errors.append((filename, err))
+        if metrics is not None:
+            if err is None:
+                metrics.inc("headers_extracted")
+            else:
+                metrics.inc("errors", type=type(err).__name__)
+            metrics.maybe_write()
+
+    end_time = perf_counter()
     duration = end_time - start_time
     return headers, errors, duration
 
 
+def collect_indexed(
+    files: list[tuple[Path, Path]],
+    indexes: Dict[Path, NightIndex],
+    progress_desc: str = "",
+    extract: Callable[[Path], HeaderDict] = header_to_dict,
+    workers: int = 1,
+    quarantine: Optional[Quarantine] = None,
+    metrics: Optional[RunMetrics] = None,
+    **collect_kwargs: Any,
+) -> tuple[list[HeaderDict], list[tuple[Path, Exception]], float]:
+    """
+    Same as `collect` for (night directory, filename) pairs, but the headers of
+    files which did not change since they were stored in the index of their night
+    are taken from it. Newly read headers are added to the index.
+
+    Files in the `quarantine` (which failed before and did not change since) are
+    skipped, files which fail now are added to it. Files which cannot be stat'ed
+    (e.g. removed since they were listed) are only reported as errors. Other
+    keyword arguments (and the `metrics`) are passed on to `collect`.
+    Returns the headers (in the order of the files), the errors and the duration.
+    """
+    headers: list[Optional[HeaderDict]] = []
+    to_read = {}  # filename -> (position, night directory, stat)
+    num_quarantined = 0
+    stat_errors: list[tuple[Path, Exception]] = []
+    for night_dir, filename in files:
+        try:
+            st = filename.stat()
+        except OSError as e:
+            # E.g. removed since it was listed, reported like a file which failed
+            stat_errors.append((filename, e))
+            continue
+        header = indexes[night_dir].lookup(filename, st)
+        if header is None:
+            if quarantine is not None and quarantine.is_quarantined(filename, st):
+                num_quarantined += 1
+                continue
+            to_read[filename] = (len(headers), night_dir, st)
+        headers.append(header)
+
+    num_indexed = len(files) - len(to_read) - num_quarantined - len(stat_errors)
+    if num_indexed > 0:
+        print(f"Using the index for {num_indexed} files")
+    if num_quarantined > 0:
+        print(f"Skipping {num_quarantined} quarantined files")
+    if metrics is not None:
+        metrics.inc("files_discovered", len(files))
+        metrics.inc("files_indexed", num_indexed)
+        metrics.inc("files_quarantined", num_quarantined)
+        for _, err in stat_errors:
+            metrics.inc("errors", type=type(err).__name__)
+
+    results, errors, duration = collect(
+        list(to_read.keys()),
+        progress_desc,
+        extract=extract,
+        workers=workers,
+        metrics=metrics,
+        **collect_kwargs,
+    )
+    for filename, header in results:
+        position, night_dir, st = to_read[filename]
+        headers[position] = header
+        if metrics is not None:
+            metrics.inc("bytes_read", st.st_size)
+        indexes[night_dir].add(filename, st, header)
+        if quarantine is not None:
+            quarantine.release(filename)
+    if quarantine is not None:
+        for filename, err in errors:
+            quarantine.add(filename, to_read[filename][2], err)
+
+    return [h for h in headers if h is not None], stat_errors + errors, duration
+
+
 def split_astrometry(iter: Iterable[str]):
     # TODO: not used?
     astrom_files = filter(
@@ -184,37 +296,87 @@ def split_astrometry(iter: Iterable[str]):
     return list(raw_files), list(astrom_files)
 
 
-def crawl(search_dirs: List[Path], pipeline=False) -> dict[str, List[HeaderDict]]:
-    result = {}
-    if pipeline:
-        for ftype in PIPELINE_FILE_TYPES:
-            # Seach for the files & collect into a list
-            files_iter = []
-            for search_dir in search_dirs:
-                files_iter.extend(search(search_dir, ftype))
-            headers, errors, duration = collect(files_iter, progress_desc=ftype)
+def crawl(
+    search_dirs: List[Path],
+    pipeline=False,
+    extract: Callable[[Path], HeaderDict] = header_to_dict,
+    workers: int = 1,
+    kind: str = HEADERS_KIND,
+    write_index: bool = False,
+    quarantine: Optional[Quarantine] = None,
+    timeout: Optional[float] = None,
+    max_files_per_worker: Optional[int] = None,
+    tree: Optional[DirTree] = None,
+    changed_only: bool = False,
+    metrics: Optional[RunMetrics] = None,
+) -> dict[str, List[HeaderDict]]:
+    """
+    Crawls the (night) directories, using their header index (see NightIndex) of
+    the given `kind` where it is up to date. With `write_index`, the indexes are
+    updated afterwards. Files which fail are kept in the `quarantine` (if given).
+    See `collect` for the `timeout` and `max_files_per_worker`.
 
-            # Store resulting headers
-            result[ftype] = headers
+    With a `tree` of the previous crawl, only the directories which changed since
+    are listed, and with `changed_only` only the files which are new or changed
+    since, or failed in it, are crawled. Files which fail are marked in the tree.
 
-            # Report
-            print("Took {}s".format(duration))
+    The counters and the time of the stages (search, extract, index) are kept in
+    the `metrics`, if given.
+    """
+    if metrics is None:
+        metrics = RunMetrics("crawler")
 
-            if len(errors) > 0:
-                print("")
-                print(f"{len(errors)} errors found:")
+    indexes = {
+        search_dir: NightIndex.load(search_dir, kind) for search_dir in search_dirs
+    }
 
-            for filename, err in errors:
-                print(filename, "|", err)
-    else:
+    listings = {}
+    if tree is not None:
+        with metrics.stage("search"):
+            for search_dir in search_dirs:
+                all_files, changed_files = tree.walk(search_dir)
+                listings[search_dir] = changed_files if changed_only else all_files
+                if changed_only:
+                    # The files which are not crawled again stay in the index
+                    for path in all_files:
+                        indexes[search_dir].keep(path)
+        print(f"Found {sum(len(f) for f in listings.values())} files to crawl")
+
+    result = {}
+    ftypes = PIPELINE_FILE_TYPES if pipeline else [None]
+    for ftype in ftypes:
         # Seach for the files & collect into a list
-        files_iter = []
-        for search_dir in search_dirs:
-            files_iter.extend(search(search_dir))
-        headers, errors, duration = collect(files_iter, progress_desc="All")
+        files = []
+        with metrics.stage("search"):
+            for search_dir in search_dirs:
+                if tree is None:
+                    paths = search(search_dir, ftype)
+                else:
+                    # Same as the pattern of `search`
+                    paths = [
+                        path
+                        for path in listings[search_dir]
+                        if ftype is None or path.parent.name == ftype
+                    ]
+                files.extend((search_dir, path) for path in paths)
+        with metrics.stage("extract"):
+            headers, errors, duration = collect_indexed(
+                files,
+                indexes,
+                progress_desc=ftype or "All",
+                extract=extract,
+                workers=workers,
+                quarantine=quarantine,
+                timeout=timeout,
+                max_files_per_worker=max_files_per_worker,
+                metrics=metrics,
+            )
 
         # Store resulting headers
-        result["Raw"] = headers
+        result[ftype or "Raw"] = headers
+        if tree is not None:
+            # Crawled again by the next --changed-only run
+            tree.add_failed(filename for filename, _ in errors)
 
         # Report
         print("Took {}s".format(duration))
@@ -226,10 +388,17 @@ def crawl(search_dirs: List[Path], pipeline=False) -> dict[str, List[HeaderDict]
         for filename, err in errors:
             print(filename, "|", err)
 
-    return result
-
+    if write_index:
+        num_written = 0
+        with metrics.stage("index"):
+            for search_dir, index in indexes.items():
+                try:
+                    num_written += index.write()
+                except OSError as e:
+                    print(f"Could not write index of {search_dir}: {e}")
+        print(f"Updated {num_written} index file(s)")
 
-DIR_EXEPTIONS = {"2222-22-22", "FISHEYE JAKE 20230407"}
+    return result
 
 
 def main() -> None:
@@ -242,29 +411,19 @@ def main() -> None:
         exit(1)
 
     # Construct the base directory from where to search (given as an argument)
-    base_directory = Path(BASE_DIR_MAP[args.base])
-
-    print(f"Indexing dates in {base_directory}...")
-    # List all valid dates in that directory
-    date_re = re.compile(r"([0-9][0-9])?([0-9][0-9]-?[0-9][0-9]-?[0-9][0-9])")
-    children = list(base_directory.iterdir())
-    dates = []
-    for child in children:
-        if child.name in DIR_EXEPTIONS:
-            print(f"Skipping {child.name}: exception...")
-            continue
-        match = date_re.match(child.name)
-        if match is None:
-            print(f"Skipping {child.name}: not matched...")
-            continue
-        date_str = match.groups()[-1]  # match the last group
-        date_str = date_str.replace("-", "")
-        date = dt.datetime.strptime(date_str, "%y%m%d").date()  # format: YYMMDD
-        # print(f"parsed: {date} from {child}")
-        dates.append((date, child))
+    base_directory = Path(BASE_DIRS[args.base])
 
-    dates.sort()
-    # Now we have a list with tuples: (date, path). Note that date is not unique!
+    # Counters and stage timings, written during and at the end of the run
+    metrics_prefix = Path(args.metrics).resolve() if args.metrics else None
+    metrics = RunMetrics("crawler", metrics_prefix, interval=args.metrics_interval)
+
+    # The night directories come from the catalog, which is only refreshed when
+    # the base directory changed
+    catalog_file = Path(args.catalog or f"nights-{args.base.lower()}.json").resolve()
+    with metrics.stage("catalog"):
+        catalog = NightCatalog.load(catalog_file, base_directory)
+        if catalog.refresh():
+            print(f"Indexed dates in {base_directory}")
 
     # Now we have 3 cases:
     # 1. We want to seach everything (--all)
@@ -275,49 +434,92 @@ def main() -> None:
     #    --> Find the dates in the range
 
     # Case 1.
-    search_dirs = []
     if args.all:
         print("Running for all dates")
-        search_dirs = [d[1] for d in dates]
+        nights = catalog.select()
         outfile_date = "all"
     # Case 3.
     elif args.to_date is not None and args.from_date is not None:
         print(f"Running for range: {args.from_date} - {args.to_date}")
-        search_dirs = [
-            d[1] for d in dates if d[0] >= args.from_date and d[0] <= args.to_date
-        ]
+        nights = catalog.select(from_date=args.from_date, to_date=args.to_date)
         outfile_date = (
             f"{args.from_date.strftime('%y%m%d')}-{args.to_date.strftime('%y%m%d')}"
         )
     # Case 2.
     else:
         print(f"Running for single date: {args.date}")
-        search_dirs = [d[1] for d in dates if d[0] == args.date]
+        nights = catalog.select(date=args.date)
         outfile_date = args.date.strftime("%y%m%d")
 
-    # print("To search")
-    # for d in search_dirs:
-    #     print(d)
+    with metrics.stage("catalog"):
+        nights = catalog.refresh_nights(nights)
+        catalog.save(catalog_file)
+
+    if args.list_nights:
+        for night in nights:
+            print(f"{night.date}\t{night.name}\t{night.num_files}\t{night.num_bytes}")
+        return
+
+    print(
+        f"Found {len(nights)} nights, {sum(n.num_files for n in nights)} files, {sum(n.num_bytes for n in nights) / 1e9:.1f} GB"
+    )
+    search_dirs = [base_directory / night.name for night in nights]
 
     total_time = process_time()
 
-    pipeline = PIPE_GBT == base_directory
-    result = crawl(search_dirs, pipeline)
+    # Files which failed before are skipped until they change (see quarantine.py)
+    quarantine_file = Path(args.quarantine).resolve()
+    quarantine = Quarantine.load(quarantine_file)
+    quarantine.skip = not args.retry_quarantined
+
+    # Directory listings of the previous crawl, only changed directories are listed
+    tree = None
+    if args.dir_tree is not None:
+        tree_file = Path(args.dir_tree).resolve()
+        tree = DirTree.load(tree_file)
+    elif args.changed_only:
+        print("--changed-only needs a --dir-tree")
+        exit(1)
+
+    pipeline = BASE_DIRS.get("PIPE_GBT") == base_directory
+    extract = header_to_dict
+    if args.stats:
+        print(f"Computing pixel statistics (stride {args.stats_stride})")
+        extract = partial(header_to_dict, stats=True, stats_stride=args.stats_stride)
+    result = crawl(
+        search_dirs,
+        pipeline,
+        extract=extract,
+        workers=args.workers,
+        kind=index_kind(args.stats, args.stats_stride),
+        write_index=args.write_index,
+        quarantine=quarantine,
+        timeout=args.timeout,
+        max_files_per_worker=args.max_files_per_worker,
+        tree=tree,
+        changed_only=args.changed_only,
+        metrics=metrics,
+    )
+    quarantine.save(quarantine_file)
+    if tree is not None:
+        tree.save(tree_file)
 
     # TODO: alternatively, store the entire `result` dict -> copying easier
     for ftype, headers in result.items():
-        # Save using pickle
+        # Save in chunks (see headerfile.py), so they can be read back in batches
         write_location = (
-            output_directory / f"{outfile_date}-{ftype.lower()}-headers.pickle"
+            output_directory / f"{outfile_date}-{ftype.lower()}{HEADER_FILE_SUFFIX}"
         )
         print(f"Writing to {write_location}...")
-        with open(write_location, "wb") as f:
-            pickle.dump(headers, f)
+        with metrics.stage("write"):
+            with HeaderWriter(write_location, append=args.append) as writer:
+                writer.write_many(headers)
 
     # Report total time
     end_time = process_time()
     total_duration = end_time - total_time
     print(f"The total process took {total_duration}s")
+    metrics.write()
 
 
 def parse() -> argparse.Namespace:
@@ -350,13 +552,94 @@ def parse() -> argparse.Namespace:
         type=lambda s: dt.datetime.strptime(s, "%y%m%d").date(),
         help="Specifies the end date of the (inclusive) range to search in (format YYMMDD). Also needs --from-date.",
     )
+    parser.add_argument(
+        "--catalog",
+        type=str,
+        help="File with the catalog of night directories of the base directory. Default is nights-<base>.json.",
+    )
+    parser.add_argument(
+        "--list-nights",
+        action="store_true",
+        help="Only list the selected nights (date, directory, number of files, bytes).",
+    )
+    parser.add_argument(
+        "--dir-tree",
+        type=str,
+        help="File with the directory listings of the previous crawl, only directories which changed since are listed again.",
+    )
+    parser.add_argument(
+        "--changed-only",
+        action="store_true",
+        help="Only crawl the files which are new or changed since the previous crawl, or failed in it (needs --dir-tree).",
+    )
+    parser.add_argument(
+        "--quarantine",
+        type=str,
+        default="quarantine.json",
+        help="File with the files which could not be read, they are skipped until they change. Default is quarantine.json.",
+    )
+    parser.add_argument(
+        "--retry-quarantined",
+        action="store_true",
+        help="Also try the quarantined files again.",
+    )
     parser.add_argument(
         "--base",
         type=str,
-        choices=list(BASE_DIR_MAP.keys()),
+        choices=list(BASE_DIRS.keys()),
         default="RAW_GBT",
         help="Defined where the crawler will look for fits files.",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes used to read the files. Default is 1.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=60,
+        help="Seconds a single file may take, after which its worker is killed and the file is skipped (and quarantined). Default is 60.",
+    )
+    parser.add_argument(
+        "--max-files-per-worker",
+        type=int,
+        default=1000,
+        help="Worker processes are replaced after this many files, to limit their memory use. Default is 1000.",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Also compute pixel statistics (median, sigma, min, max, saturation) of each frame.",
+    )
+    parser.add_argument(
+        "--stats-stride",
+        type=int,
+        default=4,
+        help="Only use every n-th row and column for the statistics, 1 uses the full image. Default is 4.",
+    )
+    parser.add_argument(
+        "--append",
+        action="store_true",
+        help="Append the headers to the existing output file(s), instead of replacing them.",
+    )
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        help="Write the run metrics (files, errors, bytes, time per stage) to <METRICS>.prom (Prometheus textfile format) and <METRICS>.json.",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=30,
+        help="Seconds between writes of the metrics during the run. Default is 30.",
+    )
+    parser.add_argument(
+        "--write-index",
+        action="store_true",
+        help="Store the headers in an index file in each night directory, which is used (also by later runs) for the files that did not change.",
+    )
     return parser.parse_args()
 
 
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import argparse
+import logging as log
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from blaauw.core import crossmatch, database, models
+
+LINK_BATCH_SIZE = 10000
+
+
+def main(args: argparse.Namespace):
+    start_time = perf_counter()
+    catalog_file = Path(args.catalog)
+    name = args.name or catalog_file.name.split(".")[0]
+    log.info(f"Reading catalog {name} from {catalog_file}")
+    catalog = crossmatch.load_catalog(
+        catalog_file, args.ra_column, args.dec_column, id_column=args.id_column
+    )
+    log.info(f"- Building the tree of {len(catalog.ra)} sources")
+    index = crossmatch.CatalogIndex(catalog)
+
+    engine = database.get_engine(args.dsn, echo=args.echo)
+    models.Base.metadata.create_all(engine)
+
+    raw = models.Observation
+    with Session(engine) as session:
+        # Only science frames have a meaningful pointing
+        obs_stmt = (
+            select(
+                raw.id,
+                raw.ra,
+                raw.dec,
+                raw.field_width,
+                raw.field_height,
+                raw.telescope,
+            )
+            .where(raw.ra.is_not(None))
+            .where(raw.dec.is_not(None))
+            .where(raw.image_type == models.ImageType.LIGHT)
+        )
+        rows = session.execute(obs_stmt).all()
+        log.info(f"Matching {len(rows)} observations")
+
+        ids = np.array([r.id for r in rows], dtype=np.int64)
+        ra = np.array([r.ra for r in rows], dtype=float)
+        dec = np.array([r.dec for r in rows], dtype=float)
+        radius = crossmatch.field_radius(
+            np.array([r.field_width for r in rows], dtype=float),
+            np.array([r.field_height for r in rows], dtype=float),
+            np.array([str(r.telescope) for r in rows]),
+            default=args.radius,
+        )
+
+        # The catalog file is leading, so replace its matches in one go
+        session.execute(
+            delete(models.CatalogMatch).where(models.CatalogMatch.catalog == name)
+        )
+        num_matches = 0
+        for positions, sources, separation in index.match(
+            ra, dec, radius, workers=args.workers
+        ):
+            for start in range(0, len(positions), LINK_BATCH_SIZE):
+                batch = sources[start : start + LINK_BATCH_SIZE]
+                columns = zip(
+                    ids[positions[start : start + LINK_BATCH_SIZE]].tolist(),
+                    catalog.ids[batch].tolist(),
+                    catalog.ra[batch].tolist(),
+                    catalog.dec[batch].tolist(),
+                    separation[start : start + LINK_BATCH_SIZE].tolist(),
+                )
+                session.execute(
+                    insert(models.CatalogMatch),
+                    [
+                        {
+                            "catalog": name,
+                            "observation_id": o,
+                            "source_id": source_id,
+                            "ra": source_ra,
+                            "dec": source_dec,
+                            "separation": sep,
+                        }
+                        for o, source_id, source_ra, source_dec, sep in columns
+                    ],
+                )
+            num_matches += len(positions)
+            log.info(f"- {num_matches} matches")
+
+        session.commit()
+
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+    log.info(f"- Matched {len(rows)} observations with {len(catalog.ra)} sources")
+    log.info(f"- Stored {num_matches} matches of {name}")
+    log.info(f"- Took {perf_counter() - start_time:.1f}s")
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+
+
+def parse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Stores which sources of a local catalog are in the field of each observation."
+    )
+    parser.add_argument(
+        "--catalog",
+        type=str,
+        required=True,
+        help="Catalog file: CSV/TSV, FITS (first binary table) or Parquet.",
+    )
+    parser.add_argument(
+        "--name",
+        type=str,
+        help="Name under which the matches are stored. Default is the file name without extension.",
+    )
+    parser.add_argument("--ra-column", type=str, default="ra", help="Default is ra.")
+    parser.add_argument("--dec-column", type=str, default="dec", help="Default is dec.")
+    parser.add_argument(
+        "--id-column",
+        type=str,
+        help="Column with the source identifiers. Default is the row number.",
+    )
+    parser.add_argument(
+        "--radius",
+        type=float,
+        default=crossmatch.DEFAULT_RADIUS,
+        help=f"Radius (arcmin) for observations without a field size (and no other observations of their telescope with one). Default is {crossmatch.DEFAULT_RADIUS}.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of threads used to query the tree, -1 uses all CPUs. Default is 1.",
+    )
+    parser.add_argument(
+        "--dsn",
+        type=str,
+        help="Database to connect to. Default is $BLAAUW_DSN, or the server/local database.",
+    )
+    parser.add_argument("--echo", action="store_true")
+    parser.add_argument("--debug", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse()
+    if args.debug:
+        log.basicConfig(level=log.DEBUG)
+    else:
+        log.basicConfig(level=log.INFO)
+    main(args)
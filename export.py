@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import logging as log
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from sqlalchemy import select
+
+from blaauw.core import database, logsheets, models
+from blaauw.core.export import WRITERS, convert_row
+
+_raw = models.Observation.__table__
+
+# Internal columns which are not exported
+EXCLUDED_COLUMNS = {"content_hash"}
+
+
+def build_query(args: argparse.Namespace):
+    columns = [c for c in _raw.columns if c.key not in EXCLUDED_COLUMNS]
+    stmt = select(*columns)
+
+    # A night runs from noon to noon (see also the documentation in the rd)
+    if args.from_date is not None:
+        stmt = stmt.where(_raw.c.date_obs >= logsheets.night_start(args.from_date))
+    if args.to_date is not None:
+        end = logsheets.night_start(args.to_date + dt.timedelta(days=1))
+        stmt = stmt.where(_raw.c.date_obs < end)
+    if args.telescope is not None:
+        stmt = stmt.where(_raw.c.telescope == models.Telescope[args.telescope])
+    if args.image_type is not None:
+        stmt = stmt.where(_raw.c.image_type == models.ImageType[args.image_type])
+    if args.filter is not None:
+        stmt = stmt.where(_raw.c.filter == args.filter)
+
+    # Sort on the split key, so only a single output file is open at a time
+    if args.split == "night":
+        stmt = stmt.order_by(_raw.c.date_obs, _raw.c.id)
+    elif args.split == "telescope":
+        stmt = stmt.order_by(_raw.c.telescope, _raw.c.id)
+    else:
+        stmt = stmt.order_by(_raw.c.id)
+    return columns, stmt
+
+
+def split_key(split: Optional[str]) -> Callable[[Any], str]:
+    if split == "night":
+        return lambda row: logsheets.night_of(row.date_obs).strftime("%y%m%d")
+    if split == "telescope":
+        return lambda row: row.telescope.name
+    return lambda row: "all"
+
+
+def main(args: argparse.Namespace):
+    output_directory = Path(args.output).resolve()
+    if not output_directory.is_dir():
+        print(f"Given output directory {output_directory} does not exist.")
+        exit(1)
+
+    writer_class, extension = WRITERS[args.format]
+    columns, stmt = build_query(args)
+    key_of = split_key(args.split)
+
+    engine = database.get_engine(args.dsn, echo=args.echo)
+
+    num_rows = 0
+    num_files = 0
+    key = None
+    writer = None
+    with engine.connect() as conn:
+        # Server side cursor, only a single batch is in memory at any time
+        result = conn.execution_options(
+            stream_results=True, yield_per=args.batch_size
+        ).execute(stmt)
+
+        for partition in result.partitions():
+            batch = []
+            for row in partition:
+                row_key = key_of(row)
+                if row_key != key:
+                    if writer is not None:
+                        writer.write_batch(batch)
+                        writer.close()
+                        batch = []
+                    key = row_key
+                    filename = output_directory / f"{args.prefix}-{key}.{extension}"
+                    log.info(f"Writing to {filename}")
+                    writer = writer_class(filename, columns)
+                    num_files += 1
+                batch.append(convert_row(row))
+
+            writer.write_batch(batch)
+            num_rows += len(partition)
+
+    if writer is not None:
+        writer.close()
+
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+    log.info(f"- Exported {num_rows} rows into {num_files} file(s)")
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+
+
+def parse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=".",
+        help="Directory where the exported files are stored. Default is the current directory.",
+    )
+    parser.add_argument("--prefix", type=str, default="blaauw-raw")
+    parser.add_argument(
+        "--format", type=str, choices=list(WRITERS.keys()), default="parquet"
+    )
+    parser.add_argument(
+        "--split",
+        type=str,
+        choices=["night", "telescope"],
+        help="Write a separate file per night or telescope. Default is a single file.",
+    )
+    parser.add_argument(
+        "--from-date",
+        type=lambda s: dt.datetime.strptime(s, "%y%m%d").date(),
+        help="First night to export (format YYMMDD).",
+    )
+    parser.add_argument(
+        "--to-date",
+        type=lambda s: dt.datetime.strptime(s, "%y%m%d").date(),
+        help="Last night to export (format YYMMDD).",
+    )
+    parser.add_argument(
+        "--telescope", type=str, choices=[t.name for t in models.Telescope]
+    )
+    parser.add_argument(
+        "--image-type", type=str, choices=[t.name for t in models.ImageType]
+    )
+    parser.add_argument("--filter", type=str)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument(
+        "--dsn",
+        type=str,
+        help="Database to connect to. Default is $BLAAUW_DSN, or the server/local database.",
+    )
+    parser.add_argument("--echo", action="store_true")
+    parser.add_argument("--debug", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse()
+    if args.debug:
+        log.basicConfig(level=log.DEBUG)
+    else:
+        log.basicConfig(level=log.INFO)
+    main(args)
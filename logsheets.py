@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import argparse
+import logging as log
+from pathlib import Path
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from blaauw.core import database, logsheets, models
+
+LINK_BATCH_SIZE = 10000
+
+
+def main(args: argparse.Namespace):
+    log.info(f"Reading logsheet rows from {args.file}")
+    rows = logsheets.read_scan_rows(Path(args.file))
+    logsheets.assign_windows(rows)
+    num_timed = sum(1 for row in rows if row["start_time"] is not None)
+    log.info(f"- Found {len(rows)} rows, {num_timed} with a time")
+
+    engine = database.get_engine(args.dsn, echo=args.echo)
+    models.Base.metadata.create_all(engine)
+
+    with Session(engine) as session:
+        # The logsheet database is leading, so replace everything in one go
+        log.info("Replacing logsheet rows")
+        session.execute(delete(models.LogsheetLink))
+        session.execute(delete(models.LogsheetRow))
+        if len(rows) > 0:
+            session.execute(insert(models.LogsheetRow), rows)
+
+        timed = [row for row in rows if row["start_time"] is not None]
+        num_links = 0
+        if len(timed) > 0:
+            # Fetch only the observations in the range of the logsheets
+            first = min(row["start_time"] for row in timed)
+            last = max(row["end_time"] for row in timed)
+            obs_stmt = (
+                select(models.Observation.date_obs, models.Observation.id)
+                .where(models.Observation.date_obs >= first)
+                .where(models.Observation.date_obs < last)
+            )
+            observations = [tuple(r) for r in session.execute(obs_stmt)]
+            log.info(f"Linking with {len(observations)} observations")
+
+            links = logsheets.link_observations(timed, observations)
+            for start in range(0, len(links), LINK_BATCH_SIZE):
+                batch = links[start : start + LINK_BATCH_SIZE]
+                session.execute(
+                    insert(models.LogsheetLink),
+                    [{"observation_id": o, "logsheet_row_id": r} for o, r in batch],
+                )
+            num_links = len(links)
+
+        session.commit()
+
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+    log.info(f"- Imported {len(rows)} logsheet rows, {num_links} links")
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+
+
+def parse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--file",
+        type=str,
+        required=True,
+        help="Location of the logsheet (SQLite) database, DB_logrows.",
+    )
+    parser.add_argument(
+        "--dsn",
+        type=str,
+        help="Database to connect to. Default is $BLAAUW_DSN, or the server/local database.",
+    )
+    parser.add_argument("--echo", action="store_true")
+    parser.add_argument("--debug", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse()
+    if args.debug:
+        log.basicConfig(level=log.DEBUG)
+    else:
+        log.basicConfig(level=log.INFO)
+    main(args)
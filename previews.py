@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import argparse
+import logging as log
+from pathlib import Path
+from time import perf_counter
+
+from blaauw.core import nightindex, transformers
+from blaauw.core.headerfile import read_headers
+from blaauw.core.previews import PREVIEW_FORMATS, PREVIEW_SIZE, generate_previews
+
+
+def main(args: argparse.Namespace):
+    headers = []
+    for night_dir in map(Path, args.night or []):
+        # Any kind of index, only the filenames are used
+        night_headers, skipped = nightindex.read_headers(night_dir, kind=None)
+        log.info(f"Read {len(night_headers)} headers from the index of {night_dir}")
+        for filename in skipped:
+            log.warning(f"Skipping {filename}: not in the night index (or changed)")
+        headers += night_headers
+    for input_file in args.file or []:
+        log.info(f"Reading headers from {input_file}")
+        headers += read_headers([Path(input_file)])
+
+    files = []
+    for header in headers:
+        filename = Path(header["FILENAME"])
+        file_id = transformers.path_to_file_id(filename)
+        if file_id is None:
+            log.warning(f"Skipping {filename}: unknown file id")
+            continue
+        files.append((file_id, filename))
+
+    cache_dir = Path(args.cache_dir).resolve()
+    log.info(f"Generating previews for {len(files)} files in {cache_dir}")
+
+    start_time = perf_counter()
+    num_generated, num_cached, errors = generate_previews(
+        files, cache_dir, fmt=args.format, size=args.size, workers=args.workers
+    )
+    duration = perf_counter() - start_time
+
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+    log.info(f"- Generated {num_generated}, Cached {num_cached}, Failed {len(errors)}")
+    log.info(f"- Took {duration:.1f}s")
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+    for filename, err in errors:
+        log.warning(f"{filename} | {err}")
+
+
+def parse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--night",
+        type=str,
+        nargs="+",
+        help="Night directories, previews are made for the files in their index (see crawler.py --write-index).",
+    )
+    source.add_argument(
+        "--file",
+        type=str,
+        nargs="+",
+        help="Header file(s) produced by the crawler, previews are made for all files in it.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default="previews",
+        help="Directory where the previews are stored. Default is ./previews",
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        choices=list(PREVIEW_FORMATS.keys()),
+        default="png",
+    )
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=PREVIEW_SIZE,
+        help=f"Maximum size (in pixels) of the longest side of the preview. Default is {PREVIEW_SIZE}.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes. Default is the number of CPUs.",
+    )
+    parser.add_argument("--debug", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse()
+    if args.debug:
+        log.basicConfig(level=log.DEBUG)
+    else:
+        log.basicConfig(level=log.INFO)
+    main(args)
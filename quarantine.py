@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+from blaauw.core.quarantine import Quarantine
+
+
+def main(args: argparse.Namespace):
+    quarantine_file = Path(args.file)
+    quarantine = Quarantine.load(quarantine_file)
+
+    if args.release:
+        for filename in args.release:
+            quarantine.release(Path(filename))
+        quarantine.save(quarantine_file)
+
+    for line in quarantine.report():
+        print(line)
+    print(f"{len(quarantine.entries)} quarantined file(s)")
+
+
+def parse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Lists the files which could not be read by the crawler."
+    )
+    parser.add_argument(
+        "--file",
+        type=str,
+        default="quarantine.json",
+        help="Quarantine file of the crawler. Default is quarantine.json.",
+    )
+    parser.add_argument(
+        "--release",
+        type=str,
+        nargs="+",
+        help="Remove these files from the quarantine, so the next crawl tries them again.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse())
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import argparse
+import logging as log
+import tempfile
+from typing import Iterator, List, Sequence, Tuple
+
+from sqlalchemy import bindparam, case, delete, func, or_, select, update
+from sqlalchemy.engine import Connection, Row
+
+from blaauw.core import database, models, paths, transformers
+from blaauw.core.reconcile import (
+    SORT_COLLATIONS,
+    disk_listing,
+    merge_diff,
+    mounted_roots,
+)
+
+BATCH_SIZE = 10000
+
+_raw = models.Observation.__table__
+
+
+def db_listing(conn: Connection, prefixes: Sequence[str]) -> Iterator[Tuple[str, Row]]:
+    """
+    Streams (filename, row) of all observations under the prefixes, sorted by
+    filename in byte order (same as the disk listing), using a server side cursor.
+    """
+    stmt = (
+        select(_raw.c.filename, _raw.c.id, _raw.c.file_id, _raw.c.missing_since)
+        .where(or_(*(_raw.c.filename.startswith(p, autoescape=True) for p in prefixes)))
+        .order_by(_raw.c.filename.collate(SORT_COLLATIONS[conn.dialect.name]))
+    )
+    result = conn.execution_options(stream_results=True, yield_per=BATCH_SIZE).execute(
+        stmt
+    )
+    for row in result:
+        yield row.filename, row
+
+
+def move_key(filename: str, file_id: str) -> Tuple[str, str]:
+    """
+    Files are only matched as moved within the same root, so e.g. a raw file is
+    never taken for a moved astrom_ file (with the same file_id) of another root.
+    """
+    info = paths.classify(filename)
+    return (info.root if info is not None else "", file_id)
+
+
+def apply_changes(
+    conn: Connection,
+    moves: List[Tuple[int, str, str]],
+    missing: List[int],
+    reappeared: List[int],
+    delete_missing: bool,
+) -> None:
+    if len(moves) > 0:
+        new = bindparam("b_new")
+        old = bindparam("b_old")
+        move_stmt = (
+            update(_raw)
+            .where(_raw.c.id == bindparam("b_id"))
+            .values(
+                filename=new,
+                raw_filename=case(
+                    (_raw.c.raw_filename == old, new), else_=_raw.c.raw_filename
+                ),
+                wcs_filename=case(
+                    (_raw.c.wcs_filename == old, new), else_=_raw.c.wcs_filename
+                ),
+                missing_since=None,
+            )
+        )
+        conn.execute(
+            move_stmt,
+            [{"b_id": i, "b_old": o, "b_new": n} for i, o, n in moves],
+        )
+
+    for start in range(0, len(missing), BATCH_SIZE):
+        ids = missing[start : start + BATCH_SIZE]
+        if delete_missing:
+            conn.execute(delete(_raw).where(_raw.c.id.in_(ids)))
+        else:
+            conn.execute(
+                update(_raw)
+                .where(_raw.c.id.in_(ids))
+                .where(_raw.c.missing_since.is_(None))
+                .values(missing_since=func.now())
+            )
+
+    for start in range(0, len(reappeared), BATCH_SIZE):
+        ids = reappeared[start : start + BATCH_SIZE]
+        conn.execute(update(_raw).where(_raw.c.id.in_(ids)).values(missing_since=None))
+
+
+def main(args: argparse.Namespace):
+    roots = [root for root in paths.ROOTS if args.root is None or root.name in args.root]
+    roots, unavailable = mounted_roots(roots)
+    for root in unavailable:
+        # Otherwise all its rows would be marked missing (or deleted)
+        log.warning(f"Skipping {root.name}: {root.path} is empty or cannot be read")
+    if len(roots) == 0:
+        log.error("No base directories to reconcile")
+        exit(1)
+    prefixes = [str(root.path).rstrip("/") + "/" for root in roots]
+    log.info(f"Reconciling {', '.join(root.name for root in roots)}")
+
+    engine = database.get_engine(args.dsn, echo=args.echo)
+
+    num_present = 0
+    num_new = 0
+    missing = {}  # (root, file_id) -> (id, filename), only the (few) missing rows
+    reappeared = []
+    # Files which are only on disk can be many (e.g. not inserted yet), so they are
+    # kept in a temporary file instead of in memory
+    with tempfile.TemporaryFile("w+") as only_disk:
+        with engine.connect() as conn:
+            for filename, row in merge_diff(
+                disk_listing(roots), db_listing(conn, prefixes)
+            ):
+                if row is None:
+                    num_new += 1
+                    file_id = transformers.path_to_file_id(filename)
+                    if file_id is not None:
+                        root, _ = move_key(filename, file_id)
+                        only_disk.write(f"{root}\t{file_id}\t{filename}\n")
+                elif filename is None:
+                    missing[move_key(row.filename, row.file_id)] = (
+                        row.id,
+                        row.filename,
+                    )
+                else:
+                    num_present += 1
+                    if row.missing_since is not None:
+                        reappeared.append(row.id)
+
+        # Moved files: missing in the database, but with the same file_id on disk
+        # under the same root
+        moves = []
+        only_disk.seek(0)
+        for line in only_disk:
+            root, file_id, filename = line.rstrip("\n").split("\t", 2)
+            entry = missing.pop((root, file_id), None)
+            if entry is not None:
+                moves.append((entry[0], entry[1], filename))
+
+    for _, old, new in moves:
+        log.debug(f"Moved: {old} -> {new}")
+    for _, filename in missing.values():
+        log.debug(f"Missing: {filename}")
+
+    if not args.dry_run:
+        with engine.begin() as conn:
+            apply_changes(
+                conn,
+                moves,
+                [obs_id for obs_id, _ in missing.values()],
+                reappeared,
+                args.delete,
+            )
+
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+    log.info(f"- Present {num_present}, Only on disk {num_new - len(moves)}")
+    log.info(
+        f"- Moved {len(moves)}, Missing {len(missing)} ({'deleted' if args.delete else 'marked'}), Reappeared {len(reappeared)}"
+    )
+    if args.dry_run:
+        log.info("- Dry run, nothing was changed")
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+
+
+def parse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--root",
+        type=str,
+        nargs="+",
+        choices=[root.name for root in paths.ROOTS],
+        help="Only reconcile the files under these base directories. Default is all.",
+    )
+    parser.add_argument(
+        "--delete",
+        action="store_true",
+        help="Delete the rows of missing files, instead of setting missing_since.",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only report the differences, do not change the database.",
+    )
+    parser.add_argument(
+        "--dsn",
+        type=str,
+        help="Database to connect to. Default is $BLAAUW_DSN, or the server/local database.",
+    )
+    parser.add_argument("--echo", action="store_true")
+    parser.add_argument("--debug", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse()
+    if args.debug:
+        log.basicConfig(level=log.DEBUG)
+    else:
+        log.basicConfig(level=log.INFO)
+    main(args)
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import argparse
+import logging as log
+from pathlib import Path
+
+from blaauw.core import database
+from blaauw.core.coverage import COVERAGE_ORDER, CoverageMaps, num_pixels
+
+
+def main(args: argparse.Namespace):
+    coverage_file = Path(args.file).resolve()
+    if args.rebuild:
+        log.info("Rebuilding the coverage maps from the database")
+        engine = database.get_engine(args.dsn, echo=args.echo)
+        coverage = CoverageMaps.from_table(engine, args.order)
+        coverage.save(coverage_file)
+    else:
+        coverage = CoverageMaps.load(coverage_file)
+        if coverage is None:
+            log.error(f"No coverage maps in {coverage_file}, create them with --rebuild")
+            exit(1)
+
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+    log.info(f"- Coverage maps of {coverage_file} (HEALPix order {coverage.order})")
+    keys = coverage.keys(args.telescope, args.filter, args.image_type)
+    for key in keys:
+        _, counts, exposure = coverage.maps[key]
+        telescope, filter, image_type = key
+        fraction = len(counts) / num_pixels(coverage.order)
+        log.info(
+            f"- {telescope:5} {filter or '-':10} {image_type or '-':6}"
+            f" {counts.sum():8d} frames {exposure.sum() / 3600:9.1f} h"
+            f" {100 * fraction:7.3f}% of the sky"
+        )
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+
+
+def parse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Lists (or rebuilds) the sky coverage maps per telescope, filter and image type."
+    )
+    parser.add_argument(
+        "--file",
+        type=str,
+        default="coverage.npz",
+        help="File with the coverage maps. Default is coverage.npz.",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Build the maps again from all observations in the database (e.g. after rows were removed).",
+    )
+    parser.add_argument(
+        "--order",
+        type=int,
+        default=COVERAGE_ORDER,
+        help=f"HEALPix order of rebuilt maps. Default is {COVERAGE_ORDER}.",
+    )
+    parser.add_argument("--telescope", type=str, help="Only list this telescope.")
+    parser.add_argument("--filter", type=str, help="Only list this filter.")
+    parser.add_argument(
+        "--image-type", type=str, help="Only list this image type, e.g. LIGHT."
+    )
+    parser.add_argument(
+        "--dsn",
+        type=str,
+        help="Database to connect to. Default is $BLAAUW_DSN, or the server/local database.",
+    )
+    parser.add_argument("--echo", action="store_true")
+    parser.add_argument("--debug", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse()
+    if args.debug:
+        log.basicConfig(level=log.DEBUG)
+    else:
+        log.basicConfig(level=log.INFO)
+    main(args)
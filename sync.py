@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import json
+import logging as log
+import os
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from blaauw.core import database, history, models
+from blaauw.core.ingest import insert_headers, upsert_observations
+
+_raw = models.Observation.__table__
+_header = models.ObservationHeader.__table__
+
+# SQLite stores updated_at with a resolution of a second, so rows updated in the
+# same second as the last synced one are sent again (and skipped by their hash)
+SYNC_OVERLAP = dt.timedelta(seconds=1)
+
+
+def load_state(state_file: Path, target: str) -> Optional[dt.datetime]:
+    """
+    Returns the updated_at of the last row synced to `target`, None when nothing
+    was synced yet.
+    """
+    if not state_file.exists():
+        return None
+
+    with open(state_file) as f:
+        state = json.load(f)
+    if target not in state:
+        return None
+    return dt.datetime.fromisoformat(state[target])
+
+
+def save_state(state_file: Path, target: str, last_updated: dt.datetime) -> None:
+    state = {}
+    if state_file.exists():
+        with open(state_file) as f:
+            state = json.load(f)
+    state[target] = last_updated.isoformat()
+
+    tmp = state_file.with_name(f".{state_file.name}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, state_file)
+
+
+def main(args: argparse.Namespace):
+    source = database.get_engine(f"sqlite:///{args.sqlite}", echo=args.echo)
+    target = database.get_engine(args.dsn, echo=args.echo)
+    target_name = target.url.render_as_string(hide_password=True)
+    state_file = Path(args.state or f"{args.sqlite}.sync.json")
+
+    since = None if args.restart else load_state(state_file, target_name)
+    log.info(f"Syncing {args.sqlite} to {target_name}, changes since {since}")
+
+    models.Base.metadata.create_all(target)
+    with Session(target) as session:
+        run = models.IngestRun(source=f"sync {Path(args.sqlite).resolve()}")
+        session.add(run)
+        session.commit()
+        run_id = run.id
+    log.info(f"- Ingest run {run_id}")
+
+    stmt = select(_raw).order_by(_raw.c.updated_at, _raw.c.id)
+    if since is not None:
+        stmt = stmt.where(_raw.c.updated_at >= since - SYNC_OVERLAP)
+
+    num_inserted = 0
+    num_updated = 0
+    num_unchanged = 0
+    with source.connect() as conn:
+        result = conn.execution_options(
+            stream_results=True, yield_per=args.batch_size
+        ).execute(stmt)
+
+        for partition in result.partitions():
+            # Ids differ between the databases, so rows are matched on file_id
+            observations = {
+                row.id: models.Observation(
+                    **{k: row._mapping[k] for k in history.TRACKED_COLUMNS}
+                )
+                for row in partition
+            }
+            header_stmt = select(_header).where(
+                _header.c.observation_id.in_(observations.keys())
+            )
+            headers = {
+                row.observation_id: row.header for row in conn.execute(header_stmt)
+            }
+
+            with Session(target) as session:
+                inserted, updated, unchanged, _ = upsert_observations(
+                    list(observations.values()), session, run_id
+                )
+                insert_headers(
+                    list(headers.values()),
+                    [observations[obs_id] for obs_id in headers.keys()],
+                    session,
+                )
+                session.commit()
+            # Rows are sorted on updated_at, so everything before it is synced
+            save_state(state_file, target_name, partition[-1].updated_at)
+
+            num_inserted += inserted
+            num_updated += updated
+            num_unchanged += unchanged
+            log.debug(f"Synced {num_inserted + num_updated + num_unchanged} rows")
+
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+    log.info(
+        f"- Inserted {num_inserted}, Updated {num_updated}, Unchanged {num_unchanged}"
+    )
+    log.info(
+        "--------------------------------------------------------------------------------"
+    )
+
+
+def parse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sqlite",
+        type=str,
+        required=True,
+        help="SQLite database filled by insert.py --dsn sqlite:///<file>.",
+    )
+    parser.add_argument(
+        "--dsn",
+        type=str,
+        help="Database to sync to. Default is $BLAAUW_DSN, or the server/local database.",
+    )
+    parser.add_argument(
+        "--state",
+        type=str,
+        help="File with the last synced change per database. Default is <sqlite>.sync.json.",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Send all rows, instead of only the ones changed since the last sync.",
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--echo", action="store_true")
+    parser.add_argument("--debug", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse()
+    if args.debug:
+        log.basicConfig(level=log.DEBUG)
+    else:
+        log.basicConfig(level=log.INFO)
+    main(args)
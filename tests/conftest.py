@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import List, Tuple
+
+import pytest
+from sqlalchemy.orm import Session
+
+from blaauw.core import database, ingest, models, paths
+from blaauw.core.paths import Root
+
+NIGHT = "160216"
+
+
+@pytest.fixture
+def engine(tmp_path: Path):
+    """An empty SQLite archive database."""
+    engine = database.get_engine(f"sqlite:///{tmp_path / 'blaauw.sqlite'}")
+    models.Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def roots(tmp_path: Path, monkeypatch) -> Tuple[Root, Root]:
+    """A raw and an astrometry root under the temporary directory, used as the
+    root table of the paths module."""
+    roots = (
+        Root("RAW_GBT", tmp_path / "raw", "GBT"),
+        Root("ASTROM_GBT", tmp_path / "astrom", "GBT"),
+    )
+    for root in roots:
+        root.path.mkdir()
+    monkeypatch.setattr(paths, "ROOTS", roots)
+    monkeypatch.setattr(paths, "BASE_DIRS", {root.name: root.path for root in roots})
+    monkeypatch.setattr(paths, "CLASSIFIER", paths.PathClassifier(roots))
+    return roots
+
+
+def make_header(filename: Path, **values) -> dict:
+    """A minimal header of a GBT frame, with `values` added or replaced."""
+    return {
+        "FILENAME": str(filename),
+        "DATE-OBS": "2016-02-16T20:00:00",
+        "XBINNING": 1,
+        "YBINNING": 1,
+        "EXPTIME": 10.0,
+        "IMAGETYP": "Light Frame",
+        "FILTER": "i",
+        "OBJECT": "M42",
+        **values,
+    }
+
+
+def raw_file(roots: Tuple[Root, Root], num: int) -> Path:
+    return roots[0].path / NIGHT / "STL-6303E" / "i" / f"{NIGHT}_Li_{num:08d}.fits"
+
+
+def astrom_file(roots: Tuple[Root, Root], num: int) -> Path:
+    return roots[1].path / NIGHT / f"astrom_{NIGHT}_Li_{num:08d}.fits"
+
+
+def upsert(engine, headers: List[dict]) -> Tuple[int, tuple]:
+    """Upserts the headers in a new ingest run, returns the run id and the counts
+    of `ingest.upsert_observations`."""
+    with Session(engine) as session:
+        run = models.IngestRun(source="test")
+        session.add(run)
+        session.flush()
+        observations = [ingest.create_observation(header) for header in headers]
+        counts = ingest.upsert_observations(observations, session, run.id)
+        session.commit()
+        return run.id, counts
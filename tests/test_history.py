@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+from conftest import make_header, raw_file, upsert
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from blaauw.core import history, models
+
+
+def observation_id(session: Session, filename) -> int:
+    return session.scalar(
+        select(models.Observation.id).where(
+            models.Observation.filename == str(filename)
+        )
+    )
+
+
+def test_observation_as_of(engine, roots):
+    filename = raw_file(roots, 0)
+    runs = [
+        upsert(engine, [make_header(filename, FILTER=band)])[0] for band in "RVB"
+    ]
+    # A run which did not change it
+    runs.append(upsert(engine, [make_header(filename, FILTER="B")])[0])
+
+    with Session(engine) as session:
+        obs_id = observation_id(session, filename)
+        bands = [
+            history.observation_as_of(session, obs_id, run_id)["filter"]
+            for run_id in runs
+        ]
+        assert bands == ["R", "V", "B", "B"]
+
+
+def test_observation_as_of_before_insert(engine, roots):
+    first, _ = upsert(engine, [make_header(raw_file(roots, 0))])
+    upsert(engine, [make_header(raw_file(roots, 1))])
+
+    with Session(engine) as session:
+        assert history.observation_as_of(
+            session, observation_id(session, raw_file(roots, 1)), first
+        ) is None
+        # Unknown run
+        assert history.observation_as_of(
+            session, observation_id(session, raw_file(roots, 0)), first + 10
+        ) is None
+
+
+def test_recomputed_floats_are_equal():
+    row = {field: None for field in history.TRACKED_COLUMNS}
+    other = dict(row, alt=45.0 + 1e-13)
+    row["alt"] = 45.0
+    assert history.content_hash(row) == history.content_hash(other)
+    assert history.diff_rows(row, other) == []
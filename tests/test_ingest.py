@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+from conftest import astrom_file, make_header, raw_file, upsert
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from blaauw.core import ingest, models
+
+
+def test_reingest_writes_nothing(engine, roots):
+    headers = [make_header(raw_file(roots, i)) for i in range(10)]
+    assert upsert(engine, headers)[1] == (10, 0, 0, 0)
+
+    with Session(engine) as session:
+        before = session.execute(select(models.Observation.updated_at)).all()
+    assert upsert(engine, headers)[1] == (0, 0, 10, 0)
+    with Session(engine) as session:
+        assert session.execute(select(models.Observation.updated_at)).all() == before
+        assert session.scalar(select(func.count(models.ObservationHistory.id))) == 0
+
+
+def test_changed_row_is_updated(engine, roots):
+    headers = [make_header(raw_file(roots, i)) for i in range(10)]
+    upsert(engine, headers)
+
+    headers[3] = make_header(raw_file(roots, 3), FILTER="V")
+    assert upsert(engine, headers)[1] == (0, 1, 9, 0)
+    with Session(engine) as session:
+        changes = session.scalars(select(models.ObservationHistory)).all()
+        assert [(c.field, c.old_value, c.new_value) for c in changes] == [
+            ("filter", "i", "V")
+        ]
+
+
+def test_duplicates_are_not_updates(engine, roots):
+    # The astrometry frame of a raw frame has the same file_id, the last one wins
+    headers = [make_header(raw_file(roots, i)) for i in range(3)]
+    headers.append(make_header(astrom_file(roots, 1)))
+    assert upsert(engine, headers)[1] == (3, 0, 0, 1)
+
+    with Session(engine) as session:
+        obs = session.scalars(
+            select(models.Observation).where(models.Observation.has_wcs)
+        ).one()
+        assert obs.filename == str(astrom_file(roots, 1))
+        assert obs.raw_filename == str(raw_file(roots, 1))
+
+
+def test_pixel_stats_are_kept(engine, roots):
+    upsert(engine, [make_header(raw_file(roots, 0), PIX_MEDIAN=1200.0)])
+    # A crawl without --stats has no pixel statistics
+    assert upsert(engine, [make_header(raw_file(roots, 0))])[1] == (0, 0, 1, 0)
+    with Session(engine) as session:
+        assert session.scalar(select(models.Observation.pixel_median)) == 1200.0
+
+
+def test_later_batches_take_precedence(engine, roots):
+    batches = [
+        [make_header(raw_file(roots, i)) for i in range(5)],
+        [make_header(raw_file(roots, 2), OBJECT="M31")],
+    ]
+    ingest.insert_header_batches(batches, engine, source="test", workers=4)
+
+    with Session(engine) as session:
+        objects = session.scalars(
+            select(models.Observation.target_object).order_by(
+                models.Observation.file_id
+            )
+        ).all()
+        assert objects == ["M42", "M42", "M31", "M42", "M42"]
+        assert session.scalar(select(func.count(models.ObservationHeader.observation_id))) == 5
+
+
+def test_partitions_keep_file_ids_together(roots):
+    headers = [make_header(raw_file(roots, i % 7)) for i in range(30)]
+    partitions = ingest.partition_headers(headers, 4)
+
+    assert sum(len(p) for p in partitions) == len(headers)
+    for partition in partitions:
+        # Same order as in the input
+        assert partition == [h for h in headers if h in partition]
+    names = [{h["FILENAME"] for h in p} for p in partitions]
+    for i, a in enumerate(names):
+        for b in names[i + 1 :]:
+            assert a.isdisjoint(b)
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import datetime as dt
+
+from blaauw.core.logsheets import (
+    assign_windows,
+    interval_join,
+    link_observations,
+    night_start,
+    parse_row_time,
+)
+
+NIGHT = dt.date(2016, 2, 16)
+
+
+def row(row_id, time, sheet="sheet1.jpg"):
+    return {
+        "id": row_id,
+        "obs_date": NIGHT,
+        "logsheet_file": sheet,
+        "start_time": parse_row_time(time, NIGHT),
+        "end_time": None,
+    }
+
+
+def at(hour, minute=0, day=16):
+    return dt.datetime(2016, 2, day, hour, minute)
+
+
+def test_parse_row_time():
+    assert parse_row_time("21:34", NIGHT) == at(21, 34)
+    # After midnight belongs to the next day
+    assert parse_row_time("02h10", NIGHT) == at(2, 10, day=17)
+    assert parse_row_time("no time", NIGHT) is None
+
+
+def test_assign_windows():
+    rows = [row(1, "20:00"), row(2, "21:00"), row(3, "21:00"), row(4, "22:00")]
+    rows.append(row(5, "20:30", sheet="sheet2.jpg"))
+    rows.append(row(6, None))
+    assign_windows(rows)
+
+    end_of_night = night_start(NIGHT + dt.timedelta(days=1))
+    windows = {r["id"]: (r["start_time"], r["end_time"]) for r in rows}
+    assert windows == {
+        1: (at(20), at(21)),
+        # Rows with the same time share the window
+        2: (at(21), at(22)),
+        3: (at(21), at(22)),
+        4: (at(22), end_of_night),
+        5: (at(20, 30), end_of_night),
+        6: (None, None),
+    }
+
+
+def test_interval_join():
+    windows = [(at(20), at(21), 1), (at(20, 30), at(22), 2), (at(22), at(23), 3)]
+    observations = [(at(19), 10), (at(20, 45), 11), (at(21, 30), 12), (at(23), 13)]
+    assert interval_join(windows, observations) == [(11, 1), (11, 2), (12, 2)]
+
+
+def test_link_observations():
+    rows = [row(1, "20:00"), row(2, "20:00"), row(3, "21:00")]
+    assign_windows(rows)
+    observations = [(at(20, 15), 10), (at(21, 15), 11), (at(20, 15, day=17), 12)]
+    assert sorted(link_observations(rows, observations)) == [(10, 1), (10, 2), (11, 3)]
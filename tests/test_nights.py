@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import datetime as dt
+import os
+import time
+
+from blaauw.core.nights import NightCatalog, parse_night
+
+
+def make_files(directory, names):
+    directory.mkdir(parents=True, exist_ok=True)
+    for name in names:
+        (directory / name).write_bytes(b"x" * 10)
+
+
+def age(path, seconds: float = 60):
+    """Sets the modification times of the directories in the past, so they are
+    stable (see dirtree.stable_mtime)."""
+    past = time.time() - seconds
+    for directory, _, _ in os.walk(path):
+        os.utime(directory, (past, past))
+
+
+def test_parse_night():
+    assert parse_night("160216") == dt.date(2016, 2, 16)
+    assert parse_night("2016-02-16") == dt.date(2016, 2, 16)
+    assert parse_night("20160216") == dt.date(2016, 2, 16)
+    assert parse_night("2222-22-22") is None
+    assert parse_night("calibration") is None
+
+
+def test_refresh(tmp_path):
+    base_dir = tmp_path / "images"
+    make_files(base_dir / "160216" / "STL-6303E" / "i", ["a.fits", "b.fits"])
+    make_files(base_dir / "160217", ["c.fits", "notes.txt"])
+    make_files(base_dir / "calibration", ["d.fits"])
+    age(base_dir)
+
+    catalog = NightCatalog(base_dir)
+    assert catalog.refresh()
+    nights = {n.name: (n.num_files, n.num_bytes) for n in catalog.select()}
+    assert nights == {"160216": (2, 20), "160217": (1, 10)}
+    assert not catalog.refresh()
+
+    catalog_file = tmp_path / "nights.json"
+    catalog.save(catalog_file)
+    assert NightCatalog.load(catalog_file, base_dir).nights == catalog.nights
+
+
+def test_refresh_nights_sees_subdirectories(tmp_path):
+    base_dir = tmp_path / "images"
+    make_files(base_dir / "160216" / "STL-6303E" / "i", ["a.fits", "b.fits"])
+    age(base_dir)
+    catalog = NightCatalog(base_dir)
+    catalog.refresh()
+
+    # Only changes the modification time of the subdirectory
+    make_files(base_dir / "160216" / "STL-6303E" / "i", ["c.fits"])
+    age(base_dir / "160216" / "STL-6303E" / "i", seconds=30)
+    assert not catalog.refresh()
+    [night] = catalog.refresh_nights(catalog.select(dt.date(2016, 2, 16)))
+    assert night.num_files == 3
+    assert catalog.nights["160216"] == night
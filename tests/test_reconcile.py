@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import argparse
+
+import pytest
+import reconcile
+from conftest import astrom_file, make_header, raw_file, upsert
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from blaauw.core import models
+from blaauw.core.paths import Root
+from blaauw.core.reconcile import merge_diff, mounted_roots, walk_sorted
+
+
+def touch(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+
+
+def reconcile_args(engine, **kwargs) -> argparse.Namespace:
+    args = dict(root=None, delete=False, dry_run=False, dsn=str(engine.url), echo=False)
+    return argparse.Namespace(**{**args, **kwargs})
+
+
+def stored(engine):
+    """filename -> whether it is missing, of all observations"""
+    with Session(engine) as session:
+        rows = session.execute(
+            select(models.Observation.filename, models.Observation.missing_since)
+        )
+        return {filename: missing is not None for filename, missing in rows}
+
+
+def test_merge_diff():
+    disk = ["a", "b", "d"]
+    db = [("b", 2), ("c", 3), ("d", 4)]
+    assert list(merge_diff(disk, db)) == [("a", None), ("b", 2), (None, 3), ("d", 4)]
+
+
+def test_walk_sorted(tmp_path):
+    for name in ["b.fits", "a/b.fits", "a/b/c.fits", "a-b.fits", "a/notes.txt"]:
+        touch(tmp_path / name)
+    found = [path[len(str(tmp_path)) + 1 :] for path in walk_sorted(str(tmp_path))]
+    assert found == ["a-b.fits", "a/b.fits", "a/b/c.fits", "b.fits"]
+    assert found == sorted(found)
+
+    with pytest.raises(OSError):
+        list(walk_sorted(str(tmp_path / "gone")))
+
+
+def test_mounted_roots(tmp_path):
+    full = Root("FULL", tmp_path / "full", None)
+    empty = Root("EMPTY", tmp_path / "empty", None)
+    gone = Root("GONE", tmp_path / "gone", None)
+    touch(full.path / "160216" / "a.fits")
+    empty.path.mkdir()
+    assert mounted_roots([full, empty, gone]) == ([full], [empty, gone])
+
+
+def test_reconcile(engine, roots):
+    headers = [make_header(raw_file(roots, i)) for i in range(4)]
+    upsert(engine, headers)
+    touch(raw_file(roots, 0))
+    # Moved to another directory of the same root
+    moved = roots[0].path / "160216" / "STL-6303E" / "V" / raw_file(roots, 2).name
+    touch(moved)
+    # The astrometry frame of a removed raw frame is not a move of that frame
+    touch(astrom_file(roots, 3))
+
+    reconcile.main(reconcile_args(engine))
+    assert stored(engine) == {
+        str(raw_file(roots, 0)): False,
+        str(raw_file(roots, 1)): True,
+        str(moved): False,
+        str(raw_file(roots, 3)): True,
+    }
+
+    # Reappeared
+    touch(raw_file(roots, 1))
+    reconcile.main(reconcile_args(engine))
+    assert stored(engine)[str(raw_file(roots, 1))] is False
+
+    reconcile.main(reconcile_args(engine, delete=True))
+    assert str(raw_file(roots, 3)) not in stored(engine)
+
+
+def test_reconcile_skips_unmounted_roots(engine, roots):
+    upsert(engine, [make_header(raw_file(roots, 0)), make_header(astrom_file(roots, 1))])
+    touch(raw_file(roots, 0))
+
+    reconcile.main(reconcile_args(engine))
+    assert stored(engine) == {
+        str(raw_file(roots, 0)): False,
+        str(astrom_file(roots, 1)): False,
+    }
@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+# Entry points which should start without these (slow) modules
+ENTRY_POINTS = {"crawler": ("astropy",), "insert": ("astropy",)}
+# Seconds an entry point may take to import
+IMPORT_BUDGET = 1.0
+
+# Run in a fresh interpreter, so nothing is imported yet
+_IMPORT_CODE = """
+import importlib, json, sys, time
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "modules": sorted({name.split(".")[0] for name in sys.modules}),
+}))
+"""
+
+
+def import_time(module: str) -> dict:
+    """The import time of the module and the (top level) modules it imported."""
+    result = subprocess.run(
+        [sys.executable, "-c", _IMPORT_CODE, module],
+        cwd=Path(__file__).resolve().parents[1],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout)
+
+
+@pytest.mark.parametrize("module", list(ENTRY_POINTS))
+def test_startup_time(module):
+    found = import_time(module)
+    assert found["seconds"] <= IMPORT_BUDGET
+    for name in ENTRY_POINTS[module]:
+        assert name not in found["modules"], f"{module} imports {name} at startup"